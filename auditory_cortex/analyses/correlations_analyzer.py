@@ -11,6 +11,7 @@ from auditory_cortex.neural_data import NormalizerCalculator
 from auditory_cortex.neural_data import create_neural_metadata
 from auditory_cortex.plotters.plotter_utils import PlotterUtils
 from auditory_cortex import saved_corr_dir, aux_dir, valid_model_names
+from auditory_cortex.io_utils.results_store import ResultsStore
 
 import logging
 logger = logging.getLogger(__name__)
@@ -42,7 +43,11 @@ class BaseCorrelations(ABC):
         self.metadata = create_neural_metadata(self.dataset_name)
         self.norm_obj = NormalizerCalculator(self.dataset_name)
 
-        self.data = pd.read_csv(self.corr_file_path)
+        # merged view of csv file and rows appended by runs..
+        self.results_store = ResultsStore(self.corr_file_path)
+        self.data = self.results_store.read()
+        if self.data is None:
+            raise FileNotFoundError(f"No results found for: {self.corr_file_path}")
 
 
 
@@ -71,6 +76,51 @@ class BaseCorrelations(ABC):
 
 
     # ---------------- methods using normalizer dist. using all-possible-pairs (app) ---------#
+    def get_normalizers_table(self, mVocs=False, norm_bin_width=None):
+        """Returns table of normalizers for all (session, bin_width, channel) of
+        the results, computed from the cached distributions. Distributions of
+        each (session, bin_width) are read once.
+
+        Args:
+            mVocs: bool = If True, normalizers for monkey vocalizations.
+            norm_bin_width: int = bin width in ms, if specified normalizers at this
+                bin width are used for all bin widths.
+
+        Returns:
+            pd.DataFrame = columns (session, bin_width, channel, normalizer, null_mean, null_std)
+        """
+        keys = ['session', 'bin_width', 'channel']
+        tables = []
+        stats = {}
+        for (session, bin_width), channels in self.data.groupby(['session', 'bin_width'])['channel']:
+            bw_norm = bin_width if norm_bin_width is None else norm_bin_width
+            if (session, bw_norm) not in stats:
+                norm_dist, null_dist = self.norm_obj.get_inter_trial_corr_dists_for_session(
+                    session=session, bin_width=bw_norm, mVocs=mVocs,
+                    )
+                ch_ids = list(norm_dist.keys())
+                norm_dist = np.stack([norm_dist[ch] for ch in ch_ids])
+                null_dist = np.stack([null_dist[ch] for ch in ch_ids])
+                stats[(session, bw_norm)] = pd.DataFrame({
+                    'channel': ch_ids,
+                    'normalizer': np.mean(norm_dist, axis=1),
+                    'null_mean': np.mean(null_dist, axis=1),
+                    'null_std': np.std(null_dist, axis=1),
+                    })
+            table = stats[(session, bw_norm)]
+            missing = np.setdiff1d(channels.unique(), table['channel'])
+            if len(missing) > 0:
+                logger.warning(f"No normalizer for sess-{session}, bw-{bw_norm}, channels: {missing}")
+            table = table[table['channel'].isin(channels.unique())].copy()
+            table['session'] = session
+            table['bin_width'] = bin_width
+            tables.append(table)
+        if len(tables) == 0:
+            return pd.DataFrame(columns=keys+['normalizer', 'null_mean', 'null_std'])
+        norm_table = pd.concat(tables, ignore_index=True)
+        norm_table['channel'] = norm_table['channel'].astype(self.data['channel'].dtype)
+        return norm_table[keys+['normalizer', 'null_mean', 'null_std']]
+
     def set_normalizers_using_bootsrap(self, mVocs=False, norm_bin_width=None, verbose=False):
         """Reads normalizer distributions (both True & Null) from the memory and
         incorporates them to the current file by following steps:
@@ -102,51 +152,25 @@ class BaseCorrelations(ABC):
             null_mean_col = 'mVocs_'+null_mean_col
             null_std_col = 'mVocs_'+null_std_col
 
-        bin_widths = self.data['bin_width'].unique()
-        for bin_width in bin_widths:
-            select_data = self.get_selected_data(bin_width=bin_width)
-            sessions = select_data['session'].unique()
-            for session in sessions:
-                # for delay in delays:
-                select_data = self.get_selected_data(
-                    sessions=[session], bin_width=bin_width, #delay=delay
-                )
-                channels = select_data['channel'].unique()
-
-                # reading the normalizer...
-                if norm_bin_width is None:
-                    bw_norm = bin_width
-                else:
-                    bw_norm = norm_bin_width
-
-                norm_dist, null_dist = self.norm_obj.get_inter_trial_corr_dists_for_session(
-                    session=session, bin_width=bw_norm, mVocs=mVocs,
-                    )
-
-                for ch in channels:
-
-                    ch_normalizer = np.mean(norm_dist[ch])
-                    ch_null_mean = np.mean(null_dist[ch])
-                    ch_null_std = np.std(null_dist[ch])
-
-                    ids = select_data[select_data['channel']==ch].index
-                    self.data.loc[ids, normalizer_col] = ch_normalizer
-                    self.data.loc[ids, null_mean_col] = ch_null_mean
-                    self.data.loc[ids, null_std_col] = ch_null_std 
+        # one row per (session, bin_width, channel), joined with results in a single merge..
+        norm_table = self.get_normalizers_table(mVocs=mVocs, norm_bin_width=norm_bin_width)
+        norm_table = norm_table.rename(columns={
+            'normalizer': normalizer_col, 'null_mean': null_mean_col, 'null_std': null_std_col,
+            })
+        keys = ['session', 'bin_width', 'channel']
+        data = self.data.drop(columns=[normalizer_col, null_mean_col, null_std_col], errors='ignore')
+        data = data.merge(norm_table, how='left', on=keys, validate='many_to_one')
+        data.index = self.data.index
+        # keep the column order of the results..
+        columns = list(self.data.columns) + [col for col in data.columns if col not in self.data.columns]
+        self.data = data[columns]
 
         if 'layer_type' not in self.data.columns and self.model_name is not None:
             config = utils.load_dnn_config(self.model_name)
-            num_layers = len(config['layers'])
-            layer_types = {
-                config['layers'][i]['layer_id']: config['layers'][i]['layer_type'] 
-                for i in range(num_layers)
-                }
-            for layer_id in layer_types.keys():
-                layer_type = layer_types[layer_id]
-                ids = self.data[self.data['layer']==layer_id].index
-                self.data.loc[ids, 'layer_type'] = layer_type
-
-        self.data[norm_corr_col] = self.data[raw_corr_col]/(self.data[normalizer_col].apply(np.sqrt))
+            layer_types = {layer['layer_id']: layer['layer_type'] for layer in config['layers']}
+            self.data['layer_type'] = self.data['layer'].map(layer_types)
+
+        self.data[norm_corr_col] = self.data[raw_corr_col]/np.sqrt(self.data[normalizer_col])
         logger.info(f"Columns: '{normalizer_col}', '{raw_corr_col}', '{norm_corr_col}' updated using normalizer (random pairs) dist, writing back now...")
         self.write_back()
         #                 self.data.loc[ids, 'normalizer'] = ch_normalizer 
@@ -186,7 +210,7 @@ class BaseCorrelations(ABC):
     def write_back(self):
         """Saves the updated dataframe to disk.
         """
-        self.data.to_csv(self.corr_file_path, index=False)
+        self.results_store.consolidate(self.data)
         logger.info(f"Saved at {self.corr_file_path}")
 
     def get_filepath(self):
@@ -885,7 +909,10 @@ class Correlations(BaseCorrelations):
             model = model_name 
         filename = f"{model}_corr_results.csv"
         file_path = os.path.join(saved_corr_dir, filename)
-        data = pd.read_csv(file_path)
+        results_store = ResultsStore(file_path)
+        data = results_store.read()
+        if data is None:
+            raise FileNotFoundError(f"No results found for: {file_path}")
         logger.info(f"reading from {file_path}")
 
         # remove 'Unnamed' columns
@@ -897,5 +924,5 @@ class Correlations(BaseCorrelations):
             data.loc[ids, 'layer_type'] = type
 
         logger.info("Writing back...!")
-        data.to_csv(file_path, index=False)
+        results_store.consolidate(data)
 
@@ -0,0 +1,158 @@
+"""
+Array backend for the linear algebra of the encoding models.
+
+cupy is an optional accelerator, encoding models run on NumPy (threaded BLAS
+and scipy.linalg) when cupy is not installed or no GPU is present. The backend
+is picked in the following order:
+    - 'backend' argument passed to the model, ('numpy', 'cupy' or None)
+    - environment variable AC_ARRAY_BACKEND,
+    - 'array_backend' setting in config.yml,
+    - cupy if a GPU is available, numpy otherwise.
+
+Functions:
+    gpu_available():
+        True if cupy is installed and at least one GPU is visible.
+
+    get_backend(name=None):
+        Returns the array module (numpy or cupy) for the given backend name.
+
+    get_array_module(x):
+        Returns the array module the array x lives on.
+
+    to_device(x, xp, dtype=None):
+        Moves x to the device of array module xp, no copy if already there.
+
+    to_numpy(x):
+        Moves x to host memory, no copy if already there.
+
+    solve_pos(A, B):
+        Solves A X = B for symmetric positive definite A (Cholesky based on CPU).
+
+    eigh(A):
+        Eigendecomposition of the symmetric matrix A.
+"""
+
+import os
+import numpy as np
+import scipy.linalg
+
+from auditory_cortex import config
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import cupy as cp
+except ImportError:
+    cp = None
+
+VALID_BACKENDS = ['numpy', 'cupy']
+_gpu_available = None
+
+
+def gpu_available():
+    """Returns True if cupy is installed and at least one GPU is visible."""
+    global _gpu_available
+    if _gpu_available is None:
+        _gpu_available = False
+        if cp is not None:
+            try:
+                _gpu_available = cp.cuda.runtime.getDeviceCount() > 0
+            except Exception:
+                _gpu_available = False
+    return _gpu_available
+
+
+def get_backend(name=None):
+    """Returns the array module for the backend name.
+
+    Args:
+        name: str = one of ['numpy', 'cupy'], if None, uses AC_ARRAY_BACKEND
+            environment variable or 'array_backend' of config, and falls back to
+            cupy when a GPU is available and numpy otherwise.
+
+    Returns:
+        module: numpy or cupy
+    """
+    if name is None:
+        name = os.environ.get('AC_ARRAY_BACKEND', config.get('array_backend', None))
+    if name is None or name == 'auto':
+        name = 'cupy' if gpu_available() else 'numpy'
+    if name not in VALID_BACKENDS:
+        raise ValueError(f"Invalid backend='{name}', choose from {VALID_BACKENDS}.")
+    if name == 'cupy':
+        if not gpu_available():
+            raise RuntimeError(f"Backend 'cupy' requested, but cupy/GPU is not available.")
+        return cp
+    return np
+
+
+def get_array_module(x):
+    """Returns the array module (numpy or cupy) the array x lives on."""
+    if cp is not None and isinstance(x, cp.ndarray):
+        return cp
+    return np
+
+
+def to_device(x, xp, dtype=None):
+    """Moves array x to the device of array module xp,
+    without copying if x already lives there (and has the dtype).
+
+    Args:
+        x: ndarray = numpy or cupy array.
+        xp: module = numpy or cupy
+        dtype: dtype = optional dtype of the returned array.
+    """
+    if xp is np:
+        x = to_numpy(x)
+        return x if dtype is None else x.astype(dtype, copy=False)
+    return cp.asarray(x, dtype=dtype)
+
+
+def to_numpy(x):
+    """Returns x as numpy array, copies to host only for device arrays."""
+    if cp is not None and isinstance(x, cp.ndarray):
+        return cp.asnumpy(x)
+    return np.asarray(x)
+
+
+def solve_pos(A, B):
+    """Solves A X = B for symmetric positive definite A,
+    using Cholesky factorization on CPU and cupy solver on GPU.
+
+    Args:
+        A: ndarray = (N,N) or (L,N,N) left-hand side array.
+        B: ndarray = (N,K) or (L,N,K) right-hand side array.
+
+    Returns:
+        X: ndarray = same shape as B.
+    """
+    xp = get_array_module(A)
+    if xp is not np:
+        return xp.linalg.solve(A, B)
+    if A.ndim == 2:
+        return _solve_pos_np(A, B)
+    return np.stack([_solve_pos_np(a, b) for a, b in zip(A, B)], axis=0)
+
+
+def _solve_pos_np(A, B):
+    """Solves using Cholesky factorization, falls back to LU
+    if A is numerically not positive definite (e.g. lmbda=0)."""
+    try:
+        return scipy.linalg.solve(A, B, assume_a='pos', check_finite=False)
+    except np.linalg.LinAlgError:
+        logger.warning(f"Matrix not positive definite, using generic solver.")
+        return scipy.linalg.solve(A, B, check_finite=False)
+
+
+def eigh(A):
+    """Eigendecomposition of the symmetric matrix A.
+
+    Returns:
+        eig_vals: ndarray = (N,) in ascending order.
+        eig_vecs: ndarray = (N,N) columns are eigenvectors.
+    """
+    xp = get_array_module(A)
+    if xp is not np:
+        return xp.linalg.eigh(A)
+    return scipy.linalg.eigh(A, check_finite=False)
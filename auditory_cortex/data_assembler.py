@@ -352,7 +352,7 @@ class DNNDataAssembler(BaseDataAssembler):
         all_layer_features = self.dataloader.get_resampled_DNN_features(
             bin_width=self.bin_width, mVocs=self.mVocs, 
             LPF=self.LPF, LPF_analysis_bw=self.LPF_analysis_bw,
-            force_reload=self.force_reload,
+            force_reload=self.force_reload, layer_ids=[self.layer_id],
             )
         layer_features = all_layer_features[self.layer_id]
         return layer_features
@@ -403,7 +403,7 @@ class DNNAllLayerAssembler(BaseDataAssembler):
         all_layer_features = self.dataloader.get_resampled_DNN_features(
             bin_width=self.bin_width, mVocs=self.mVocs, 
             LPF=self.LPF, LPF_analysis_bw=self.LPF_analysis_bw,
-            force_reload=self.force_reload,
+            force_reload=self.force_reload, layer_ids=self.layer_ids,
             )
         
         stim_ids = list(all_layer_features[self.layer_ids[0]].keys())
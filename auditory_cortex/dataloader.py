@@ -14,6 +14,8 @@ from memory_profiler import profile
 
 from auditory_cortex.io_utils import io
 from auditory_cortex import config
+from auditory_cortex import feature_server
+from auditory_cortex.neural_data.audio_store import resample_audio
 
 
 # from auditory_cortex.io_utils.io import read_cached_spikes, write_cached_spikes
@@ -60,6 +62,45 @@ class DataLoader:
         """Return audio for stimulus (timit or mVocs) id"""
         return self.dataset_obj.get_stim_audio(stim_id, mVocs=mVocs)
     
+    def get_stim_audios(self, stim_ids, mVocs=False, sampling_rate=None):
+        """Returns audios of the stimuli, resampled at sampling_rate.
+        Resampled audios are read from the audio bank on disk (if 'audio_bank'
+        of config is set), stimuli missing from the bank are resampled and 
+        added to it, so resampling is done once per dataset.
+
+        Args:
+            stim_ids: list = stimulus ids.
+            sampling_rate: int = sampling rate (Hz), native sampling rate if None.
+
+        Returns:
+            dict: {stim_id: audio}
+        """
+        native_rate = self.get_sampling_rate(mVocs)
+        if sampling_rate is None or sampling_rate == native_rate:
+            return {stim_id: self.get_stim_audio(stim_id, mVocs=mVocs) for stim_id in stim_ids}
+        use_bank = config.get('audio_bank', False)
+        dataset_name = self.dataset_obj.dataset_name
+        bank = None
+        if use_bank:
+            bank = io.read_audio_bank(dataset_name, sampling_rate, mVocs=mVocs)
+        if bank is None:
+            bank = {}
+        missing = [stim_id for stim_id in stim_ids if stim_id not in bank]
+        resampled = {
+            stim_id: resample_audio(self.get_stim_audio(stim_id, mVocs=mVocs), native_rate, sampling_rate)
+            for stim_id in missing
+            }
+        if use_bank and len(missing) > 0:
+            logger.info(f"Adding {len(missing)} stimuli to the audio bank ({sampling_rate} Hz)...")
+            audios = {**bank, **resampled}
+            io.write_audio_bank(audios, dataset_name, sampling_rate, mVocs=mVocs)
+            # bank may be replaced by a concurrent run, in-memory audios are the fallback..
+            bank = io.read_audio_bank(dataset_name, sampling_rate, mVocs=mVocs)
+            if bank is None:
+                bank = {}
+            return {stim_id: bank[stim_id] if stim_id in bank else audios[stim_id] for stim_id in stim_ids}
+        return {stim_id: bank[stim_id] if stim_id in bank else resampled[stim_id] for stim_id in stim_ids}
+
     def get_stim_duration(self, stim_id, mVocs=False):
         """Return duration for stimulus (timit or mVocs) id"""
         return self.dataset_obj.get_stim_duration(stim_id, mVocs=mVocs)
@@ -150,70 +191,173 @@ class DataLoader:
         return self.num_channels
 
     def get_raw_DNN_features(
-            self, mVocs=False, force_reload=False, contextualized=False, scale_factor=None
+            self, mVocs=False, force_reload=False, contextualized=False, scale_factor=None,
+            layer_ids=None, cache_dtype=None, rebuild=False,
         ):
         """Retrieves raw features, starts by attempting to read cached features,
         if not found, extract features and also cache them, for future use.
+        Cached features are memory-mapped, only the layers requested are read.
 
         Args:
             model_name: str = assigned name of DNN model of interest.
-            force_reload: bool = Force reload features, even if cached already..Default=False.
+            force_reload: bool = If True, checks cached features against the manifest and 
+                extracts features of stimuli missing or stale (see update_cached_features). Default=False.
             shuffled: bool = If True, loads features for shuffled network.
             contextualized: bool = If True, extracts 'contextualized' features. Deprecated.
             scale_factor: float = If not None, scales the network weights by this factor.
+            layer_ids: list = layers to return, returns all layers if None.
+            cache_dtype: str = dtype of the cached features ('float32' or 'float16'),
+                if None, uses 'feature_cache_dtype' of config.
+            rebuild: bool = If True (with force_reload), extracts features of all stimuli.
 
         Returns:
-            raw_features: list of dict = 
+            raw_features: dict of dict = {layer_id: {stim_id: features}}
         """
         if self.feature_extractor is None:
             raise ValueError("Feature extractor object is not available.")
         model_name = self.feature_extractor.model_name
         shuffled = self.feature_extractor.shuffled
         if not force_reload:
-            raw_DNN_features = io.read_cached_features(
-                model_name, dataset_name=self.dataset_obj.dataset_name,
-                contextualized=contextualized,
-                shuffled=shuffled, mVocs=mVocs,
-                )
+            raw_DNN_features = None
+            if layer_ids is not None and not contextualized:
+                # features served in shared memory (see feature_server)..
+                raw_DNN_features = feature_server.attach_features(
+                    model_name, self.dataset_obj.dataset_name, layer_ids, shuffled=shuffled, mVocs=mVocs,
+                    )
+                if len(raw_DNN_features) < len(layer_ids):
+                    raw_DNN_features = None
+            if raw_DNN_features is None:
+                raw_DNN_features = io.read_cached_features(
+                    model_name, dataset_name=self.dataset_obj.dataset_name,
+                    contextualized=contextualized,
+                    shuffled=shuffled, mVocs=mVocs, layer_ids=layer_ids,
+                    )
         if force_reload or raw_DNN_features is None:
             training_stim_ids = self.get_training_stim_ids(mVocs)
             testing_stim_ids = self.get_testing_stim_ids(mVocs)
             all_stim_ids = np.concatenate([training_stim_ids, testing_stim_ids])
-            stim_audios = {}
-            stim_durations = {}
-            for stim_id in all_stim_ids:
-                stim_audios[stim_id] = self.get_stim_audio(stim_id, mVocs=mVocs)
-                stim_durations[stim_id] = self.get_stim_duration(stim_id, mVocs=mVocs)
-
             sampling_rate = self.get_sampling_rate(mVocs)
             if contextualized:	# deprecated...
                 long_audio, total_duration, *_ = self.get_contextualized_stim_audio(include_repeated_trials=True)
                 raw_DNN_features = self.get_DNN_obj(
                     model_name, shuffled=shuffled, scale_factor=scale_factor
                     ).extract_features_for_audio(long_audio, total_duration)
+                # cache features for future use...
+                io.write_cached_features(
+                    model_name, raw_DNN_features, dataset_name=self.dataset_obj.dataset_name,
+                    contextualized=contextualized, shuffled=shuffled, mVocs=mVocs,
+                    dtype=cache_dtype,
+                    )
             else:
-                logger.info(f"Extracting DNN features for '{model_name}'...")
-                raw_DNN_features = self.feature_extractor.extract_features(
-                    stim_audios, sampling_rate, stim_durations, self.pad_time
+                raw_DNN_features = self.update_cached_features(
+                    all_stim_ids, mVocs=mVocs, rebuild=rebuild, cache_dtype=cache_dtype,
                     )
-                
-
-            # delete temporary variables to avoid memory issues
-            del stim_audios, stim_durations
-            collected = gc.collect()
-            logger.info(f"Garbage collector: collected {collected} objects.")
-            # cache features for future use...
-            io.write_cached_features(
-                model_name, raw_DNN_features, dataset_name=self.dataset_obj.dataset_name,
-                contextualized=contextualized, shuffled=shuffled, mVocs=mVocs
-                )
+            if layer_ids is not None:
+                raw_DNN_features = {layer_id: raw_DNN_features[layer_id] for layer_id in layer_ids}
         return raw_DNN_features
     
+    def update_cached_features(self, stim_ids, mVocs=False, rebuild=False, cache_dtype=None):
+        """Brings the cached (raw) features up to date for stim_ids, and returns them.
+        An entry (stimulus) of the cache is valid if the hash of its audio, fingerprint 
+        of the feature extractor and pad_time match the manifest (see io.read_features_manifest). 
+        Only missing or stale entries are extracted, valid entries are copied over, 
+        features of each stimulus are written out as soon as available, and 
+        an interrupted run is resumed.
+
+        Args:
+            stim_ids: list = stimuli to be cached.
+            rebuild: bool = If True, extracts features of all stimuli.
+            cache_dtype: str = dtype of the cached features.
+
+        Returns:
+            raw_features: dict of dict = {layer_id: {stim_id: features}}, memory-mapped.
+        """
+        model_name = self.feature_extractor.model_name
+        shuffled = self.feature_extractor.shuffled
+        dataset_name = self.dataset_obj.dataset_name
+        layer_ids = self.feature_extractor.layer_ids
+        sampling_rate = self.get_sampling_rate(mVocs)
+        if config.get('audio_bank', False):
+            # audios already resampled for the extractor (see get_stim_audios)..
+            sampling_rate = self.feature_extractor.sampling_rate
+        extractor_fingerprint = self.feature_extractor.fingerprint()
+
+        stim_audios = self.get_stim_audios(stim_ids, mVocs=mVocs, sampling_rate=sampling_rate)
+        stim_info = {}
+        for stim_id in stim_ids:
+            stim_info[stim_id] = {
+                'audio': io.audio_fingerprint(stim_audios[stim_id], sampling_rate),
+                'extractor': extractor_fingerprint, 'pad_time': self.pad_time,
+                }
+        manifest, cached_features = {}, None
+        if not rebuild:
+            manifest = io.read_features_manifest(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+            cached_features = io.read_cached_features(
+                model_name, dataset_name=dataset_name, shuffled=shuffled, mVocs=mVocs, layer_ids=layer_ids,
+                )
+        cached_stim_ids = set() if cached_features is None else set.intersection(
+            *[set(layer_features.keys()) for layer_features in cached_features.values()]
+            )
+        valid_stim_ids = [
+            stim_id for stim_id in stim_ids
+            if stim_id in cached_stim_ids and manifest.get(str(stim_id)) == stim_info[stim_id]
+            ]
+        if len(valid_stim_ids) == len(stim_ids) and not io.is_features_caching_interrupted(
+                model_name, dataset_name, shuffled=shuffled, mVocs=mVocs
+            ):
+            logger.info(f"Cached features of '{model_name}' are up to date.")
+            return cached_features
+
+        writer = io.open_cached_features_writer(
+            model_name, dataset_name=dataset_name, layer_ids=layer_ids, shuffled=shuffled,
+            mVocs=mVocs, dtype=cache_dtype,
+            )
+        if any([writer.stim_info.get(str(stim_id)) != stim_info.get(stim_id) for stim_id in writer.stim_ids]):
+            logger.info(f"Interrupted run was for different audio or extractor, starting over.")
+            writer.close()
+            writer = io.open_cached_features_writer(
+                model_name, dataset_name=dataset_name, layer_ids=layer_ids, shuffled=shuffled,
+                mVocs=mVocs, dtype=cache_dtype, resume=False,
+                )
+        done_stim_ids = writer.done_stim_ids
+        # valid entries are copied over, from the memory-mapped cache..
+        for stim_id in valid_stim_ids:
+            if stim_id not in done_stim_ids:
+                writer.append(
+                    stim_id, {layer_id: cached_features[layer_id][stim_id] for layer_id in layer_ids},
+                    info=stim_info[stim_id],
+                    )
+        pending_audios = {}
+        stim_durations = {}
+        for stim_id in stim_ids:
+            if stim_id in done_stim_ids or stim_id in valid_stim_ids:
+                continue
+            pending_audios[stim_id] = stim_audios[stim_id]
+            stim_durations[stim_id] = self.get_stim_duration(stim_id, mVocs=mVocs)
+        del stim_audios, cached_features
+
+        logger.info(f"Extracting DNN features for '{model_name}', {len(pending_audios)} stimuli...")
+        for stim_id, stim_features in self.feature_extractor.iter_features(
+                pending_audios, sampling_rate, stim_durations, self.pad_time
+            ):
+            writer.append(stim_id, stim_features, info=stim_info[stim_id])
+        writer.finalize()
+        io.write_features_manifest(
+            model_name, dataset_name, writer.stim_info, shuffled=shuffled, mVocs=mVocs
+            )
+        return io.read_cached_features(
+            model_name, dataset_name=dataset_name, shuffled=shuffled, mVocs=mVocs,
+            )
+
     def get_resampled_DNN_features(
             self, bin_width, mVocs=False, LPF=False, LPF_analysis_bw=20, force_reload=False, 
+            layer_ids=None,
         ):
         """
-        Retrieves resampled all DNN layer features to specific bin_width
+        Retrieves resampled all DNN layer features to specific bin_width.
+        Resampled features are also cached on disk (if 'cache_resampled_features' 
+        of config is True), keyed by (bin_width, LPF, pad_time) and invalidated 
+        when raw features of the layer are cached again.
 
         Args:
             bin_width (float): width of data samples in ms.
@@ -222,6 +366,7 @@ class DataLoader:
                 and resamples again at predefined bin-width (e.g. 10ms)
             LPF_analysis_bw: int = bin-width for LPF analysis in ms.
             force_reload: bool = Force reload features, even if cached already..Default=False.
+            layer_ids: list = layers to return, returns all layers if None.
         Returns:
             List of dict: all layer features (resampled at required sampling_rate).
                 {layer_id: {stim_id: features}}
@@ -247,13 +392,40 @@ class DataLoader:
 
         model_features = DNN_feature_dict[features_key]
         if bin_width not in model_features.keys() or force_reload:
-            raw_features = self.get_raw_DNN_features(mVocs=mVocs, force_reload=force_reload)
+            model_features[bin_width] = {}
+        if layer_ids is None:
+            layer_ids = self.get_layer_ids()
+        # resample only the layers not already resampled..
+        missing_layers = [layer_id for layer_id in layer_ids if layer_id not in model_features[bin_width]]
+
+        cache_kwargs = dict(
+            dataset_name=self.dataset_obj.dataset_name, bin_width=bin_width,
+            shuffled=self.feature_extractor.shuffled, mVocs=mVocs,
+            LPF=LPF, LPF_analysis_bw=LPF_analysis_bw, pad_time=self.pad_time,
+            )
+        if len(missing_layers) > 0 and not force_reload:
+            # features served in shared memory (see feature_server)..
+            model_features[bin_width].update(feature_server.attach_features(
+                model_name, layer_ids=missing_layers, **cache_kwargs
+                ))
+            missing_layers = [layer_id for layer_id in missing_layers if layer_id not in model_features[bin_width]]
+        use_disk_cache = config.get('cache_resampled_features', True)
+        if len(missing_layers) > 0 and use_disk_cache and not force_reload:
+            model_features[bin_width].update(io.read_resampled_features(
+                model_name, layer_ids=missing_layers, **cache_kwargs
+                ))
+            missing_layers = [layer_id for layer_id in missing_layers if layer_id not in model_features[bin_width]]
+
+        if len(missing_layers) > 0:
+            raw_features = self.get_raw_DNN_features(
+                mVocs=mVocs, force_reload=force_reload, layer_ids=missing_layers,
+                )
 
             resampled_features = {layer_id:{} for layer_id in raw_features.keys()}
             
-            layer_ids = list(raw_features.keys())
+            raw_layer_ids = list(raw_features.keys())
             # reads first 'value' to get list of sent_IDs
-            stim_ids = raw_features[layer_ids[0]].keys()
+            stim_ids = raw_features[raw_layer_ids[0]].keys()
 
             logger.info(f"Resamping ANN features at bin-width: {bin_width}")
             bin_width_sec = bin_width/1000 # ms
@@ -273,10 +445,10 @@ class DataLoader:
                         # extra number of bins because of padding..
                         n_final += self.dataset_obj.calculate_num_bins(self.pad_time, analysis_bw_sec)
 
-                for layer_id in layer_ids:
+                for layer_id in raw_layer_ids:
                     if bin_width == 1000:
                         # treat this as a special case, and sum all samples across time...
-                        tmp = np.sum(raw_features[layer_id][stim_id].numpy(), axis=0)[None, :]
+                        tmp = np.sum(np.asarray(raw_features[layer_id][stim_id]), axis=0)[None, :]
                     else:
                         tmp = signal.resample(raw_features[layer_id][stim_id], n, axis=0)
                         if LPF:
@@ -286,6 +458,12 @@ class DataLoader:
 
             if LPF:
                 logger.info(f"Resampled ANN features at LPF bin-width: {LPF_analysis_bw}")
-            DNN_feature_dict[features_key][bin_width] = resampled_features
-        return DNN_feature_dict[features_key][bin_width]
+            if use_disk_cache:
+                io.write_resampled_features(model_name, resampled_features, **cache_kwargs)
+                # read back (memory-mapped), so that features are identical to later runs..
+                resampled_features.update(io.read_resampled_features(
+                    model_name, layer_ids=raw_layer_ids, **cache_kwargs
+                    ))
+            model_features[bin_width].update(resampled_features)
+        return {layer_id: model_features[bin_width][layer_id] for layer_id in layer_ids}
 
@@ -1,13 +1,15 @@
 import os
 import gc
 import yaml
+import json
+import hashlib
 import torch
 import numpy as np
 from scipy.signal import resample
 from abc import ABC, abstractmethod
 
 from memory_profiler import profile
-from auditory_cortex import aux_dir
+from auditory_cortex import aux_dir, config as ac_config
 
 import logging
 logger = logging.getLogger(__name__)
@@ -42,6 +44,10 @@ def list_dnn_models():
 
 
 class BaseFeatureExtractor(ABC):
+    # True for models that give same features for a padded batch of stimuli,
+    # (implementing fwd_pass_batch), see extract_features.
+    supports_batching = False
+
     def __init__(self, model, config, shuffled=False, sampling_rate=16000) -> None:
         super().__init__()
         self.model = model
@@ -53,6 +59,7 @@ class BaseFeatureExtractor(ABC):
         self.layer_names, self.layer_ids, self.layer_types, self.receptive_fields = self.get_config_details()
         self.num_layers = len(self.layer_names)
         self.features = {}
+        self.batched = False
         self.register_hooks()
         
         if self.shuffled:
@@ -64,6 +71,42 @@ class BaseFeatureExtractor(ABC):
         """DNN specific forward pass method."""
         pass
 
+    def fwd_pass_batch(self, audios):
+        """DNN specific forward pass for a batch of stimuli, needed
+        only if supports_batching is True.
+
+        Args:
+            audios: list = list of 'wav' inputs of shape (t,), of different lengths.
+        """
+        raise NotImplementedError(f"Batched forward pass not implemented for '{self.model_name}'.")
+
+    def num_frames(self, layer_name, num_samples, padded_frames, padded_samples):
+        """Returns number of frames of the layer output for audio of num_samples,
+        used to unpad items of a batch. Default assumes constant frame rate
+        of the layer i.e. padded_frames/padded_samples, models override it
+        to give exact output lengths.
+
+        Args:
+            layer_name: str = name of the layer.
+            num_samples: int = true length of the audio.
+            padded_frames: int = number of frames of the layer for the padded batch.
+            padded_samples: int = length of the padded batch.
+        """
+        frames = int(np.ceil(num_samples*padded_frames/padded_samples))
+        return min(frames, padded_frames)
+
+
+    def fingerprint(self):
+        """Returns hash of the layer configuration and the weights of the
+        model, identifies the features extracted (e.g. changes for every 
+        randomly reset network)."""
+        digest = hashlib.sha1(json.dumps(self.config, sort_keys=True, default=str).encode())
+        digest.update(f"{self.model_name}-{self.sampling_rate}".encode())
+        with torch.no_grad():
+            for name, tensor in self.model.state_dict().items():
+                digest.update(name.encode())
+                digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+        return digest.hexdigest()
 
     def reset_model_parameters(self):
         """Reset weights of all the layers of the model.
@@ -109,7 +152,7 @@ class BaseFeatureExtractor(ABC):
                 param.data = param.data*self.scale_factor
 
 
-    def extract_features(self, stim_audios, sampling_rate, stim_durations=None, pad_time=None):
+    def extract_features(self, stim_audios, sampling_rate, stim_durations=None, pad_time=None, batch_size=None):
         """
         Returns raw features for all layers of the DNN..!
 
@@ -120,49 +163,114 @@ class BaseFeatureExtractor(ABC):
             stim_durations (dict): dictionary of sentence durations.
                 {stim_id: duration}
             pad_time (float): amount of padding time in seconds.
+            batch_size (int): number of stimuli forward passed together, stimuli
+                are sorted by length and zero padded to the longest of the batch.
+                Used only if model supports_batching. If None, uses 'feature_batch_size'
+                of config (default 1).
 
         Returns:
             dict of dict: read this as features[layer_id][stim_id]
         """
         features = {id:{} for id in self.layer_ids}
-        for stim_id, audio in stim_audios.items():
+        stim_features = {}
+        for stim_id, layer_features in self.iter_features(
+                stim_audios, sampling_rate, stim_durations, pad_time, batch_size
+            ):
+            stim_features[stim_id] = layer_features
+        # keep the order of stim_audios..
+        for stim_id in stim_audios.keys():
+            for layer_id in self.layer_ids:
+                features[layer_id][stim_id] = stim_features[stim_id][layer_id]
+        return features
 
-            if sampling_rate != self.sampling_rate:
-                n_samples = int(audio.size*self.sampling_rate/sampling_rate)
-                audio = resample(audio, n_samples)
-            
-            if pad_time is not None:
-                pad = int(pad_time*self.sampling_rate)
-                padding = np.zeros((pad, ))
-                audio = np.concatenate([padding, audio])
-
-            # # needed only for Whisper...!
-            if 'whisper' in self.model_name:
-                bin_width = 20/1000.0   #20 ms for all layers except the very first...
-                sent_duration = stim_durations[stim_id]
-                if pad_time is not None:
-                    sent_duration += pad_time
-                sent_samples = int((sent_duration + bin_width/2)/bin_width)
+    def iter_features(self, stim_audios, sampling_rate, stim_durations=None, pad_time=None, batch_size=None):
+        """Yields raw features of one stimulus at a time, as soon as these are 
+        extracted, so that features can be written out without holding 
+        features of all stimuli (see extract_features for args).
 
+        Yields:
+            stim_id, dict: {layer_id: (time, features)}
+        """
+        if batch_size is None:
+            batch_size = ac_config.get('feature_batch_size', 1)
+        if batch_size > 1 and self.supports_batching:
+            yield from self.iter_features_batched(
+                stim_audios, sampling_rate, stim_durations, pad_time, batch_size
+                )
+            return
+
+        for stim_id, audio in stim_audios.items():
+            audio = self.prepare_audio(audio, sampling_rate, pad_time)
             stim_features = self.get_features(audio)
-            for layer_id in self.layer_ids:
-                layer_name = self.get_layer_name(layer_id)
-                features[layer_id][stim_id] = stim_features[layer_name]
-                if 'whisper' in self.model_name:
-                    ## whisper networks gives features for 30s long clip,
-                    ## extracting only the true initial samples...
-                    layer_name = self.get_layer_name(layer_id)
-                    if layer_name == 'model.encoder.conv1':
-                        # sampling rate is 100 Hz for very first layer
-                        # and 50 Hz for all the other layers...
-                        feature_samples = 2*sent_samples
-                    else:
-                        feature_samples = sent_samples
-                    features[layer_id][stim_id] = features[layer_id][stim_id][:feature_samples]
+            yield stim_id, self.layer_features(stim_features, stim_durations, stim_id, pad_time)
             del stim_features
             collected = gc.collect()
+
+    def iter_features_batched(self, stim_audios, sampling_rate, stim_durations, pad_time, batch_size):
+        """Yields raw features of one stimulus at a time, forward passing batches 
+        of stimuli of similar lengths (see extract_features for args).
+        """
+        # lengths after prepare_audio..
+        pad = 0 if pad_time is None else int(pad_time*self.sampling_rate)
+        lengths = {
+            stim_id: int(audio.size*self.sampling_rate/sampling_rate) + pad
+            for stim_id, audio in stim_audios.items()
+            }
+        # grouping by length keeps the padding small..
+        sorted_ids = sorted(lengths.keys(), key=lambda stim_id: lengths[stim_id])
+        for start in range(0, len(sorted_ids), batch_size):
+            batch_ids = sorted_ids[start:start+batch_size]
+            batch_features = self.get_batch_features([
+                self.prepare_audio(stim_audios[stim_id], sampling_rate, pad_time) for stim_id in batch_ids
+                ])
+            for stim_id, stim_features in zip(batch_ids, batch_features):
+                yield stim_id, self.layer_features(stim_features, stim_durations, stim_id, pad_time)
+            del batch_features
+            collected = gc.collect()
+
+    def layer_features(self, stim_features, stim_durations, stim_id, pad_time=None):
+        """Returns {layer_id: features} from {layer_name: features} of a stimulus."""
+        features = {}
+        for layer_id in self.layer_ids:
+            layer_name = self.get_layer_name(layer_id)
+            features[layer_id] = self.trim_features(
+                layer_name, stim_features[layer_name], stim_durations, stim_id, pad_time
+                )
         return features
 
+    def prepare_audio(self, audio, sampling_rate, pad_time=None):
+        """Resamples audio to sampling rate of the model and
+        prepends pad_time seconds of silence."""
+        if sampling_rate != self.sampling_rate:
+            n_samples = int(audio.size*self.sampling_rate/sampling_rate)
+            audio = resample(audio, n_samples)
+        
+        if pad_time is not None:
+            pad = int(pad_time*self.sampling_rate)
+            padding = np.zeros((pad, ))
+            audio = np.concatenate([padding, audio])
+        return audio
+
+    def trim_features(self, layer_name, features, stim_durations, stim_id, pad_time=None):
+        """Returns features of the layer for the true duration of the stimulus,
+        (needed only for Whisper)."""
+        if 'whisper' not in self.model_name:
+            return features
+        ## whisper networks gives features for 30s long clip,
+        ## extracting only the true initial samples...
+        bin_width = 20/1000.0   #20 ms for all layers except the very first...
+        sent_duration = stim_durations[stim_id]
+        if pad_time is not None:
+            sent_duration += pad_time
+        sent_samples = int((sent_duration + bin_width/2)/bin_width)
+        if layer_name == 'model.encoder.conv1':
+            # sampling rate is 100 Hz for very first layer
+            # and 50 Hz for all the other layers...
+            feature_samples = 2*sent_samples
+        else:
+            feature_samples = sent_samples
+        return features[:feature_samples]
+
 
     def register_hooks(self):
         """Registers hooks for all the layers in the model."""
@@ -176,25 +284,33 @@ class BaseFeatureExtractor(ABC):
     def create_hooks(self):
         """Creates hooks for all the layers in the model."""
         def fn(layer, inp, output):
-            if 'rnn' in layer.__name__:
-                features = output[0].data
+            if self.batched:
+                # batch dimension is kept, items are formatted after the forward pass..
+                self.features[layer.__name__] = output
             else:
-                output = output.squeeze()
-                if 'conv' in layer.__name__:
-                    if output.ndim > 2:
-                        output = output.reshape(output.shape[0]*output.shape[1], -1)
-                    output = output.transpose(0,1)
-                elif 'coch' in self.model_name:
-                    if output.ndim > 2:
-                        output = output.reshape(output.shape[0]*output.shape[1], -1)
-                    output = output.transpose(0,1)      # (time, features) format
-                    if output.shape[1] > 2000:
-                        # restrict the output to max 2000 features
-                        output = output[:, :2000]   
-                features = output
-            self.features[layer.__name__] = features
+                self.features[layer.__name__] = self.format_layer_output(layer.__name__, output)
         return fn
 
+    def format_layer_output(self, layer_name, output):
+        """Returns output of the layer (for a single input) in (time, features) format."""
+        if 'rnn' in layer_name:
+            features = output[0].data
+        else:
+            output = output.squeeze()
+            if 'conv' in layer_name:
+                if output.ndim > 2:
+                    output = output.reshape(output.shape[0]*output.shape[1], -1)
+                output = output.transpose(0,1)
+            elif 'coch' in self.model_name:
+                if output.ndim > 2:
+                    output = output.reshape(output.shape[0]*output.shape[1], -1)
+                output = output.transpose(0,1)      # (time, features) format
+                if output.shape[1] > 2000:
+                    # restrict the output to max 2000 features
+                    output = output[:, :2000]   
+            features = output
+        return features
+
 
     def get_config_details(self):
         """
@@ -233,6 +349,32 @@ class BaseFeatureExtractor(ABC):
         self.features = {}
         return features
 
+    def get_batch_features(self, audios):
+        """Returns features for all layers of the DNN for a batch of audios,
+        one forward pass for the batch, each item unpadded to its true length.
+
+        Args:
+            audios: list = list of 'wav' inputs of shape (t,)
+
+        Returns:
+            list of dict: features of each audio {layer_name: (time, features)}
+        """
+        self.batched = True
+        try:
+            _ = self.fwd_pass_batch(audios)
+        finally:
+            self.batched = False
+        lengths = [audio.size for audio in audios]
+        padded_samples = max(lengths)
+        batch_features = [{} for _ in audios]
+        for layer_name, output in self.features.items():
+            for i, num_samples in enumerate(lengths):
+                feats = self.format_layer_output(layer_name, output[i:i+1]).cpu()
+                num_frames = self.num_frames(layer_name, num_samples, feats.shape[0], padded_samples)
+                batch_features[i][layer_name] = feats[:num_frames]
+        self.features = {}
+        return batch_features
+
     
     def translate(self, aud, grad=False):
         if grad:
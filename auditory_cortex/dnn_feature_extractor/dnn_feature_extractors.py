@@ -20,13 +20,26 @@ from wav2letter.models import Wav2LetterRF, Wav2LetterSpect
 # local imports
 from auditory_cortex import utils
 from .base_feature_extractor import BaseFeatureExtractor, register_feature_extractor
-from auditory_cortex import results_dir, cache_dir
+from auditory_cortex import results_dir, cache_dir, config as ac_config
 
 import logging
 logger = logging.getLogger(__name__)
 
 HF_CACHE_DIR = cache_dir / 'hf_cache'
 
+
+def wav2vec2_output_frames(model_config, layer_name, num_samples):
+    """Returns number of frames of wav2vec2 layer output for input of num_samples,
+    layers of the conv feature extractor have their own frame rates,
+    all later layers have frame rate of the last conv layer."""
+    num_conv_layers = len(model_config.conv_kernel)
+    if 'feature_extractor.conv_layers.' in layer_name:
+        num_conv_layers = int(layer_name.split('conv_layers.')[1].split('.')[0]) + 1
+    length = num_samples
+    for kernel, stride in zip(model_config.conv_kernel[:num_conv_layers], model_config.conv_stride[:num_conv_layers]):
+        length = (length - kernel)//stride + 1
+    return length
+
 @register_feature_extractor('wav2letter_modified')
 class Wav2LetterModified(BaseFeatureExtractor):
     def __init__(self, shuffled=False):
@@ -104,6 +117,34 @@ class Wav2Vec2(BaseFeatureExtractor):
             logits = self.model(input_values).logits
 
         return logits
+
+    @property
+    def supports_batching(self):
+        # padding changes group norm statistics of the conv feature extractor,
+        # only models with layer norm (and attention mask) give same features..
+        return self.model.config.feat_extract_norm == 'layer'
+
+    def fwd_pass_batch(self, audios):
+        """
+        Forward passes a batch of audio inputs through the model, (zero padded 
+        to the longest, with attention mask) and captures the features in the 'self.features' dict.
+
+        Args:
+            audios (list): list of 'wav' inputs of shape (t,) 
+        """
+        inputs = self.processor(
+            [aud.astype(np.float64) for aud in audios], sampling_rate=16000, return_tensors="pt",
+            padding="longest", return_attention_mask=True,
+            )
+        self.model.eval()
+        with torch.no_grad():
+            out = self.model(
+                inputs.input_values.to(self.device), attention_mask=inputs.attention_mask.to(self.device)
+                )
+        return out
+
+    def num_frames(self, layer_name, num_samples, padded_frames, padded_samples):
+        return wav2vec2_output_frames(self.model.config, layer_name, num_samples)
     
     def fwd_pass_tensor(self, aud_tensor):
         """
@@ -201,6 +242,8 @@ class Speech2Text(BaseFeatureExtractor):
     
     
 class FeatureExtractorWhisper(BaseFeatureExtractor):
+    supports_batching = True
+
     def __init__(self, model_name, shuffled=False):
         self.model_name = model_name
         config = utils.load_dnn_config(model_name=self.model_name)
@@ -219,17 +262,60 @@ class FeatureExtractorWhisper(BaseFeatureExtractor):
         return spect.transpose(1, 0)
 
     def fwd_pass(self, aud):
+        """
+        Forward passes audio input through the encoder only and captures 
+        the features in the 'self.features' dict, (decoder is not needed for 
+        features of encoder layers). If only conv layers are hooked, the 
+        input is trimmed to the length of audio instead of the 30s window.
+
+        Args:
+            aud (ndarray): single 'wav' input of shape (t,) or list of inputs.
+        
+        Returns:
+            output of the last layer run.
+        """
+        input_features = self.processor(aud, sampling_rate=16000, return_tensors="pt").input_features
+        self.model.eval()
+        input_features = input_features.to(self.device)
+        encoder = self.model.get_encoder()
+        with torch.no_grad():
+            if all([layer_type == 'conv' for layer_type in self.layer_types]):
+                max_samples = max([a.size for a in aud]) if isinstance(aud, list) else aud.size
+                num_frames = self.conv_input_frames(max_samples)
+                # transformer layers need the 30s window, conv layers are run directly..
+                hidden = nn.functional.gelu(encoder.conv1(input_features[..., :num_frames]))
+                return nn.functional.gelu(encoder.conv2(hidden))
+            return encoder(input_features).last_hidden_state
+
+    @staticmethod
+    def conv_input_frames(num_samples, margin=8):
+        """Returns number of (100 Hz) mel frames covering audio of num_samples,
+        with margin so that conv outputs of the retained samples
+        (see trim_features) do not see the trimmed end."""
+        num_frames = int(np.ceil(num_samples/160)) + margin
+        return min(3000, num_frames + num_frames % 2)
+
+    def generate(self, aud):
+        """Returns the generated token ids for audio input."""
         input_features = self.processor(aud, sampling_rate=16000, return_tensors="pt").input_features
-        # with torch.no_grad():
         self.model.eval()
         input_features = input_features.to(self.device)
         with torch.no_grad():
             generated_ids = self.model.generate(inputs=input_features, max_new_tokens=400)
         return generated_ids
+
+    def fwd_pass_batch(self, audios):
+        """Forward passes a batch of audio inputs, each input is padded to 
+        30s by the processor, so features are same as for single inputs."""
+        return self.fwd_pass(list(audios))
+
+    def num_frames(self, layer_name, num_samples, padded_frames, padded_samples):
+        # features are given for the 30s window (or trimmed input), trimmed in trim_features..
+        return padded_frames
     
     def transcribe(self, audio):
         """Transcribes speech audio"""
-        predicted_ids = self.fwd_pass(audio)
+        predicted_ids = self.generate(audio)
         return self.processor.batch_decode(predicted_ids, skip_special_tokens=True)
     
     def batch_predictions(self, audio_batch, label_normalizer):
@@ -361,6 +447,34 @@ class W2V2Audioset(BaseFeatureExtractor):
             input_values = input_values.to(self.device)
             out = self.model(input_values)
         return out
+
+    @property
+    def supports_batching(self):
+        # padding changes group norm statistics of the conv feature extractor,
+        # only models with layer norm (and attention mask) give same features..
+        return self.model.config.feat_extract_norm == 'layer'
+
+    def fwd_pass_batch(self, audios):
+        """
+        Forward passes a batch of audio inputs through the model, (zero padded 
+        to the longest, with attention mask) and captures the features in the 'self.features' dict.
+
+        Args:
+            audios (list): list of 'wav' inputs of shape (t,) 
+        """
+        inputs = self.processor(
+            [aud.astype(np.float64) for aud in audios], sampling_rate=16000, return_tensors="pt",
+            padding="longest", return_attention_mask=True,
+            )
+        self.model.eval()
+        with torch.no_grad():
+            out = self.model(
+                inputs.input_values.to(self.device), attention_mask=inputs.attention_mask.to(self.device)
+                )
+        return out
+
+    def num_frames(self, layer_name, num_samples, padded_frames, padded_samples):
+        return wav2vec2_output_frames(self.model.config, layer_name, num_samples)
     
     def fwd_pass_tensor(self, aud_tensor):
         """
@@ -398,6 +512,8 @@ class W2V2Audioset(BaseFeatureExtractor):
 ###############        pretrained from Tuckute et al. 2023      ##################
 
 class FeatureExtractorCoch(BaseFeatureExtractor):
+    supports_batching = True
+
     def __init__(self, model_name, shuffled=False):
         self.model_name = model_name        # cochresnet50
         config = utils.load_dnn_config(model_name=self.model_name)
@@ -457,16 +573,36 @@ class FeatureExtractorCoch(BaseFeatureExtractor):
         padding_length = self.signal_length - audio.shape[0]
         padded_audio = np.pad(audio, (0, padding_length), mode='constant')
         stim_features = self.get_features(padded_audio)
-        for ii, (layer_name, feats) in enumerate(stim_features.items()):
-            extra_samples_padded = int(padding_length*self.layer_rates[ii]/self.sampling_rate)
+        return self.strip_clip_features(stim_features, padding_length, context_samples, retain_context)
+
+    def strip_clip_features(self, stim_features, padding_length, context_samples=0, retain_context=True):
+        """Removes frames of padded and context samples from the features 
+        of a clip, using rates of the layers."""
+        for layer_name, feats in stim_features.items():
+            layer_rate = self.layer_rates[self.layer_names.index(layer_name)]
+            extra_samples_padded = int(padding_length*layer_rate/self.sampling_rate)
             if not retain_context:
-                extra_samples_context = int(context_samples*self.layer_rates[ii]/self.sampling_rate)
+                extra_samples_context = int(context_samples*layer_rate/self.sampling_rate)
             else:
                 extra_samples_context = 0    
             # remove extra padded or context samples...
             num_samples = feats.shape[0]
             stim_features[layer_name] = feats[extra_samples_context:num_samples-extra_samples_padded]
         return stim_features
+
+    def fwd_pass_batch(self, audios):
+        """
+        Forward passes a batch of clips (all of length signal_length) 
+        and captures the features in the 'self.features' dict.
+
+        Args:
+            audios (list): list of 'wav' inputs of shape (signal_length,)
+        """
+        aud_input = torch.tensor(np.stack(audios), dtype=torch.float32, device=self.device)
+        self.model.eval()
+        with torch.no_grad():
+            out = self.model(aud_input)
+        return out
     
 
     def get_short_clips(self, audio, context_samples=0):
@@ -509,9 +645,10 @@ class FeatureExtractorCoch(BaseFeatureExtractor):
         return list_clips
 
     
-    def extract_features(self, stim_audios, sampling_rate, stim_durations=None, pad_time=None):
+    def iter_features(self, stim_audios, sampling_rate, stim_durations=None, pad_time=None, batch_size=None):
         """
-        Returns raw features for all layers of the DNN..!
+        Yields raw features of one stimulus at a time, audio is split into short
+        clips (see get_short_clips) and features of clips concatenated.
 
         Args:
             stim_audios (dict): dictionary of audio inputs for each sentence.
@@ -520,46 +657,80 @@ class FeatureExtractorCoch(BaseFeatureExtractor):
             stim_durations (dict): dictionary of sentence durations.
                 {stim_id: duration}
             pad_time (float): amount of padding time in seconds.
+            batch_size (int): number of clips forward passed together, clips
+                of consecutive stimuli are batched. If None, uses 'feature_batch_size' of config (default 1).
 
-        Returns:
-            dict of dict: read this as features[layer_id][stim_id]
+        Yields:
+            stim_id, dict: {layer_id: (time, features)}
         """
-        features = {id:{} for id in self.layer_ids}
-        for stim_id, audio in stim_audios.items():
-
+        if batch_size is None:
+            batch_size = ac_config.get('feature_batch_size', 1)
+        if pad_time is not None:
+            context_samples = int(pad_time*self.sampling_rate)
+        else:
+            context_samples = 0
+
+        # clips waiting for forward pass, (stim_id, clip, retain_context)..
+        clips = []
+        clip_features = {}
+        num_clips = {}
+        stim_ids = list(stim_audios.keys())
+        for i, stim_id in enumerate(stim_ids):
+            audio = stim_audios[stim_id]
             if sampling_rate != self.sampling_rate:
                 n_samples = int(audio.size*self.sampling_rate/sampling_rate)
                 audio = resample(audio, n_samples)
             
-            if pad_time is not None:
-                context_samples = int(pad_time*self.sampling_rate)
-            else:
-                context_samples = 0
-
             audio_clips = self.get_short_clips(audio, context_samples=context_samples)
-
-            stim_features_list = []
-            for ii, clip in enumerate(audio_clips):
-                if ii == 0:
-                    retain_context = True
-                else:
-                    retain_context = False
-                    
-                stim_features_list.append(
-                    self.extract_features_for_clip(
-                        clip, 
-                        context_samples=context_samples, 
-                        retain_context=retain_context)
-                    )
             ### I need context for the first short clip, but for the later clips 
             ### I don't need it....
+            clips.extend([(stim_id, clip, ii == 0) for ii, clip in enumerate(audio_clips)])
+            num_clips[stim_id] = len(audio_clips)
+            clip_features[stim_id] = []
+
+            last_stim = i == len(stim_ids) - 1
+            while len(clips) >= batch_size or (last_stim and len(clips) > 0):
+                batch, clips = clips[:batch_size], clips[batch_size:]
+                for clip_stim_id, feats in self.get_clips_features(batch, context_samples):
+                    clip_features[clip_stim_id].append(feats)
+
+            # stimuli with features of all clips are done..
+            for done_id in [sid for sid in clip_features if len(clip_features[sid]) == num_clips[sid]]:
+                stim_feats = clip_features.pop(done_id)
+                features = {}
+                for layer_id in self.layer_ids:
+                    layer_name = self.get_layer_name(layer_id)
+                    features[layer_id] = np.concatenate(
+                        [feats[layer_name] for feats in stim_feats], axis=0
+                        )
+                yield done_id, features
+                del stim_feats, features
+
+    def get_clips_features(self, clips, context_samples=0):
+        """Returns features of clips, with padding and context stripped,
+        forward passed as a single batch if more than one clip.
 
-            for layer_id in self.layer_ids:
-                layer_name = self.get_layer_name(layer_id)
-                features[layer_id][stim_id] = np.concatenate([stim_feats[layer_name] for stim_feats in stim_features_list], axis=0)
+        Args:
+            clips (list): list of (stim_id, clip, retain_context)
+            context_samples (int): number of samples of context in the clips.
 
-            del stim_features_list
-        return features
+        Returns:
+            list: list of (stim_id, {layer_name: features})
+        """
+        if len(clips) == 1:
+            stim_id, clip, retain_context = clips[0]
+            return [(stim_id, self.extract_features_for_clip(
+                clip, context_samples=context_samples, retain_context=retain_context
+                ))]
+        padding_lengths = [self.signal_length - clip.shape[0] for _, clip, _ in clips]
+        batch_features = self.get_batch_features([
+            np.pad(clip, (0, padding_length), mode='constant')
+            for (_, clip, _), padding_length in zip(clips, padding_lengths)
+            ])
+        return [
+            (stim_id, self.strip_clip_features(feats, padding_length, context_samples, retain_context))
+            for (stim_id, _, retain_context), feats, padding_length in zip(clips, batch_features, padding_lengths)
+            ]
 
 @register_feature_extractor('cochresnet50')
 class CochResnet50(FeatureExtractorCoch):
@@ -14,7 +14,21 @@ Classes:
         
     GpuTRF:
         A GPU-accelerated implementation of naplib's TRF model, enabling faster model fitting 
-        and prediction by leveraging the GPU for computations.
+        and prediction by leveraging the GPU for computations. Runs on NumPy backend
+        when no GPU is available (see auditory_cortex.array_backend).
+
+    RidgePath:
+        Ridge regression for a path of regularization parameters, solved from a single
+        eigendecomposition of X^T X, used for cross-validation of lmbdas.
+
+    SufficientStats:
+        Sufficient statistics (X^T X, X^T y, sums) of the time delayed design matrix,
+        accumulated one stimulus at a time, so that the full design matrix is never
+        materialized.
+
+    StatsCache:
+        Cache of sufficient statistics of blocks of stimuli, lets cross-validation folds
+        and the final fit on the mapping set reuse the same statistics.
 
 Methods in TRF:
     __init__(model_name, dataset_obj):
@@ -32,11 +46,25 @@ Methods in TRF:
         regularization parameter and lag.
 
 Methods in GpuTRF:
-    __init__(tmin, tmax, sfreq, alpha=1):
-        Initializes the GPU-accelerated TRF model with given time window and regularization parameter.
+    __init__(tmin, tmax, sfreq, alpha=1, backend=None):
+        Initializes the GPU-accelerated TRF model with given time window and regularization parameter
+        (scalar, or one for each channel solved together by MultiAlphaLinearModel).
         
-    fit(X, y):
+    fit(X, y, n_offset, streaming=False):
         Fits the TRF model using time-delayed versions of the input features and neural responses.
+
+    fit_lmbda_path(X, y, lmbdas, n_offset, streaming=False):
+        Fits the TRF model for all the regularization parameters using a single 
+        eigendecomposition of the delayed design matrix (see RidgePath).
+
+    accumulate_stats(X, y, n_offset):
+        Streams trials one at a time and accumulates sufficient statistics (see SufficientStats).
+
+    fit_from_stats(stats), fit_lmbda_path_from_stats(stats, lmbdas):
+        Fit the TRF model from the accumulated sufficient statistics.
+
+    score_lmbda_path(X, y):
+        Computes the R² score of the model's predictions for all lmbdas of the path.
         
     predict(X):
         Predicts the neural responses for the given input features using the fitted TRF model.
@@ -52,7 +80,7 @@ License: MIT
 Dependencies:
     - naplib
     - numpy (np)
-    - cupy (cp)
+    - cupy (cp), optional
     - sklearn.metrics (r2_score)
     - auditory_cortex.utils (for computing average test correlation)
 
@@ -64,12 +92,13 @@ Usage:
 
 import gc
 import numpy as np
-import cupy as cp
+from collections import OrderedDict
 import naplib as nl
 from sklearn.metrics import r2_score
 
 # local imports
 from auditory_cortex import utils
+from auditory_cortex import array_backend
 import auditory_cortex.io_utils.io as io
 
 import logging
@@ -78,13 +107,19 @@ logger = logging.getLogger(__name__)
 
 
 class TRF:
-    def __init__(self, model_name, dataset_assembler):
+    def __init__(self, model_name, dataset_assembler, stats_cache=None):
         """
         Args:
-            num_freqs (int): Number of frequency channels on spectrogram
+            model_name: str = name of the model (features).
+            dataset_assembler: BaseDataAssembler = assembler providing features and spikes.
+            stats_cache: StatsCache = cache of sufficient statistics, can be shared
+                across TRF objects, a new one is created if None.
         """       
         self.model_name = model_name
         self.dataset_assembler = dataset_assembler
+        if stats_cache is None:
+            stats_cache = StatsCache()
+        self.stats_cache = stats_cache
         logger.info(f"TRF object created for '{model_name}' model.")
         
     def evaluate(self, trf_model, n_test_trials=None, percent_duration=None):
@@ -162,25 +197,28 @@ class TRF:
         lmbda_score = np.zeros(((len(lmbdas), num_channels)))
         size_of_chunk = int(len(mapping_set) / num_folds)
 
+        # statistics of each validation block are computed once, 
+        # training statistics of a fold = total - validation block..
+        val_sets = []
         for r in range(num_folds):
-            logger.info(f"\n For fold={r}: ")
             if r<(num_folds-1):
-                val_set = mapping_set[r*size_of_chunk:(r+1)*size_of_chunk]
+                val_sets.append(mapping_set[r*size_of_chunk:(r+1)*size_of_chunk])
             else:
-                val_set = mapping_set[r*size_of_chunk:]
-            train_set = mapping_set[np.isin(mapping_set, val_set, invert=True)]
-
-            train_x, train_y = self.dataset_assembler.get_training_data(stim_ids=train_set)
-            val_x, val_y = self.dataset_assembler.get_training_data(stim_ids=val_set)
-            for i, lmbda in enumerate(lmbdas):
-
-                trf_model = GpuTRF(
-                    tmin, tmax, sfreq, alpha=lmbda,
-                    )
-                trf_model.fit(X=train_x, y=train_y, n_offset=self.dataset_assembler.n_offset)
+                val_sets.append(mapping_set[r*size_of_chunk:])
+        val_stats = [self.get_sufficient_stats(val_set, tmin, tmax, sfreq) for val_set in val_sets]
+        total_stats = val_stats[0]
+        for stats in val_stats[1:]:
+            total_stats = total_stats + stats
+        # total is reused by the final fit on the mapping set..
+        self.stats_cache.put(self._stats_key(mapping_set, tmin, tmax), total_stats)
 
-                # save validation score for lmbda..
-                lmbda_score[i] += trf_model.score(X=val_x, y=val_y, n_offset=self.dataset_assembler.n_offset)
+        for r in range(num_folds):
+            logger.info(f"\n For fold={r}: ")
+            # single factorization of the design per fold, scores all lmbdas at once..
+            trf_model = GpuTRF(tmin, tmax, sfreq)
+            trf_model.fit_lmbda_path_from_stats(total_stats - val_stats[r], lmbdas=lmbdas)
+            # save validation score for all lmbdas..
+            lmbda_score += trf_model.score_lmbda_path_from_stats(val_stats[r])
 
         lmbda_score /= num_folds
         max_lmbda_score = np.max(lmbda_score, axis=0)
@@ -229,22 +267,60 @@ class TRF:
             )
             
         
-        # get mapping data..
-        mapping_x, mapping_y = self.dataset_assembler.get_training_data(mapping_set)
-
         sfreq = 1000/self.dataset_assembler.get_bin_width()
         tmax = lag/1000 # convert seconds to ms
 
+        # statistics of mapping set are already cached by cross-validation..
+        mapping_stats = self.get_sufficient_stats(mapping_set, tmin/1000, tmax, sfreq)
+
         logger.info(f"Fitting model using optimal lag={lag} ms and optimal lmbda={opt_lmbda}")
         trf_model = GpuTRF(
                     tmin, tmax, sfreq, alpha=opt_lmbda,
                     )
-        trf_model.fit(X=mapping_x, y=mapping_y, n_offset=self.dataset_assembler.n_offset)
+        trf_model.fit_from_stats(mapping_stats)
 
         logger.info(f"Computing corr for test set...")
         corr = self.evaluate(trf_model)
         return corr, opt_lmbda, trf_model
     
+    def get_sufficient_stats(self, stim_ids, tmin, tmax, sfreq):
+        """Returns sufficient statistics of time delayed features and spikes
+        for the stim_ids, reads from the cache if available, otherwise 
+        accumulates (one stimulus at a time) and caches them.
+
+        Args:
+            stim_ids: list = stimulus IDs of the block.
+            tmin: float = start of time window in sec.
+            tmax: float = end of time window in sec.
+            sfreq: float = sampling frequency (Hz) of the data
+
+        Returns:
+            SufficientStats
+        """
+        key = self._stats_key(stim_ids, tmin, tmax)
+        stats = self.stats_cache.get(key)
+        if stats is None:
+            X, y = self.dataset_assembler.get_training_data(stim_ids=stim_ids)
+            stats = GpuTRF(tmin, tmax, sfreq).accumulate_stats(
+                X, y, n_offset=self.dataset_assembler.n_offset
+                )
+            self.stats_cache.put(key, stats)
+        return stats
+
+    def _stats_key(self, stim_ids, tmin, tmax):
+        """Key identifying statistics of block of stimuli for the 
+        (session, layer, bin_width, lag) of current data assembler."""
+        assembler = self.dataset_assembler
+        layer = getattr(assembler, 'layer_id', getattr(assembler, 'layer_ids', None))
+        if isinstance(layer, (list, np.ndarray)):
+            layer = tuple(layer)
+        return (
+            self.model_name, assembler.get_session_id(), layer,
+            assembler.get_bin_width(), assembler.mVocs,
+            round(tmin*1000), round(tmax*1000), 
+            StatsCache.block_id(stim_ids),
+        )
+
     @staticmethod
     def load_saved_model(
             model_name, session, layer_ID, bin_width, shuffled=False,
@@ -328,31 +404,32 @@ class GpuTRF(nl.encoding.TRF):
     Built on top of naplib's TRF model.
     https://naplib-python.readthedocs.io/en/latest/references/encoding.html#trf 
     """
-    def __init__(self, tmin, tmax, sfreq, alpha=0.1):
+    def __init__(self, tmin, tmax, sfreq, alpha=0.1, backend=None):
         """
         Args:
             tmin: int = start of time window in ms
             tmax: int = end of time window in ms
             sfreq: int = sampling frequency (Hz) of the data
             alpha: float or list = regularization parameter scalar or list of scalars.
-                if list, fit separate model for channel of Y.
+                if list, separate regularization for each channel of Y, all channels 
+                are solved together (see MultiAlphaLinearModel).
+            backend: str = array backend ['numpy', 'cupy'], if None picks cupy
+                when GPU is available, numpy otherwise. Default=None.
             
         """
         logger.info(f"GpuTRF object created with alpha={alpha}, tmin={tmin}, tmax={tmax}, sfreq={sfreq}")
         self.normalize_X = True
         self.center_y = True
         self.alpha = alpha
+        self.backend = backend
         if isinstance(alpha, float):
             # self.alpha = alpha
             self.n_alphas = 1
-            self.model = LinearModel(alpha=alpha)
+            self.model = LinearModel(alpha=alpha, backend=backend)
         elif isinstance(alpha, list) or (isinstance(alpha, np.ndarray) and alpha.ndim == 1):
             # self.alpha = alpha
             self.n_alphas = len(alpha)
-            for i in range(self.n_alphas):
-                self.models = [LinearModel(alpha=alp) for alp in alpha]
-            # this is redundant, just to pass the first model to the parent class
-            self.model = self.models[0]
+            self.model = MultiAlphaLinearModel(alpha=alpha, backend=backend)
         else:
             raise ValueError(f"Invalid alpha value={alpha}")
         super().__init__(
@@ -361,7 +438,7 @@ class GpuTRF(nl.encoding.TRF):
             n_jobs=1, show_progress=True
             )
 
-    def fit(self, X, y, n_offset):
+    def fit(self, X, y, n_offset, streaming=False):
         """Given the input data, fits TRF model. Precisely, for each trial
         features in X, it's time delayed versions are stacked along features axis,
         and resultant ndarrays for each trial are concatenated along time axis.
@@ -373,11 +450,160 @@ class GpuTRF(nl.encoding.TRF):
         Args:
             X: list = list of ndarrays of shape (n_samples, n_features)
             y: list = list of ndarrays of shape (n_samples, n_targets)
+            n_offset: int = number of initial (padding) samples to drop from X.
+            streaming: bool = If True, time delayed features are never concatenated,
+                instead sufficient statistics are accumulated one trial at a time,
+                needs O(d^2) instead of O(total_samples*d) memory. Default=False.
         """
-        self.ndim_y_ = y[0].ndim
-        self.X_feats_ = X[0].shape[-1]
-        self.n_targets_ = y[0].shape[1]
+        if streaming:
+            return self.fit_from_stats(self.accumulate_stats(X, y, n_offset))
+        X_delayed, y_delayed = self._delay_and_normalize(X, y, n_offset)
+        self.model.fit(X_delayed, y_delayed)
+        return self
+
+    def fit_lmbda_path(self, X, y, lmbdas, n_offset, streaming=False):
+        """Fits the TRF model for all the regularization parameters in 'lmbdas',
+        using a single eigendecomposition of the delayed design matrix. 
+        Time delays and normalization are handled exactly as in fit() method,
+        use score_lmbda_path() to get validation scores for all the lmbdas.
+
+        Args:
+            X: list = list of ndarrays of shape (n_samples, n_features)
+            y: list = list of ndarrays of shape (n_samples, n_targets)
+            lmbdas: ndarray = (n_lmbdas,) regularization parameters.
+            n_offset: int = number of initial (padding) samples to drop from X.
+            streaming: bool = If True, accumulate sufficient statistics one trial
+                at a time (see fit() method). Default=False.
+        """
+        if streaming:
+            return self.fit_lmbda_path_from_stats(self.accumulate_stats(X, y, n_offset), lmbdas)
+        X_delayed, y_delayed = self._delay_and_normalize(X, y, n_offset)
+        self.path_ = RidgePath(lmbdas, backend=self.backend).fit(X_delayed, y_delayed)
+        return self
+
+    def accumulate_stats(self, X, y, n_offset, stats=None):
+        """Streams trials one at a time, builds time delayed features of
+        the trial on the fly and accumulates sufficient statistics.
+        
+        Args:
+            X: list = list of ndarrays of shape (n_samples, n_features)
+            y: list = list of ndarrays of shape (n_samples, n_targets)
+            n_offset: int = number of initial (padding) samples to drop from X.
+            stats: SufficientStats = If given, statistics are added to it.
+
+        Returns:
+            stats: SufficientStats
+        """
+        self._set_dims(X, y)
+        for xx, yy in zip(X, y):
+            X_tmp, y_tmp = self._delay_and_reshape(xx, yy)
+            if stats is None:
+                stats = SufficientStats(X_tmp.shape[1], y_tmp.shape[1], backend=self.backend)
+            stats.update(X_tmp[n_offset:], y_tmp)
+        return stats
+
+    def fit_from_stats(self, stats):
+        """Fits the TRF model from the sufficient statistics, 
+        normalization of features (and centering of targets) is applied 
+        analytically to the accumulated moments.
+
+        Args:
+            stats: SufficientStats = statistics of the time delayed training data.
+        """
+        ZtZ, Zty = self._normalize_stats(stats)
+        self.model.fit_gram(ZtZ, Zty, stats.n_samples)
+        return self
+
+    def fit_lmbda_path_from_stats(self, stats, lmbdas):
+        """Fits the TRF model for all the lmbdas from the sufficient statistics,
+        use score_lmbda_path() to get validation scores for all the lmbdas.
+
+        Args:
+            stats: SufficientStats = statistics of the time delayed training data.
+            lmbdas: ndarray = (n_lmbdas,) regularization parameters.
+        """
+        ZtZ, Zty = self._normalize_stats(stats)
+        self.path_ = RidgePath(lmbdas, backend=self.backend).fit_gram(ZtZ, Zty, stats.n_samples)
+        return self
+
+    def score_lmbda_path_from_stats(self, stats):
+        """Computes the coefficient of determination (score) for all
+        the lmbdas of the path, using sufficient statistics of the (validation)
+        data instead of predictions. Same as score_lmbda_path().
+
+        Args:
+            stats: SufficientStats = statistics of the time delayed validation data.
+
+        Returns:
+            ndarray = (n_lmbdas, n_targets)
+        """
+        if not hasattr(self, 'path_'):
+            raise ValueError(f'Must call .fit_lmbda_path() before can call .score_lmbda_path_from_stats()')
+        normalize_X = getattr(self, "normalize_X", True)
+        ZtZ, Zty, yty = stats.centered(
+            X_mean=self.X_mean_ if normalize_X else None,
+            X_std=self.X_std_ if normalize_X else None,
+            y_mean=self.y_mean_,
+            )
+        return stats.r2_score(self.path_.sse(ZtZ, Zty, yty))
+
+    def _normalize_stats(self, stats):
+        """Applies normalization to the sufficient statistics and saves
+        normalization statistics for use at prediction.
+
+        Returns:
+            ZtZ: ndarray = (d, d) gram matrix of normalized features.
+            Zty: ndarray = (d, n_targets) normalized features times centered targets.
+        """
+        self.ndim_y_ = 2
+        self.X_feats_ = stats.n_dims // self._ndelays
+        self.n_targets_ = stats.n_targets
         self.n_models = None
+        ZtZ, Zty, X_mean, X_std, y_mean = stats.normalized(
+            normalize_X=getattr(self, "normalize_X", True),
+            center_y=getattr(self, "center_y", False),
+            )
+        if getattr(self, "normalize_X", True):
+            self.X_mean_ = array_backend.to_numpy(X_mean)[None, :]
+            self.X_std_ = array_backend.to_numpy(X_std)[None, :]
+        if getattr(self, "center_y", False):
+            self.y_mean_ = array_backend.to_numpy(y_mean)[None, :]
+        else:
+            self.y_mean_ = None
+        return ZtZ, Zty
+
+    def score_lmbda_path(self, X, y, n_offset=0):
+        """Computes the coefficient of determination (score) for all
+        the lmbdas of the path fitted by fit_lmbda_path().
+
+        Returns:
+            ndarray = (n_lmbdas, n_targets)
+        """
+        if not hasattr(self, 'path_'):
+            raise ValueError(f'Must call .fit_lmbda_path() before can call .score_lmbda_path()')
+        y = np.concatenate(y, axis=0)
+        if y.ndim == 1:
+            y = y[:, np.newaxis]
+
+        X_delayed = self._delay_and_normalize_test(X, n_offset)
+        X_delayed = np.concatenate(X_delayed, axis=0)
+        scores = []
+        for pred in self.path_.predict(X_delayed):
+            if getattr(self, "center_y", False):
+                pred += self.y_mean_
+            scores.append(r2_score(y, pred, multioutput='raw_values'))
+        return np.stack(scores, axis=0)
+
+    def _delay_and_normalize(self, X, y, n_offset):
+        """Stacks time delayed copies of features (for each trial), concatenates
+        trials along time axis and normalizes the features (and centers the 
+        targets). Normalization statistics are saved for use at prediction.
+
+        Returns:
+            X_delayed: ndarray = (total_samples, n_features*n_lags)
+            y_delayed: ndarray = (total_samples, n_targets)
+        """
+        self._set_dims(X, y)
         
         X_delayed, y_delayed = [], []
         for xx, yy in zip(X, y):
@@ -400,13 +626,30 @@ class GpuTRF(nl.encoding.TRF):
             y_delayed = y_delayed - self.y_mean_
         else:
             self.y_mean_ = None
+        return X_delayed, y_delayed
 
-        if self.n_alphas == 1:
-            self.model.fit(X_delayed, y_delayed)
-        else:
-            for i in range(self.n_alphas):
-                self.models[i].fit(X_delayed, y_delayed[:,i])
-        return self
+    def _set_dims(self, X, y):
+        """Saves dimensions of the features and targets."""
+        self.ndim_y_ = y[0].ndim
+        self.X_feats_ = X[0].shape[-1]
+        self.n_targets_ = y[0].shape[1]
+        self.n_models = None
+
+    def _delay_and_normalize_test(self, X, n_offset=0):
+        """Time delays and normalizes (using statistics saved at fit) the
+        features of each trial.
+
+        Returns:
+            list = list of ndarrays of shape (n_samples, n_features*n_lags)
+        """
+        X_delayed = []
+        for xx in X:
+            X_tmp,_ = self._delay_and_reshape(xx)
+            # Normalize after delay-and-reshape using stored mean/std with matching shape
+            if getattr(self, "normalize_X", True):
+                X_tmp = (X_tmp - self.X_mean_) / self.X_std_
+            X_delayed.append(X_tmp[n_offset:])
+        return X_delayed
     
     def predict(self, X, n_offset=0):
         """Predicts the response for the given input data. Hanldes time
@@ -421,33 +664,14 @@ class GpuTRF(nl.encoding.TRF):
         if not hasattr(self, 'X_feats_'):
             raise ValueError(f'Must call .fit() before can call .predict()')
 
-        X_delayed = []
-        for xx in X:
-            X_tmp,_ = self._delay_and_reshape(xx)
-            # Normalize after delay-and-reshape using stored mean/std with matching shape
-            # if hasattr(self, "X_mean_") and hasattr(self, "X_std_"):
-            if getattr(self, "normalize_X", True):
-                X_tmp = (X_tmp - self.X_mean_) / self.X_std_
-            X_delayed.append(X_tmp[n_offset:])
+        X_delayed = self._delay_and_normalize_test(X, n_offset)
             
-        if self.n_alphas == 1:
-            y_pred = []
-            for xx in X_delayed:
-                yp = self.model.predict(xx)
-                if getattr(self, "center_y", False):
-                    yp += self.y_mean_
-                y_pred.append(yp)
-        else:
-            y_pred = [[] for _ in range(len(X_delayed))]
-            for xi, xx in enumerate(X_delayed):
-                for i in range(self.n_alphas):
-                    # y_pred[xi].append(self.models[i].predict(xx))
-                    yp = self.models[i].predict(xx)
-                    if getattr(self, "center_y", False):
-                        yp += self.y_mean_[:, i]
-                    y_pred[xi].append(yp)
-                    # y_pred.append()
-                y_pred[xi] = np.stack(y_pred[xi], axis=1)
+        y_pred = []
+        for xx in X_delayed:
+            yp = self.model.predict(xx)
+            if getattr(self, "center_y", False):
+                yp += self.y_mean_
+            y_pred.append(yp)
         return y_pred
     
     def score(self, X, y, n_offset=0):
@@ -473,15 +697,8 @@ class GpuTRF(nl.encoding.TRF):
             # for fitting multiple layers at the same time, this will almost never happen.
             return self.model.coef_.reshape(self.n_models, self.X_feats_, self._ndelays, self.n_targets_)
         else:
-            if self.n_alphas ==1:	
-                weights = self.model.coef_.reshape(self.X_feats_, self._ndelays, self.n_targets_)
-                return weights
-            else:
-                coef = []
-                biases = []
-                for i in range(self.n_alphas):
-                    coef.append(self.models[i].coef_.reshape(self.X_feats_, self._ndelays))
-                return np.stack(coef, axis=-1)
+            weights = self.model.coef_.reshape(self.X_feats_, self._ndelays, self.n_targets_)
+            return weights
             
     @coef_.setter
     def coef_(self, value):
@@ -493,26 +710,49 @@ class GpuTRF(nl.encoding.TRF):
         
 
 class LinearModel:
-    """GPU accelerated linear model. Uses cupy for computations on GPU.
+    """GPU accelerated linear model. Uses cupy for computations on GPU,
+    and NumPy (threaded BLAS, Cholesky solve) when no GPU is available.
     It implements close form solution for linear regression with L2 regularization.
     """
-    def __init__(self, alpha):
-        """Create linear model with regularization parameter alpha."""
+    def __init__(self, alpha, backend=None):
+        """Create linear model with regularization parameter alpha.
+        
+        Args:
+            alpha: float = regularization parameter.
+            backend: str = array backend ['numpy', 'cupy'], if None picks cupy
+                when GPU is available, numpy otherwise. Default=None.
+        """
         self.alpha = alpha
+        self.backend = backend
+        self.xp = array_backend.get_backend(backend)
 
     def fit(self, X, y):
         """Fit the linear model using the given data."""
         # X = self.adjust_for_bias(X)
-        X = cp.array(X)
-        y = cp.array(y)
+        X = array_backend.to_device(X, self.xp)
+        y = array_backend.to_device(y, self.xp)
         self.Beta = self.reg(X, y, lmbda=self.alpha)
 
 
+    def fit_gram(self, XtX, Xty, n_samples):
+        """Fit the linear model using the gram matrix X^T X and X^T y,
+        solves the same equation as reg() method.
+
+        Args:
+            XtX (ndarray): (N,N) gram matrix
+            Xty (ndarray): (N,) or (N,K) 
+            n_samples (int): number of samples (rows of X)
+        """
+        XtX = array_backend.to_device(XtX, self.xp)
+        Xty = array_backend.to_device(Xty, self.xp)
+        A = XtX + n_samples*self.alpha*self.xp.eye(XtX.shape[0])
+        self.Beta = array_backend.solve_pos(A, Xty)
+
     def predict(self, X):
         # X = self.adjust_for_bias(X)
-        X = cp.array(X)
-        pred = np.matmul(X, self.Beta)
-        return cp.asnumpy(pred)
+        X = array_backend.to_device(X, self.xp)
+        pred = self.xp.matmul(X, self.Beta)
+        return array_backend.to_numpy(pred)
     
     
     def adjust_for_bias(self, X):
@@ -535,10 +775,7 @@ class LinearModel:
 
         #check if incoming array is np or cp,
         #and decide which module to use...!
-        if type(X).__module__ == np.__name__:
-            module = np
-        else:
-            module = cp
+        module = array_backend.get_array_module(X)
         
         if X.ndim ==2:
             X = module.expand_dims(X,axis=0)
@@ -552,19 +789,362 @@ class LinearModel:
         A = module.matmul(X.transpose((0, 2, 1)), X) + m * lmbda * I
         B = module.matmul(X.transpose((0, 2, 1)), y)
 
-        return module.linalg.solve(A, B).squeeze()
+        return array_backend.solve_pos(A, B).squeeze()
     
     @property
     def coef_(self):
-        """Returns the coefficients of the linear map, excluding the bias term."""
+        """Returns the coefficients of the linear map (on host memory),
+        so that saved parameters can be loaded with either backend."""
         if not hasattr(self, 'Beta'):
             raise ValueError("Model has not been fit yet.")
-        return self.Beta
-        # return cp.asnumpy(self.Beta[:-1]), cp.asnumpy(self.Beta[-1])
+        return array_backend.to_numpy(self.Beta)
     
     @coef_.setter
     def coef_(self, value):
         """Sets the coefficients of the linear map."""
-        self.Beta = cp.asarray(value)
+        self.Beta = array_backend.to_device(value, self.xp)
 	
 
+
+
+class MultiAlphaLinearModel(LinearModel):
+    """Linear model with separate regularization parameter for each target.
+    Instead of solving a separate system for each target, all targets are solved 
+    from a single eigendecomposition X^T X = V diag(s) V^T, as:
+        B[:, k] = V diag(1/(s + m*alpha[k])) V^T X^T y[:, k]
+    so that weights of all targets are given by one matrix expression (see RidgePath).
+    """
+    def __init__(self, alpha, backend=None):
+        """Create linear model with regularization parameters alpha.
+        
+        Args:
+            alpha: list or ndarray = (n_targets,) regularization parameter for each target.
+            backend: str = array backend ['numpy', 'cupy'], if None picks cupy
+                when GPU is available, numpy otherwise. Default=None.
+        """
+        super().__init__(np.asarray(alpha, dtype=np.float64), backend=backend)
+
+    def fit(self, X, y):
+        """Fit the linear model using the given data."""
+        path = RidgePath(self.alpha, backend=self.backend).fit(X, y)
+        self.Beta = path.coef(self._device_alpha())
+
+    def fit_gram(self, XtX, Xty, n_samples):
+        """Fit the linear model using the gram matrix X^T X and X^T y.
+
+        Args:
+            XtX (ndarray): (N,N) gram matrix
+            Xty (ndarray): (N,K) 
+            n_samples (int): number of samples (rows of X)
+        """
+        path = RidgePath(self.alpha, backend=self.backend).fit_gram(XtX, Xty, n_samples)
+        self.Beta = path.coef(self._device_alpha())
+
+    def _device_alpha(self):
+        """Returns alphas as (n_targets,) array on the device of the backend."""
+        return array_backend.to_device(self.alpha, self.xp)
+
+
+class RidgePath:
+    """GPU accelerated (NumPy when no GPU) ridge regression for a path of regularization parameters.
+    Computes eigendecomposition of X^T X only once and gives solutions for
+    all the lmbdas from the single factorization. For X^T X = V diag(s) V^T,
+    the solution for X^T X B + m*lmbda*I = X^T y is given by:
+        B = V diag(1/(s + m*lmbda)) V^T X^T y
+    which is the same closed form solution as used by LinearModel.
+    """
+    def __init__(self, lmbdas, backend=None):
+        """Create ridge path for the regularization parameters lmbdas.
+        
+        Args:
+            lmbdas: ndarray = (n_lmbdas,) regularization parameters.
+            backend: str = array backend ['numpy', 'cupy'], if None picks cupy
+                when GPU is available, numpy otherwise. Default=None.
+        """
+        self.lmbdas = np.atleast_1d(np.asarray(lmbdas, dtype=np.float64))
+        self.xp = array_backend.get_backend(backend)
+
+    def fit(self, X, y):
+        """Factorizes the design matrix using the given data.
+
+        Args:
+            X (ndarray): (M,N) left-hand side array
+            y (ndarray): (M,) or (M,K) right-hand side array
+        """
+        xp = self.xp
+        X = array_backend.to_device(X, xp)
+        y = array_backend.to_device(y, xp)
+        if y.ndim == 1:
+            y = xp.expand_dims(y, axis=1)
+        XtX = xp.matmul(X.T, X)
+        Xty = xp.matmul(X.T, y)
+        return self.fit_gram(XtX, Xty, X.shape[0])
+
+    def fit_gram(self, XtX, Xty, n_samples):
+        """Factorizes the gram matrix X^T X.
+
+        Args:
+            XtX (ndarray): (N,N) gram matrix
+            Xty (ndarray): (N,) or (N,K) 
+            n_samples (int): number of samples (rows of X)
+        """
+        xp = self.xp
+        XtX = array_backend.to_device(XtX, xp, dtype=xp.float64)
+        Xty = array_backend.to_device(Xty, xp, dtype=xp.float64)
+        if Xty.ndim == 1:
+            Xty = xp.expand_dims(Xty, axis=1)
+        self.n_samples = n_samples
+        # eigendecomposition of the (symmetric) gram matrix..
+        self.eig_vals, self.eig_vecs = array_backend.eigh(XtX)
+        # projection of X^T y on the eigen basis, shared by all lmbdas
+        self.proj_Xty = xp.matmul(self.eig_vecs.T, Xty)
+        return self
+
+    def _shrinkage(self, lmbda):
+        """Returns the filter factors 1/(s + m*lmbda) on the eigen basis,
+        (N,1) for scalar lmbda and (N,K) for lmbda array of shape (K,)."""
+        return 1/(self.eig_vals[:, None] + self.n_samples*lmbda)
+
+    def coef(self, lmbda):
+        """Returns the coefficients for the regularization parameter lmbda,
+        lmbda can be a scalar or (K,) array with separate lmbda for each target.
+
+        Returns:
+            B (ndarray): (N,K)
+        """
+        return self.xp.matmul(self.eig_vecs, self.proj_Xty*self._shrinkage(lmbda))
+
+    def sse(self, ZtZ, Zty, yty):
+        """Sum of squared errors of predictions for all lmbdas of the path,
+        computed from the gram matrices of (validation) data, without the need
+        of design matrix. For solution B, SSE = y^T y - 2 B^T Z^T y + B^T Z^T Z B.
+
+        Args:
+            ZtZ (ndarray): (N,N) gram matrix
+            Zty (ndarray): (N,K) 
+            yty (ndarray): (K,) sum of squares of targets.
+
+        Returns:
+            ndarray = (n_lmbdas, K)
+        """
+        xp = self.xp
+        # rotate to the eigen basis once, shared by all lmbdas
+        G = xp.matmul(self.eig_vecs.T, xp.matmul(ZtZ, self.eig_vecs))
+        c = xp.matmul(self.eig_vecs.T, Zty)
+        sse = []
+        for lmbda in self.lmbdas:
+            beta = self.proj_Xty*self._shrinkage(lmbda)
+            sse.append(yty - 2*xp.sum(beta*c, axis=0) + xp.sum(beta*xp.matmul(G, beta), axis=0))
+        return xp.stack(sse, axis=0)
+
+    def predict(self, X):
+        """Predicts using the solutions for all lmbdas of the path.
+        
+        Args:
+            X (ndarray): (M,N) left-hand side array
+
+        Returns:
+            list = list of ndarrays (M,K), one for each lmbda.
+        """
+        xp = self.xp
+        X = array_backend.to_device(X, xp, dtype=xp.float64)
+        # rotate X once to the eigen basis, shared by all lmbdas
+        X_rot = xp.matmul(X, self.eig_vecs)
+        preds = []
+        for lmbda in self.lmbdas:
+            pred = xp.matmul(X_rot, self.proj_Xty*self._shrinkage(lmbda))
+            preds.append(array_backend.to_numpy(pred))
+        return preds
+
+
+
+class SufficientStats:
+    """Sufficient statistics of the (time delayed) design matrix X and 
+    targets y, i.e. n_samples, sum of X, sum of y, sum of y^2, X^T X and X^T y.
+    Statistics are accumulated one stimulus at a time, so the memory needed is
+    O(d^2) instead of O(n_samples*d). Statistics of disjoint sets of stimuli
+    can be added (or subtracted), e.g. training statistics of a cross-validation
+    fold are the total statistics minus the validation statistics.
+
+    Normalization of features (and centering of targets) is applied analytically,
+    for Z = (X - mu)/sigma and y_c = y - y_mean:
+        Z^T Z = D^-1 (X^T X - n mu mu^T) D^-1,   
+        Z^T y_c = D^-1 (X^T y - n mu y_mean^T),     where D = diag(sigma).
+    """
+    def __init__(self, n_dims, n_targets, backend=None):
+        """Create empty statistics.
+        
+        Args:
+            n_dims: int = number of columns of (time delayed) design matrix.
+            n_targets: int = number of targets (channels).
+            backend: str = array backend ['numpy', 'cupy'], if None picks cupy
+                when GPU is available, numpy otherwise. Default=None.
+        """
+        self.backend = backend
+        self.xp = array_backend.get_backend(backend)
+        xp = self.xp
+        self.n_dims = n_dims
+        self.n_targets = n_targets
+        self.n_samples = 0
+        self.sum_x = xp.zeros(n_dims, dtype=xp.float64)
+        self.sum_y = xp.zeros(n_targets, dtype=xp.float64)
+        self.sum_yy = xp.zeros(n_targets, dtype=xp.float64)
+        self.XtX = xp.zeros((n_dims, n_dims), dtype=xp.float64)
+        self.Xty = xp.zeros((n_dims, n_targets), dtype=xp.float64)
+
+    def update(self, X, y):
+        """Adds contribution of (a stimulus) X and y to the statistics.
+
+        Args:
+            X (ndarray): (M,N) time delayed features.
+            y (ndarray): (M,) or (M,K) targets.
+        """
+        xp = self.xp
+        X = array_backend.to_device(X, xp, dtype=xp.float64)
+        y = array_backend.to_device(y, xp, dtype=xp.float64)
+        if y.ndim == 1:
+            y = xp.expand_dims(y, axis=1)
+        self.n_samples += X.shape[0]
+        self.sum_x += X.sum(axis=0)
+        self.sum_y += y.sum(axis=0)
+        self.sum_yy += (y**2).sum(axis=0)
+        self.XtX += xp.matmul(X.T, X)
+        self.Xty += xp.matmul(X.T, y)
+        return self
+
+    def copy(self):
+        """Returns a copy of the statistics."""
+        other = SufficientStats.__new__(SufficientStats)
+        other.__dict__.update(self.__dict__)
+        for name in ['sum_x', 'sum_y', 'sum_yy', 'XtX', 'Xty']:
+            setattr(other, name, getattr(self, name).copy())
+        return other
+
+    def _combine(self, other, sign):
+        if (self.n_dims, self.n_targets) != (other.n_dims, other.n_targets):
+            raise ValueError(f"Can not combine statistics of different shapes.")
+        result = self.copy()
+        result.n_samples += sign*other.n_samples
+        for name in ['sum_x', 'sum_y', 'sum_yy', 'XtX', 'Xty']:
+            value = getattr(result, name)
+            value += sign*array_backend.to_device(getattr(other, name), self.xp)
+        return result
+
+    def __add__(self, other):
+        return self._combine(other, 1)
+
+    def __sub__(self, other):
+        return self._combine(other, -1)
+
+    def normalized(self, normalize_X=True, center_y=True):
+        """Returns gram matrices of the normalized features and centered targets,
+        computed analytically from the accumulated statistics. Matches the 
+        normalization of GpuTRF (std with ddof=0, +1e-6 to avoid div-by-zero).
+
+        Returns:
+            ZtZ: ndarray = (d, d) 
+            Zty: ndarray = (d, n_targets) 
+            X_mean: ndarray = (d,) or None
+            X_std: ndarray = (d,) or None
+            y_mean: ndarray = (n_targets,) or None
+        """
+        xp = self.xp
+        n = self.n_samples
+        X_mean, X_std, y_mean = None, None, None
+        if normalize_X:
+            X_mean = self.sum_x / n
+            X_var = xp.clip(xp.diag(self.XtX)/n - X_mean**2, 0, None)
+            X_std = xp.sqrt(X_var) + 1e-6  # avoid div-by-zero
+        if center_y:
+            y_mean = self.sum_y / n
+        ZtZ, Zty, _ = self.centered(X_mean, X_std, y_mean)
+        return ZtZ, Zty, X_mean, X_std, y_mean
+
+    def centered(self, X_mean=None, X_std=None, y_mean=None):
+        """Returns gram matrices for the given normalization statistics 
+        (e.g. saved at fit, for scoring validation data), 
+        for Z = (X - X_mean)/X_std and y_c = y - y_mean.
+
+        Args:
+            X_mean: ndarray = (d,) or (1,d), if None, features are not centered.
+            X_std: ndarray = (d,) or (1,d), if None, features are not scaled.
+            y_mean: ndarray = (n_targets,) or (1,n_targets), if None, targets are not centered.
+
+        Returns:
+            ZtZ: ndarray = (d, d) 
+            Zty: ndarray = (d, n_targets) 
+            yty: ndarray = (n_targets,) sum of squares of y_c.
+        """
+        xp = self.xp
+        n = self.n_samples
+        mu = xp.zeros(self.n_dims) if X_mean is None else array_backend.to_device(X_mean, xp).reshape(-1)
+        y_c = xp.zeros(self.n_targets) if y_mean is None else array_backend.to_device(y_mean, xp).reshape(-1)
+
+        # sum((x - mu)(x - mu)^T), sum((x - mu)(y - y_c)^T) and sum((y - y_c)^2)
+        ZtZ = self.XtX - xp.outer(self.sum_x, mu) - xp.outer(mu, self.sum_x) + n*xp.outer(mu, mu)
+        Zty = self.Xty - xp.outer(self.sum_x, y_c) - xp.outer(mu, self.sum_y) + n*xp.outer(mu, y_c)
+        yty = self.sum_yy - 2*y_c*self.sum_y + n*y_c**2
+
+        if X_std is not None:
+            X_std = array_backend.to_device(X_std, xp).reshape(-1)
+            ZtZ = ZtZ / xp.outer(X_std, X_std)
+            Zty = Zty / X_std[:, None]
+        return ZtZ, Zty, yty
+
+    def r2_score(self, sse):
+        """Returns coefficient of determination, for the sum of squared errors 
+        of predictions of the targets, same as sklearn's r2_score (raw_values).
+
+        Args:
+            sse: ndarray = (..., n_targets) sum of squared errors.
+        """
+        xp = self.xp
+        sst = self.sum_yy - self.sum_y**2/self.n_samples
+        sse = array_backend.to_device(sse, xp)
+        # constant targets are scored 1 for perfect predictions, 0 otherwise..
+        valid = sst > 0
+        score = xp.where(valid, 1 - sse/xp.where(valid, sst, 1), xp.where(sse == 0, 1.0, 0.0))
+        return array_backend.to_numpy(score)
+
+
+
+class StatsCache:
+    """In-memory cache of sufficient statistics (see SufficientStats) of blocks 
+    of stimuli, keyed by (model, session, layer, bin_width, mVocs, tmin, tmax, stim_ids).
+    Least recently used entries are evicted beyond max_entries.
+    """
+    def __init__(self, max_entries=16):
+        """
+        Args:
+            max_entries: int = maximum number of cached blocks, None for no limit.
+        """
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+
+    @staticmethod
+    def block_id(stim_ids):
+        """Order independent identifier for the block of stim_ids."""
+        return tuple(sorted(np.asarray(stim_ids).tolist()))
+
+    def get(self, key):
+        """Returns cached statistics for the key, or None."""
+        stats = self._cache.get(key)
+        if stats is not None:
+            self._cache.move_to_end(key)
+            logger.debug(f"Using cached statistics for {len(key[-1])} stimuli.")
+        return stats
+
+    def put(self, key, stats):
+        """Caches the statistics for the key."""
+        self._cache[key] = stats
+        self._cache.move_to_end(key)
+        if self.max_entries is not None:
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        """Removes all the cached statistics."""
+        self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
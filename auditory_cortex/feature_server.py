@@ -0,0 +1,332 @@
+"""
+Shared-memory server of cached DNN features, for concurrent TRF runs on a node.
+
+The server loads cached features of a model (raw and/or resampled at some bin
+widths) once, and copies each layer into a POSIX shared memory block, along with
+a metadata block (json) of shapes, dtypes, stim_ids and offsets. Blocks are named
+by the key of the features, e.g. (model, dataset, shuffled, mVocs, bin_width, ...),
+so clients (DataLoader) attach by name, in any process (forked or spawned),
+and get read-only NumPy views without reading or copying the features.
+Each layer is tagged with the fingerprint of its raw features on disk,
+clients ignore layers that have been cached again since being served.
+
+Metadata is read again on every attach, and carries the generation id of the
+server that wrote it (and its pid), so clients see a restarted server, and
+layer blocks attached by a client are cached per (name, generation); blocks
+of older generations are closed once the client holds no views into them.
+A server refuses to publish features that a live server is already serving.
+
+Classes:
+    FeatureServer:
+        Publishes features in shared memory, unlinks them on close.
+
+Functions:
+    attach_features(model_name, dataset_name, layer_ids, ...):
+        Returns served features for layers available, {} if not served.
+
+Usage:
+    (server, e.g. scripts/serve_features.py)
+    with FeatureServer('whisper_base', 'ucsf') as server:
+        server.publish(bin_width=None)      # raw features
+        server.publish(bin_width=50)
+        server.wait()
+
+    (client)
+    features = attach_features('whisper_base', 'ucsf', layer_ids=[2, 3], bin_width=50)
+"""
+
+import os
+import json
+import time
+import uuid
+import signal
+import hashlib
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+import auditory_cortex.io_utils.io as io
+
+import logging
+logger = logging.getLogger(__name__)
+
+# layer blocks attached by this process, {(name, generation): block}, kept open
+# while served (views handed out point into them), and blocks of older generations
+# waiting for their views to be released.
+_attached_blocks = {}
+_retired_blocks = []
+
+
+def _features_key(
+        model_name, dataset_name, shuffled=False, mVocs=False, bin_width=None,
+        LPF=False, LPF_analysis_bw=20, pad_time=None,
+    ):
+    """Returns name prefix of shared memory blocks of the features,
+    bin_width=None for raw features."""
+    settings = dict(
+        model=model_name, dataset=dataset_name, shuffled=shuffled, mVocs=mVocs, bin_width=bin_width,
+        )
+    if bin_width is not None:
+        settings.update(LPF=LPF, LPF_analysis_bw=LPF_analysis_bw, pad_time=pad_time)
+    digest = hashlib.sha1(io.settings_to_name(settings).encode()).hexdigest()
+    return f"ac{digest[:20]}"
+
+
+def _open_block(name):
+    """Attaches existing shared memory block, without registering it with the
+    resource tracker (which would unlink it when this process exits)."""
+    try:
+        block = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 has no 'track' argument, registration is skipped instead
+        # (unregistering would also drop the registration of the server)..
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args: None
+        try:
+            block = shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+    return block
+
+
+def _attach_block(name, generation):
+    """Returns layer block attached for the generation of the server, blocks of
+    the same name from older generations are retired (see _close_retired)."""
+    if (name, generation) in _attached_blocks:
+        return _attached_blocks[(name, generation)]
+    block = _open_block(name)
+    for key in [key for key in _attached_blocks if key[0] == name]:
+        _retired_blocks.append(_attached_blocks.pop(key))
+    _attached_blocks[(name, generation)] = block
+    return block
+
+
+def _close_retired():
+    """Closes retired blocks that no view points into anymore."""
+    for block in list(_retired_blocks):
+        try:
+            block.close()
+        except BufferError:
+            continue    # views still in use..
+        _retired_blocks.remove(block)
+
+
+def _read_meta(key):
+    """Returns metadata of the served features, None if not served (or
+    metadata not written yet). Meta block is opened anew on every call."""
+    try:
+        meta_block = _open_block(f"{key}_meta")
+    except FileNotFoundError:
+        return None
+    try:
+        # meta block is zero-filled until the server has written it..
+        size = int.from_bytes(bytes(meta_block.buf[:8]), 'little')
+        meta_bytes = bytes(meta_block.buf[8:8+size])
+    finally:
+        meta_block.close()
+    if size == 0:
+        return None
+    try:
+        return json.loads(meta_bytes.decode())
+    except ValueError:
+        return None
+
+
+def _is_alive(pid):
+    """Returns True if process pid is running (on this node)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def attach_features(
+        model_name, dataset_name, layer_ids, shuffled=False, mVocs=False, bin_width=None,
+        LPF=False, LPF_analysis_bw=20, pad_time=None,
+    ):
+    """Returns read-only views of the features served in shared memory,
+    for the requested layers that are served and not stale.
+
+    Args:
+        model_name: str = name of the DNN model.
+        dataset_name: str = name of the neural dataset.
+        layer_ids: list = layers to return.
+        bin_width: int = bin width (ms) of resampled features, None for raw features.
+        LPF, LPF_analysis_bw, pad_time: settings of resampled features.
+
+    Returns:
+        dict of dict: features[layer_id][stim_id], {} if features are not served.
+    """
+    key = _features_key(
+        model_name, dataset_name, shuffled=shuffled, mVocs=mVocs, bin_width=bin_width,
+        LPF=LPF, LPF_analysis_bw=LPF_analysis_bw, pad_time=pad_time,
+        )
+    _close_retired()
+    meta = _read_meta(key)
+    if meta is None:
+        return {}
+
+    features = {}
+    for layer_id in layer_ids:
+        layer_meta = meta['layers'].get(str(layer_id))
+        if layer_meta is None:
+            continue
+        fingerprint = io.raw_features_fingerprint(
+            model_name, dataset_name, layer_id, shuffled=shuffled, mVocs=mVocs
+            )
+        if fingerprint != layer_meta['fingerprint']:
+            logger.info(f"Served features of layer-{layer_id} are stale, ignoring them.")
+            continue
+        try:
+            block = _attach_block(layer_meta['name'], meta.get('generation'))
+        except FileNotFoundError:
+            continue
+        layer_array = np.ndarray(
+            tuple(layer_meta['shape']), dtype=np.dtype(layer_meta['dtype']), buffer=block.buf
+            )
+        layer_array.flags.writeable = False
+        offsets = layer_meta['offsets']
+        features[layer_id] = {
+            stim_id: layer_array[offsets[i]:offsets[i+1]]
+            for i, stim_id in enumerate(layer_meta['stim_ids'])
+            }
+    if len(features) > 0:
+        logger.info(f"Attached served features of '{model_name}' (bin-width: {bin_width}) for layers: {list(features)}")
+    return features
+
+
+class FeatureServer:
+    def __init__(self, model_name, dataset_name, shuffled=False, mVocs=False):
+        """
+        Args:
+            model_name: str = name of the DNN model.
+            dataset_name: str = name of the neural dataset.
+            shuffled: bool = If True, features of the shuffled network.
+            mVocs: bool = If True, features for mVocs.
+        """
+        self.model_name = model_name
+        self.dataset_name = dataset_name
+        self.shuffled = shuffled
+        self.mVocs = mVocs
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def publish(self, bin_width=None, layer_ids=None, LPF=False, LPF_analysis_bw=20, pad_time=None):
+        """Loads cached features and copies them to shared memory.
+
+        Args:
+            bin_width: int = bin width (ms) of resampled features (cached on disk by
+                DataLoader.get_resampled_DNN_features), None for raw features.
+            layer_ids: list = layers to serve, all cached layers if None (required
+                for resampled features).
+            LPF, LPF_analysis_bw, pad_time: settings of resampled features.
+
+        Returns:
+            list = layers published.
+
+        Raises:
+            RuntimeError: if another (live) server is serving these features.
+        """
+        kwargs = dict(shuffled=self.shuffled, mVocs=self.mVocs)
+        if bin_width is None:
+            features = io.read_cached_features(
+                self.model_name, dataset_name=self.dataset_name, layer_ids=layer_ids, **kwargs
+                )
+        else:
+            assert layer_ids is not None, "layer_ids must be given for resampled features."
+            features = io.read_resampled_features(
+                self.model_name, self.dataset_name, bin_width, layer_ids, LPF=LPF,
+                LPF_analysis_bw=LPF_analysis_bw, pad_time=pad_time, **kwargs
+                )
+        if not features:
+            logger.warning(f"No cached features found for '{self.model_name}' (bin-width: {bin_width}).")
+            return []
+
+        key = _features_key(
+            self.model_name, self.dataset_name, bin_width=bin_width, LPF=LPF,
+            LPF_analysis_bw=LPF_analysis_bw, pad_time=pad_time, **kwargs
+            )
+        served = _read_meta(key)
+        if served is not None and served.get('pid') != os.getpid() and _is_alive(served.get('pid', -1)):
+            raise RuntimeError(
+                f"Features of '{self.model_name}' (bin-width: {bin_width}) are already served "
+                f"by process {served['pid']}."
+                )
+        meta = {'generation': uuid.uuid4().hex, 'pid': os.getpid(), 'layers': {}}
+        for layer_id, layer_features in features.items():
+            stim_ids = list(layer_features.keys())
+            arrays = [np.asarray(layer_features[stim_id]) for stim_id in stim_ids]
+            offsets = np.cumsum([0] + [arr.shape[0] for arr in arrays])
+            shape = (int(offsets[-1]),) + arrays[0].shape[1:]
+            name = f"{key}_l{layer_id}"
+            block = self._create_block(name, max(1, int(np.prod(shape))*arrays[0].dtype.itemsize))
+            layer_array = np.ndarray(shape, dtype=arrays[0].dtype, buffer=block.buf)
+            for arr, start, end in zip(arrays, offsets[:-1], offsets[1:]):
+                layer_array[start:end] = arr
+            del layer_array
+            meta['layers'][str(layer_id)] = {
+                'name': name, 'shape': list(shape), 'dtype': arrays[0].dtype.str,
+                'stim_ids': [_to_builtin(stim_id) for stim_id in stim_ids],
+                'offsets': offsets.tolist(),
+                'fingerprint': io.raw_features_fingerprint(
+                    self.model_name, self.dataset_name, layer_id, **kwargs
+                    ),
+                }
+        # metadata last, clients see the features only once all layers are copied..
+        meta_bytes = json.dumps(meta).encode()
+        meta_block = self._create_block(f"{key}_meta", 8 + len(meta_bytes))
+        meta_block.buf[8:8+len(meta_bytes)] = meta_bytes
+        meta_block.buf[:8] = len(meta_bytes).to_bytes(8, 'little')
+        logger.info(f"Serving features of '{self.model_name}' (bin-width: {bin_width}) for layers: {list(features)}")
+        return list(features.keys())
+
+    def _create_block(self, name, size):
+        """Creates shared memory block, replacing a block left over by a server
+        that did not exit cleanly, (publish checks that no live server uses it)."""
+        try:
+            block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.blocks.append(block)
+        return block
+
+    def wait(self):
+        """Serves until interrupted (SIGINT/SIGTERM)."""
+        signal.signal(signal.SIGTERM, _raise_interrupt)
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            logger.info(f"Stopping feature server...")
+
+    def close(self):
+        """Unlinks all shared memory blocks, (views attached by clients
+        remain valid until the clients exit)."""
+        # metadata first, so that no new client attaches..
+        for block in reversed(self.blocks):
+            try:
+                block.close()
+                block.unlink()
+            except FileNotFoundError:
+                pass
+        self.blocks = []
+
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def _to_builtin(value):
+    """Returns python int/str for numpy scalars (json serializable)."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
@@ -1 +1,2 @@
-from .results_manager import ResultsManager
\ No newline at end of file
+from .results_manager import ResultsManager
+from .results_store import ResultsStore, results_exist, read_results
@@ -0,0 +1,289 @@
+"""
+Streaming writer of per-layer feature arrays.
+
+Features of each stimulus are appended to per-layer .npy files as soon as they
+are extracted, so memory is bounded by features of one stimulus. Finished files
+have the same format as io.write_feature_arrays (contiguous layer array and an
+index of stim_ids and offsets), and are read by io.read_feature_arrays.
+Layer arrays are never replaced in place, each write goes to a new (versioned)
+array file recorded in the index, so replacing the index swaps array and index
+as one unit (see replace_index).
+
+While writing, layer arrays are kept as '<layer array>.tmp' files with a fixed
+size .npy header, and a journal (one json line per stimulus) records the number
+of frames of each stimulus. A journal line is written only after features of
+all layers are flushed, so after a crash, writer is resumed from the journal
+(layer files truncated to the journaled stimuli) and only missing stimuli
+need to be extracted. Optional info of each stimulus (e.g. hashes of its
+audio and extractor, see io.read_features_manifest) is kept in the journal.
+The writer holds an exclusive lock (fcntl) on '<journal>.lock' for the life of
+the stream, so concurrent writers of the same cache wait for each other instead
+of truncating each other's files. Previously completed layers stay readable
+until finalize replaces their indexes.
+
+Classes:
+    StreamingFeatureWriter:
+        Appends features one stimulus at a time, resumes partially written caches.
+
+Functions:
+    versioned_array_path(dir_path, file_name, layer_id):
+        Returns a new (unique) path for the array of a layer.
+    index_array_path(index_path, index):
+        Returns path of the array recorded in the index.
+    replace_index(index_path, array_path, **index):
+        Writes the index of array_path, replacing the index (and array) written before.
+
+Usage:
+    writer = StreamingFeatureWriter(dir_path, file_name, layer_ids)
+    for stim_id, features in extractor.iter_features(pending_audios, ...):
+        writer.append(stim_id, features)
+    writer.finalize()   # also releases the lock, (or writer.close() to abandon the stream)
+"""
+
+import os
+import json
+import uuid
+import fcntl
+import struct
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class StreamingFeatureWriter:
+    HEADER_SIZE = 128   # bytes, fixed size .npy header, rewritten with final shape.
+
+    def __init__(self, dir_path, file_name, layer_ids, dtype=np.float32, resume=True):
+        """
+        Args:
+            dir_path: str = directory to write to.
+            file_name: str = prefix of the file names.
+            layer_ids: list = layers to be written.
+            dtype: dtype = dtype of the stored features.
+            resume: bool = If True, resumes the interrupted stream (if any),
+                otherwise starts over.
+        """
+        self.dir_path = dir_path
+        self.file_name = file_name
+        self.layer_ids = [int(layer_id) for layer_id in layer_ids]
+        self.dtype = np.dtype(dtype)
+        self.journal_path = self.journal_file_path(dir_path, file_name)
+        self._lock_file = self._acquire_lock(self.lock_file_path(dir_path, file_name))
+        self.stim_ids = []
+        self.frames = {layer_id: [] for layer_id in self.layer_ids}
+        self.row_shapes = {}
+        self.stim_info = {}
+        if not (resume and self._resume()):
+            self._start()
+
+    @staticmethod
+    def journal_file_path(dir_path, file_name):
+        """Returns path of the journal, exists only while writing (or if interrupted)."""
+        return os.path.join(dir_path, f"{file_name}_journal.jsonl")
+
+    @staticmethod
+    def lock_file_path(dir_path, file_name):
+        """Returns path of the lock file, locked by the writer while the stream is open."""
+        return os.path.join(dir_path, f"{file_name}_journal.lock")
+
+    @staticmethod
+    def is_locked(dir_path, file_name):
+        """Returns True if a writer (of any process) has the stream open."""
+        lock_path = StreamingFeatureWriter.lock_file_path(dir_path, file_name)
+        if not os.path.exists(lock_path):
+            return False
+        with open(lock_path, 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+    @staticmethod
+    def _acquire_lock(lock_path):
+        """Returns the lock file, exclusively locked, waits for the writer holding it."""
+        lock_file = open(lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info(f"Waiting for another writer of {lock_path} to finish...")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def close(self):
+        """Releases the lock, stream (if not finalized) can be resumed later."""
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def done_stim_ids(self):
+        """Stimuli already written (including those of the resumed run)."""
+        return set(self.stim_ids)
+
+    def _array_path(self, layer_id):
+        return os.path.join(self.dir_path, f"{self.file_name}_layer{layer_id:02}.npy")
+
+    def _index_path(self, layer_id):
+        return os.path.join(self.dir_path, f"{self.file_name}_layer{layer_id:02}_index.npz")
+
+    def _start(self):
+        """Starts a new stream, previously completed layers stay valid (and
+        readable) until finalize replaces their indexes."""
+        for layer_id in self.layer_ids:
+            with open(self._array_path(layer_id)+'.tmp', 'wb') as f:
+                f.write(self._header((0,)))
+        with open(self.journal_path, 'w') as f:
+            f.write(json.dumps({'layer_ids': self.layer_ids, 'dtype': self.dtype.str}) + '\n')
+
+    def _resume(self):
+        """Reads journal of an interrupted stream, returns False if there
+        is nothing to resume (or journal was written for other settings)."""
+        if not os.path.exists(self.journal_path):
+            return False
+        with open(self.journal_path) as f:
+            lines = f.read().split('\n')
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            return False
+        if header.get('layer_ids') != self.layer_ids or header.get('dtype') != self.dtype.str:
+            logger.info(f"Journal at {self.journal_path} was written for other settings, starting over.")
+            return False
+        if not all([os.path.exists(self._array_path(layer_id)+'.tmp') for layer_id in self.layer_ids]):
+            return False
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break   # partially written last line..
+            self.stim_ids.append(entry['stim_id'])
+            self.stim_info[str(entry['stim_id'])] = entry.get('info')
+            for layer_id in self.layer_ids:
+                self.frames[layer_id].append(entry['frames'][str(layer_id)])
+            self.row_shapes = {int(k): tuple(v) for k, v in entry['row_shapes'].items()}
+        # drop features written after the last journaled stimulus..
+        for layer_id in self.layer_ids:
+            row_size = int(np.prod(self.row_shapes.get(layer_id, ())))
+            size = self.HEADER_SIZE + sum(self.frames[layer_id])*row_size*self.dtype.itemsize
+            with open(self._array_path(layer_id)+'.tmp', 'r+b') as f:
+                f.truncate(size)
+        with open(self.journal_path, 'w') as f:
+            f.write('\n'.join(lines[:len(self.stim_ids)+1]) + '\n')
+        logger.info(f"Resuming cache at {self.dir_path}, {len(self.stim_ids)} stimuli already written.")
+        return True
+
+    def append(self, stim_id, features, info=None):
+        """Appends features of a stimulus to all layers.
+
+        Args:
+            stim_id: stimulus ID.
+            features: dict = {layer_id: (time, num_features)}
+            info: dict = optional (json serializable) info of the stimulus,
+                kept in stim_info (keyed by str(stim_id)).
+        """
+        frames = {}
+        for layer_id in self.layer_ids:
+            feats = features[layer_id]
+            if hasattr(feats, 'detach'):
+                feats = feats.detach().cpu().numpy()
+            feats = np.ascontiguousarray(feats, dtype=self.dtype)
+            if layer_id in self.row_shapes and feats.shape[1:] != self.row_shapes[layer_id]:
+                raise ValueError(
+                    f"Features of '{stim_id}' for layer-{layer_id} have shape {feats.shape}, "
+                    f"expected (time,)+{self.row_shapes[layer_id]}."
+                    )
+            self.row_shapes[layer_id] = feats.shape[1:]
+            with open(self._array_path(layer_id)+'.tmp', 'ab') as f:
+                f.write(feats.tobytes())
+            frames[str(layer_id)] = int(feats.shape[0])
+        entry = {
+            'stim_id': _to_builtin(stim_id), 'frames': frames,
+            'row_shapes': {str(k): list(v) for k, v in self.row_shapes.items()},
+            'info': info,
+            }
+        with open(self.journal_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.stim_ids.append(entry['stim_id'])
+        self.stim_info[str(entry['stim_id'])] = info
+        for layer_id in self.layer_ids:
+            self.frames[layer_id].append(frames[str(layer_id)])
+
+    def finalize(self):
+        """Writes final shapes in the headers, renames layer arrays and
+        writes the indexes (same format as io.write_feature_arrays)."""
+        for layer_id in self.layer_ids:
+            offsets = np.cumsum([0] + self.frames[layer_id])
+            shape = (int(offsets[-1]),) + tuple(self.row_shapes.get(layer_id, ()))
+            tmp_path = self._array_path(layer_id)+'.tmp'
+            with open(tmp_path, 'r+b') as f:
+                f.write(self._header(shape))
+            array_path = versioned_array_path(self.dir_path, self.file_name, layer_id)
+            os.replace(tmp_path, array_path)
+            replace_index(
+                self._index_path(layer_id), array_path,
+                stim_ids=np.asarray(self.stim_ids), offsets=offsets,
+                )
+        os.remove(self.journal_path)
+        self.close()
+        logger.info(f"Features of {len(self.stim_ids)} stimuli saved to: {self.dir_path}")
+
+    def _header(self, shape):
+        """Returns .npy (version 1.0) header of HEADER_SIZE bytes."""
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            np.lib.format.dtype_to_descr(self.dtype), tuple(shape)
+            )
+        magic = np.lib.format.magic(1, 0)
+        header_len = self.HEADER_SIZE - len(magic) - 2
+        if len(header) + 1 > header_len:
+            raise ValueError(f"Shape {shape} does not fit in the header.")
+        return magic + struct.pack('<H', header_len) + (header.ljust(header_len - 1) + '\n').encode('latin1')
+
+
+def versioned_array_path(dir_path, file_name, layer_id):
+    """Returns a new path for the array of the layer, unique to the process
+    and the call, (arrays are never overwritten, see replace_index)."""
+    version = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+    return os.path.join(dir_path, f"{file_name}_layer{layer_id:02}.{version}.npy")
+
+def index_array_path(index_path, index):
+    """Returns path of the array recorded in the (loaded) index, indexes
+    written before arrays were versioned refer to '<prefix>_layerXX.npy'."""
+    if 'array_file' in index.files:
+        return os.path.join(os.path.dirname(index_path), str(index['array_file']))
+    return index_path[:-len('_index.npz')] + '.npy'
+
+def replace_index(index_path, array_path, **index):
+    """Writes index (e.g. stim_ids, offsets) of the array at array_path and
+    replaces the index written before with one os.replace, so readers see
+    either the old or the new array. Array of the old index is removed,
+    (readers that have memory-mapped it keep their view of it).
+
+    Args:
+        index_path: str = path of the index.
+        array_path: str = path of the (fully written) array, see versioned_array_path.
+        **index: arrays saved in the index.
+    """
+    old_array_path = None
+    try:
+        with np.load(index_path) as old_index:
+            old_array_path = index_array_path(index_path, old_index)
+    except FileNotFoundError:
+        pass
+    tmp_path = index_path + f".{os.getpid()}-{uuid.uuid4().hex[:12]}.tmp.npz"
+    np.savez(tmp_path, array_file=np.asarray(os.path.basename(array_path)), **index)
+    os.replace(tmp_path, index_path)
+    if old_array_path is not None and old_array_path != array_path:
+        try:
+            os.remove(old_array_path)
+        except FileNotFoundError:
+            pass
+
+def _to_builtin(value):
+    """Returns python int/str for numpy scalars (json serializable)."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
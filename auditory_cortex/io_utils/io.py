@@ -4,8 +4,12 @@ import numpy as np
 import pandas as pd
 import gzip
 import pickle
+import shutil
+import json
+import hashlib
 from auditory_cortex import opt_inputs_dir, results_dir, cache_dir, normalizers_dir, saved_corr_dir
-from auditory_cortex import valid_model_names
+from auditory_cortex import valid_model_names, config
+from .feature_writer import StreamingFeatureWriter, versioned_array_path, index_array_path, replace_index
 from memory_profiler import profile
 import logging
 logger = logging.getLogger(__name__)
@@ -223,6 +227,72 @@ def write_inter_trial_corr_dists(
     write_dict(norm_dist, os.path.join(norm_dir, filename))
     write_dict(null_dist, os.path.join(null_dir, filename))
 
+def _normalizer_checkpoint_dir(job_name, mVocs=False, dataset_name='ucsf'):
+    """Returns directory holding chunk checkpoints of a normalizer job."""
+    if dataset_name != 'ucsf':
+        parent_dir = os.path.join(normalizers_dir, dataset_name)
+    else:
+        parent_dir = normalizers_dir
+    if mVocs:
+        parent_dir = os.path.join(parent_dir, 'mVocs')
+    return os.path.join(parent_dir, 'checkpoints', job_name)
+
+def write_normalizer_chunk(
+        norm_dist, null_dist, channel_ids, job_name, chunk_idx, mVocs=False, dataset_name='ucsf'
+        ):
+    """Writes (partial) distributions of normalizers computed for a chunk of 
+    iterations of a job, so that interrupted jobs can be resumed.
+
+    Args:
+        norm_dist: ndarray = (chunk_itr, num_channels) True distribution.
+        null_dist: ndarray = (chunk_itr, num_channels) Null distribution.
+        channel_ids: list = channel ids of columns.
+        job_name: str = name identifying the job (settings, seed and chunk size).
+        chunk_idx: int = index of the chunk.
+    """
+    dir_path = _normalizer_checkpoint_dir(job_name, mVocs=mVocs, dataset_name=dataset_name)
+    os.makedirs(dir_path, exist_ok=True)
+    file_path = os.path.join(dir_path, f"chunk_{chunk_idx:05d}.npz")
+    tmp_path = file_path + '.tmp.npz'
+    np.savez(tmp_path, norm_dist=norm_dist, null_dist=null_dist, channel_ids=np.asarray(channel_ids))
+    os.replace(tmp_path, file_path)
+
+def read_normalizer_chunks(job_name, mVocs=False, dataset_name='ucsf'):
+    """Reads chunk checkpoints of a normalizer job.
+
+    Returns:
+        dict: {chunk_idx: (norm_dist, null_dist, channel_ids)}
+    """
+    dir_path = _normalizer_checkpoint_dir(job_name, mVocs=mVocs, dataset_name=dataset_name)
+    chunks = {}
+    if not os.path.exists(dir_path):
+        return chunks
+    pattern = re.compile(r'chunk_(\d+)\.npz$')
+    for filename in os.listdir(dir_path):
+        match = pattern.match(filename)
+        if match is None:
+            continue
+        with np.load(os.path.join(dir_path, filename)) as data:
+            chunks[int(match.group(1))] = (
+                data['norm_dist'], data['null_dist'], data['channel_ids'].tolist()
+                )
+    return chunks
+
+def list_normalizer_chunks(job_name, mVocs=False, dataset_name='ucsf'):
+    """Returns indices of the chunks checkpointed for the normalizer job."""
+    dir_path = _normalizer_checkpoint_dir(job_name, mVocs=mVocs, dataset_name=dataset_name)
+    if not os.path.exists(dir_path):
+        return []
+    pattern = re.compile(r'chunk_(\d+)\.npz$')
+    matches = [pattern.match(filename) for filename in os.listdir(dir_path)]
+    return sorted([int(match.group(1)) for match in matches if match is not None])
+
+def clear_normalizer_chunks(job_name, mVocs=False, dataset_name='ucsf'):
+    """Deletes chunk checkpoints of the normalizer job (once the job is saved)."""
+    dir_path = _normalizer_checkpoint_dir(job_name, mVocs=mVocs, dataset_name=dataset_name)
+    if os.path.exists(dir_path):
+        shutil.rmtree(dir_path)
+
 #-----------      cache bootstrap median dist    -----------
 
 def read_bootstrap_median_dist(
@@ -1040,29 +1110,12 @@ def delete_saved_RDM(model_name, identifier, bin_width):
         logger.info(f"File does not exist.")
 
 
-def read_cached_features(model_name, dataset_name, contextualized=False, shuffled=False, mVocs=False):
-    """Retrieves cached features from the cache_dir, returns None if 
-    features not cached already. 
-
-    Args:
-        model_name: str specifying model name, possible choices are
-            ['wav2letter_modified', 'wav2vec2', 'speech2text',
-            'deepspeech2', 'whiper_tiny', 'whisper_base', 'whisper_small']
-    """
-    assert model_name in valid_model_names, f"Invalid model name '{model_name}' specified!"
-    logger.info(f"Reading features for model: {model_name}")
-    
-    # if contextualized:
-    #     logger.info(f"Reading contextualized features...")
-    #     file_name = f"{model_name}_raw_features_contextualized.pkl"
-    # else:
-    #     file_name = f"{model_name}_raw_features.pkl"
-    
+def _cached_features_dir(model_name, dataset_name, shuffled=False, mVocs=False):
+    """Returns directory of cached (raw) features, creates if needed."""
     if mVocs:
         directory = os.path.join(cache_dir, 'mVocs')
     else:
         directory = cache_dir
-
     directory = os.path.join(directory, dataset_name)
     if shuffled:
         dir_path = os.path.join(directory, model_name, 'shuffled')
@@ -1071,47 +1124,76 @@ def read_cached_features(model_name, dataset_name, contextualized=False, shuffle
     # make sure directory structure is in place...
     if not os.path.exists(dir_path):
         os.makedirs(dir_path)
+    return dir_path
+
+def read_cached_features(
+        model_name, dataset_name, contextualized=False, shuffled=False, mVocs=False,
+        layer_ids=None, stim_ids=None,
+    ):
+    """Retrieves cached features from the cache_dir, returns None if 
+    features not cached already. Features are memory-mapped (see write_feature_arrays),
+    so only the layers (and stimuli) requested are read, lazily and without copies.
+    Falls back to legacy (npz) cache format, if features were cached in that format.
+
+    Args:
+        model_name: str specifying model name, possible choices are
+            ['wav2letter_modified', 'wav2vec2', 'speech2text',
+            'deepspeech2', 'whiper_tiny', 'whisper_base', 'whisper_small']
+        layer_ids: list = layers to read, reads all layers if None.
+        stim_ids: list = stimuli to read, reads all stimuli if None.
+
+    Returns:
+        dict of dict: read this as features[layer_id][stim_id]
+    """
+    assert model_name in valid_model_names, f"Invalid model name '{model_name}' specified!"
+    logger.info(f"Reading features for model: {model_name}")
+    dir_path = _cached_features_dir(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+    file_name = f"{model_name}_raw_features"
+
+    features = read_feature_arrays(dir_path, file_name, layer_ids=layer_ids, stim_ids=stim_ids)
+    if features is not None:
+        return features
+    return _read_legacy_cached_features(dir_path, layer_ids=layer_ids, stim_ids=stim_ids)
+
+def _read_legacy_cached_features(dir_path, layer_ids=None, stim_ids=None):
+    """Reads features cached as pickled dict per layer (np.savez_compressed)."""
     features = {}
     filenames = os.listdir(dir_path)
     if len(filenames) > 0:
         filenames.sort()
     for filename in filenames:
-        if '.npz' in filename:
+        if '.npz' in filename and '_index' not in filename:
+            layer_id = int(filename.split('layer')[-1].split('.')[0])
+            if layer_ids is not None and layer_id not in layer_ids:
+                continue
             loaded_data = np.load(os.path.join(dir_path, filename), allow_pickle=True)
-            # loaded_dict = dict(loaded_data)
             loaded_dict = loaded_data['layer_features'].item()
-            layer_id = filename.split('layer')[-1].split('.')[0]
-            features[int(layer_id)] = loaded_dict
+            if stim_ids is not None:
+                loaded_dict = {stim_id: loaded_dict[stim_id] for stim_id in stim_ids}
+            features[layer_id] = loaded_dict
     
     if len(features) > 0:
+        logger.info(f"Features read from legacy (npz) cache, re-cache for faster loading.")
         return features
     else:   
         return None
 
-    # file_path = os.path.join(dir_path, file_name+'.gz')
-    # if os.path.exists(file_path):
-    #     logger.info(f"Reading raw features from {file_path}")
-    #     # Load and decompress
-    #     with gzip.open(file_path, 'rb') as f:
-    #         features = pickle.load(f)
-    #     # with open(file_path, 'rb') as F:
-    #     #     features = pickle.load(F)
-    #     return features
-    # else:
-    #     return None
-
 # @profile
 def write_cached_features(
         model_name, features, dataset_name, verbose=True, contextualized=False, shuffled=False,
-        mVocs=False):
-    """Writes features to the cache_dir,
+        mVocs=False, dtype=None):
+    """Writes features to the cache_dir, in memory-mappable format (see write_feature_arrays).
 
     Args:
         model_name: str specifying model name, possible choices are
             ['wav2letter_modified', 'wav2vec2', 'speech2text',
             'deepspeech2', 'whiper_tiny', 'whisper_base', 'whisper_small']
-        features: list = features for each layers as a list of dictionaries 
+        features: dict of dict = features[layer_id][stim_id]
+        dtype: str = 'float32' or 'float16', dtype of the stored features,
+            if None, uses 'feature_cache_dtype' of config (default 'float32').
     """
+    if dtype is None:
+        dtype = config.get('feature_cache_dtype', 'float32')
     assert model_name in valid_model_names, f"Invalid model name '{model_name}' specified!"
     logger.info(f"Saving features for model: {model_name}")
     if contextualized:
@@ -1119,38 +1201,338 @@ def write_cached_features(
         file_name = f"{model_name}_raw_features_contextualized"
     else:
         file_name = f"{model_name}_raw_features"
+    dir_path = _cached_features_dir(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+
+    for layer_id, layer_features in features.items():
+        logger.info(f"Saving features for layer: {layer_id}")
+        write_feature_arrays(dir_path, file_name, layer_id, layer_features, dtype=dtype)
+
+    logger.info(f"All layer features saved to: {dir_path}")
+
+def open_cached_features_writer(
+        model_name, dataset_name, layer_ids, shuffled=False, mVocs=False, dtype=None, resume=True,
+    ):
+    """Returns StreamingFeatureWriter for cached (raw) features, features of each
+    stimulus are written as soon as extracted. Resumes the interrupted
+    caching run if there is one, (see writer.done_stim_ids).
+
+    Args:
+        model_name: str = name of the DNN model.
+        dataset_name: str = name of the neural dataset.
+        layer_ids: list = layers to be written.
+        dtype: str = 'float32' or 'float16', dtype of the stored features,
+            if None, uses 'feature_cache_dtype' of config (default 'float32').
+        resume: bool = If False, interrupted run is discarded.
+    """
+    if dtype is None:
+        dtype = config.get('feature_cache_dtype', 'float32')
+    assert model_name in valid_model_names, f"Invalid model name '{model_name}' specified!"
+    dir_path = _cached_features_dir(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+    return StreamingFeatureWriter(
+        dir_path, f"{model_name}_raw_features", layer_ids, dtype=dtype, resume=resume
+        )
+
+def is_features_caching_interrupted(model_name, dataset_name, shuffled=False, mVocs=False):
+    """Returns True if caching of (raw) features was interrupted and can be resumed,
+    (False while another writer is still caching them)."""
+    dir_path = _cached_features_dir(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+    file_name = f"{model_name}_raw_features"
+    return os.path.exists(
+        StreamingFeatureWriter.journal_file_path(dir_path, file_name)
+        ) and not StreamingFeatureWriter.is_locked(dir_path, file_name)
+
+def _features_manifest_path(model_name, dataset_name, shuffled=False, mVocs=False):
+    dir_path = _cached_features_dir(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+    return os.path.join(dir_path, f"{model_name}_raw_features_manifest.json")
+
+def read_features_manifest(model_name, dataset_name, shuffled=False, mVocs=False):
+    """Returns manifest of cached (raw) features, {str(stim_id): info} where info
+    is {'audio': hash of audio, 'extractor': fingerprint of feature extractor,
+    'pad_time': padding}, entries not matching the current info are stale.
+    Empty dict if features were cached without a manifest.
+    """
+    file_path = _features_manifest_path(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path) as f:
+        manifest = json.load(f)
+    return manifest.get('entries', {})
+
+def write_features_manifest(model_name, dataset_name, entries, shuffled=False, mVocs=False):
+    """Writes manifest of cached (raw) features (see read_features_manifest).
+
+    Args:
+        entries: dict = {str(stim_id): info} for all stimuli of the cache.
+    """
+    file_path = _features_manifest_path(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+    manifest = {
+        'model_name': model_name, 'dataset_name': dataset_name,
+        'shuffled': shuffled, 'mVocs': mVocs, 'entries': entries,
+        }
+    with open(file_path+'.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(file_path+'.tmp', file_path)
+    logger.info(f"Manifest of {len(entries)} stimuli saved to: {file_path}")
+
+def audio_fingerprint(audio, sampling_rate):
+    """Returns hash of the audio samples and sampling rate."""
+    audio = np.ascontiguousarray(audio)
+    digest = hashlib.sha1(f"{audio.dtype.str}-{audio.shape}-{sampling_rate}".encode())
+    digest.update(audio.tobytes())
+    return digest.hexdigest()
+
+def write_feature_arrays(dir_path, file_name, layer_id, layer_features, dtype=np.float32, fingerprint=None):
+    """Writes features of a layer as one contiguous (uncompressed) array, 
+    stimuli concatenated along time axis, and an index of stim_ids and 
+    offsets, so that features can be memory-mapped by read_feature_arrays.
+    Array is written to a new (versioned) file and the index recording it is
+    replaced last, so partially written layers are never read and concurrent
+    readers see either the old or the new array with its own index.
+
+    Args:
+        dir_path: str = directory to write to.
+        file_name: str = prefix of the file names.
+        layer_id: int = layer ID.
+        layer_features: dict = {stim_id: (time, num_features)}
+        dtype: dtype = dtype of the stored features.
+        fingerprint: str = optional fingerprint of the source of features, saved
+            with the index and checked by read_feature_arrays.
+    """
+    stim_ids = list(layer_features.keys())
+    arrays = [_as_numpy(layer_features[stim_id]) for stim_id in stim_ids]
+    offsets = np.cumsum([0] + [arr.shape[0] for arr in arrays])
+    
+    array_path = versioned_array_path(dir_path, file_name, layer_id)
+    index_path = os.path.join(dir_path, f"{file_name}_layer{layer_id:02}_index.npz")
+    layer_array = np.lib.format.open_memmap(
+        array_path+'.tmp', mode='w+', dtype=dtype,
+        shape=(int(offsets[-1]),) + arrays[0].shape[1:]
+        )
+    for arr, start, end in zip(arrays, offsets[:-1], offsets[1:]):
+        layer_array[start:end] = arr
+    layer_array.flush()
+    del layer_array
+    os.replace(array_path+'.tmp', array_path)
+    index = {'stim_ids': np.asarray(stim_ids), 'offsets': offsets}
+    if fingerprint is not None:
+        index['fingerprint'] = np.asarray(fingerprint)
+    replace_index(index_path, array_path, **index)
+
+def read_feature_arrays(
+        dir_path, file_name, layer_ids=None, stim_ids=None, mmap_mode='r', fingerprints=None
+    ):
+    """Reads features written by write_feature_arrays, returns None if 
+    not found. Features of each stimulus are (zero-copy) views of the 
+    memory-mapped layer array. Requested stimuli missing from the cache
+    are skipped (and logged).
+
+    Args:
+        dir_path: str = directory to read from.
+        file_name: str = prefix of the file names.
+        layer_ids: list = layers to read, reads all layers if None.
+        stim_ids: list = stimuli to read, reads all stimuli if None.
+        mmap_mode: str = mmap_mode of np.load, None reads to memory.
+        fingerprints: dict = {layer_id: fingerprint}, layers saved with a different 
+            fingerprint (i.e. stale) are treated as missing.
+
+    Returns:
+        dict of dict: read this as features[layer_id][stim_id]
+    """
+    if not os.path.exists(dir_path):
+        return None
+    pattern = re.compile(re.escape(file_name) + r'_layer(\d+)_index\.npz$')
+    features = {}
+    for filename in sorted(os.listdir(dir_path)):
+        match = pattern.match(filename)
+        if match is None:
+            continue
+        layer_id = int(match.group(1))
+        if layer_ids is not None and layer_id not in layer_ids:
+            continue
+        index_path = os.path.join(dir_path, filename)
+        layer_array = None
+        for _ in range(3):
+            try:
+                with np.load(index_path) as index:
+                    layer_stim_ids = index['stim_ids'].tolist()
+                    offsets = index['offsets']
+                    fingerprint = str(index['fingerprint']) if 'fingerprint' in index.files else None
+                    array_path = index_array_path(index_path, index)
+                layer_array = np.load(array_path, mmap_mode=mmap_mode)
+                break
+            except FileNotFoundError:
+                # index (and array) replaced by a concurrent writer, read the new index..
+                continue
+        if layer_array is None:
+            logger.info(f"Cached features of layer-{layer_id} could not be read, ignoring them.")
+            continue
+        if fingerprints is not None and fingerprint != fingerprints.get(layer_id):
+            logger.info(f"Cached features of layer-{layer_id} are stale, ignoring them.")
+            continue
+        positions = {stim_id: i for i, stim_id in enumerate(layer_stim_ids)}
+        if stim_ids is None:
+            stim_ids_to_read = layer_stim_ids
+        else:
+            stim_ids_to_read = [stim_id for stim_id in stim_ids if stim_id in positions]
+            if len(stim_ids_to_read) < len(stim_ids):
+                missing = [stim_id for stim_id in stim_ids if stim_id not in positions]
+                logger.warning(f"Cached features of layer-{layer_id} missing for stimuli: {missing}")
+        features[layer_id] = {
+            stim_id: layer_array[offsets[positions[stim_id]]:offsets[positions[stim_id]+1]]
+            for stim_id in stim_ids_to_read
+            }
+    if len(features) == 0:
+        return None
+    if layer_ids is not None and len(features) < len(layer_ids):
+        logger.debug(f"Cached features missing for layers: {set(layer_ids) - set(features)}")
+        return None
+    return features
+
+def raw_features_fingerprint(model_name, dataset_name, layer_id, shuffled=False, mVocs=False):
+    """Returns fingerprint (size and modification time) of the cached raw features
+    of the layer, changes whenever raw features are cached again, (index is replaced
+    with every write). None if not cached."""
+    dir_path = _cached_features_dir(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs)
+    for suffix in ['_index.npz', '.npz']:
+        file_path = os.path.join(dir_path, f"{model_name}_raw_features_layer{layer_id:02}{suffix}")
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            return f"{stat.st_size}-{stat.st_mtime_ns}"
+    return None
+
+def _resampled_features_dir_and_name(
+        model_name, dataset_name, bin_width, shuffled=False, mVocs=False, 
+        LPF=False, LPF_analysis_bw=20, pad_time=None
+    ):
+    """Returns directory and file name prefix of resampled features cache,
+    name identifies (bin_width, LPF, pad_time) of the resampling."""
+    dir_path = os.path.join(
+        _cached_features_dir(model_name, dataset_name, shuffled=shuffled, mVocs=mVocs),
+        'resampled'
+        )
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+    pad_ms = 0 if pad_time is None else int(round(pad_time*1000))
+    file_name = f"{model_name}_bw{bin_width}_pad{pad_ms}"
+    if LPF:
+        file_name += f"_LPF{LPF_analysis_bw}"
+    return dir_path, file_name
+
+def read_resampled_features(
+        model_name, dataset_name, bin_width, layer_ids, shuffled=False, mVocs=False,
+        LPF=False, LPF_analysis_bw=20, pad_time=None,
+    ):
+    """Reads (memory-mapped) features resampled at bin_width, for the layers
+    whose raw features have not changed since resampled features were cached.
+
+    Args:
+        model_name: str = name of the DNN model.
+        dataset_name: str = name of the neural dataset.
+        bin_width: int = bin width in ms.
+        layer_ids: list = layers to read.
+        LPF: bool = If True, features low-pass filtered at bin_width and 
+            resampled at LPF_analysis_bw.
+        pad_time: float = padding (in seconds) before each stimulus.
+
+    Returns:
+        dict of dict: features[layer_id][stim_id], only for the layers found.
+    """
+    dir_path, file_name = _resampled_features_dir_and_name(
+        model_name, dataset_name, bin_width, shuffled=shuffled, mVocs=mVocs,
+        LPF=LPF, LPF_analysis_bw=LPF_analysis_bw, pad_time=pad_time
+        )
+    features = {}
+    for layer_id in layer_ids:
+        fingerprint = raw_features_fingerprint(
+            model_name, dataset_name, layer_id, shuffled=shuffled, mVocs=mVocs
+            )
+        if fingerprint is None:
+            continue
+        layer_features = read_feature_arrays(
+            dir_path, file_name, layer_ids=[layer_id], fingerprints={layer_id: fingerprint}
+            )
+        if layer_features is not None:
+            features.update(layer_features)
+    if len(features) > 0:
+        logger.info(f"Read cached resampled features (bin-width: {bin_width}) for layers: {list(features)}")
+    return features
+
+def write_resampled_features(
+        model_name, features, dataset_name, bin_width, shuffled=False, mVocs=False,
+        LPF=False, LPF_analysis_bw=20, pad_time=None, dtype=None,
+    ):
+    """Writes features resampled at bin_width (see read_resampled_features),
+    tagged with the fingerprint of raw features they were computed from.
 
+    Args:
+        features: dict of dict = features[layer_id][stim_id]
+        dtype: str = 'float32' or 'float16', if None, uses 'feature_cache_dtype' of config.
+    """
+    if dtype is None:
+        dtype = config.get('feature_cache_dtype', 'float32')
+    dir_path, file_name = _resampled_features_dir_and_name(
+        model_name, dataset_name, bin_width, shuffled=shuffled, mVocs=mVocs,
+        LPF=LPF, LPF_analysis_bw=LPF_analysis_bw, pad_time=pad_time
+        )
+    for layer_id, layer_features in features.items():
+        fingerprint = raw_features_fingerprint(
+            model_name, dataset_name, layer_id, shuffled=shuffled, mVocs=mVocs
+            )
+        if fingerprint is None:
+            logger.warning(f"Raw features of layer-{layer_id} not cached, not caching resampled features.")
+            continue
+        write_feature_arrays(
+            dir_path, file_name, layer_id, layer_features, dtype=dtype, fingerprint=fingerprint
+            )
+    logger.info(f"Resampled features (bin-width: {bin_width}) saved to: {dir_path}")
+
+def _audio_bank_dir_and_name(dataset_name, sampling_rate, mVocs=False):
+    """Returns directory and file name prefix of the audio bank, creates directory if needed."""
     if mVocs:
         directory = os.path.join(cache_dir, 'mVocs')
     else:
         directory = cache_dir
-    directory = os.path.join(directory, dataset_name)
-    if shuffled:
-        dir_path = os.path.join(directory, model_name, 'shuffled')
-    else:
-        dir_path = os.path.join(directory, model_name)
-    # make sure directory structure is in place...
+    dir_path = os.path.join(directory, dataset_name, 'audio_bank')
     if not os.path.exists(dir_path):
         os.makedirs(dir_path)
+    return dir_path, f"audio_{int(sampling_rate)}Hz"
 
-    for layer_id, layer_features in features.items():
-        logger.info(f"Saving features for layer: {layer_id}")
-        file_path = os.path.join(dir_path, f"{file_name}_layer{layer_id:02}.npz")
-        np.savez_compressed(file_path, layer_features=layer_features)
+def read_audio_bank(dataset_name, sampling_rate, mVocs=False, stim_ids=None):
+    """Reads (memory-mapped) stimulus audios resampled at sampling_rate,
+    returns None if audio bank is not written yet.
 
-    logger.info(f"All layer features saved to: {dir_path}")
+    Args:
+        dataset_name: str = name of the neural dataset.
+        sampling_rate: int = sampling rate (Hz) of the audios.
+        stim_ids: list = stimuli to read, all stimuli if None.
+
+    Returns:
+        dict: {stim_id: (num_samples,)} float32 audios.
+    """
+    dir_path, file_name = _audio_bank_dir_and_name(dataset_name, sampling_rate, mVocs=mVocs)
+    audios = read_feature_arrays(dir_path, file_name, layer_ids=[0], stim_ids=stim_ids)
+    if audios is None:
+        return None
+    return audios[0]
 
+def write_audio_bank(audios, dataset_name, sampling_rate, mVocs=False):
+    """Writes stimulus audios resampled at sampling_rate as one float32 array
+    (see read_audio_bank), replaces audio bank written before.
 
-    # file_path = os.path.join(dir_path, file_name+'.gz')
-    # # Compress and save
-    # with gzip.open(file_path, 'wb') as f:
-    #     pickle.dump(features, f, protocol=pickle.HIGHEST_PROTOCOL)
-    # logger.info(f"Features saved to file: {file_path}")
-    
-    # # # writing features to file
-    # # with open(file_path, 'wb') as F:
-    # #     pickle.dump(features, F)
-    # logger.info(f"Features saved to file: {file_path}")
+    Args:
+        audios: dict = {stim_id: (num_samples,)} audios.
+        dataset_name: str = name of the neural dataset.
+        sampling_rate: int = sampling rate (Hz) of the audios.
+    """
+    dir_path, file_name = _audio_bank_dir_and_name(dataset_name, sampling_rate, mVocs=mVocs)
+    write_feature_arrays(dir_path, file_name, 0, audios, dtype=np.float32)
+    logger.info(f"Audio bank of {len(audios)} stimuli ({sampling_rate} Hz) saved to: {dir_path}")
+
+def _as_numpy(x):
+    """Returns numpy array for numpy arrays and (cpu/gpu) torch tensors."""
+    if hasattr(x, 'detach'):
+        x = x.detach().cpu().numpy()
+    return np.asarray(x)
     
 def read_cached_spikes(bin_width=20, threshold=0.068):
     """Retrieves neural spikes for the bin_width and area specified,
@@ -13,6 +13,7 @@ import numpy as np
 import pandas as pd
 
 from auditory_cortex import utils, results_dir, aux_dir, saved_corr_dir
+from .results_store import ResultsStore, read_results
 
 import logging
 logger = logging.getLogger(__name__)
@@ -85,16 +86,16 @@ class ResultsManager:
         return_list = []
         if verbose:
             logger.info(f"For '{model_name}', '{identifier}'")
-        try:
-            filename = f'{model_name}_{identifier}_corr_results.csv'
-            corr_file_path = os.path.join(saved_corr_dir, filename)
-            dataframe = pd.read_csv(corr_file_path)
-        except FileNotFoundError:
+        filename = f'{model_name}_{identifier}_corr_results.csv'
+        corr_file_path = os.path.join(saved_corr_dir, filename)
+        results_store = ResultsStore(corr_file_path)
+        if not results_store.exists():
             logger.warning(f"File not found: {corr_file_path}")
             return_list.append(model_name+'_'+identifier)
             return return_list
 
-
+        # completed jobs, (without reading the results)..
+        dataframe = results_store.completed_jobs()
         bin_widths = np.sort(dataframe['bin_width'].unique())
         for bin_width in bin_widths:
             data = dataframe[dataframe['bin_width']==float(bin_width)]
@@ -182,7 +183,7 @@ class ResultsManager:
         for iden in identifiers_list:
             filename = f"{model_name}_{iden}_corr_results.csv"
             file_path = os.path.join(saved_corr_dir, filename)
-            corr_dfs.append(pd.read_csv(file_path))
+            corr_dfs.append(read_results(file_path))
 
         # save the merged results at the very first filename...
         if output_identifier is None:
@@ -190,8 +191,14 @@ class ResultsManager:
         filename = f"{model_name}_{output_identifier}_corr_results.csv"
         file_path = os.path.join(saved_corr_dir, filename)
 
-        data = pd.concat(corr_dfs)
-        data.to_csv(file_path, index=False)
+        data = pd.concat(corr_dfs, ignore_index=True)
+        store = ResultsStore(file_path)
+        if output_identifier in identifiers_list:
+            # rows of the output read above are in 'data'..
+            store.read()
+        else:
+            store.remove()
+        store.consolidate(data)
         logger.info(f"Output saved at: \n {file_path}")
 
         # once all the files have been merged, remove the files..
@@ -199,8 +206,8 @@ class ResultsManager:
             if identifier != output_identifier:
                 filename = f"{model_name}_{identifier}_corr_results.csv"
                 file_path = os.path.join(saved_corr_dir, filename)
-                # remove the file
-                os.remove(file_path)
+                # remove the file (and its store)
+                ResultsStore(file_path).remove()
 
     @staticmethod
     def combine_results_for_all_models(model_names, identifier):
@@ -0,0 +1,414 @@
+"""
+Append-only store of correlation results.
+
+Results of each results file ('<model>_<identifier>_corr_results.csv') are
+appended to a SQLite table (WAL mode) next to the csv file, '<...>_corr_results.sqlite'.
+Each append is a single transaction, so it costs O(rows appended), and
+concurrent runner processes can append to the same results safely.
+Readers get the merged view of the csv file (results written before, or
+consolidated by analysis code) and the rows of the store, with filters on
+session, bin_width and layer applied in the SQL query.
+
+The store also keeps an index of completed jobs, one record per (session, layer,
+bin_width) with results, (model and identifier are those of the results file).
+It is updated in the same transaction as the results, so runners can tell
+what remains to be done without reading the results. Results in the csv
+file are indexed once, and again only if the csv file changes.
+
+Consolidation records the last row moved to the csv file ('consolidated_upto')
+and the stamp of the csv file in the store, in the transaction that removes
+those rows. Readers read both in the same transaction as the rows, skip rows
+already consolidated, and read again if the csv file does not match the stamp
+(i.e. consolidation was in progress), so rows are never seen twice.
+
+Classes:
+    ResultsStore:
+        Appends, reads and consolidates results of a results (csv) file.
+
+Functions:
+    results_exist(file_path):
+        True if csv file or store of results exists.
+    read_results(file_path, sessions=None, bin_widths=None, layers=None, columns=None):
+        Merged view of the results.
+"""
+
+import os
+import time
+import sqlite3
+import numpy as np
+import pandas as pd
+
+import logging
+logger = logging.getLogger(__name__)
+
+# columns that can be filtered in the query..
+FILTER_COLUMNS = {'sessions': 'session', 'bin_widths': 'bin_width', 'layers': 'layer'}
+# columns identifying a job, layer is -1 for results without layers (e.g. STRF)..
+JOB_COLUMNS = ['session', 'layer', 'bin_width']
+
+
+class ResultsStore:
+    def __init__(self, file_path, timeout=600):
+        """
+        Args:
+            file_path: str = path of the results csv file.
+            timeout: float = seconds to wait for the lock of other writers.
+        """
+        self.file_path = file_path
+        self.db_path = os.path.splitext(file_path)[0] + '.sqlite'
+        self.timeout = timeout
+        # last row of the store in the last full read (see consolidate)..
+        self.read_row_id = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        # switching to WAL does not wait for the lock (e.g. when writers
+        # create the store together), so retry..
+        start = time.time()
+        while True:
+            try:
+                if conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+                    conn.execute('PRAGMA journal_mode=WAL')
+                break
+            except sqlite3.OperationalError:
+                if time.time() - start > self.timeout:
+                    conn.close()
+                    raise
+                time.sleep(0.05)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def exists(self):
+        return os.path.isfile(self.file_path) or os.path.isfile(self.db_path)
+
+    def _columns(self, conn):
+        """Returns result columns of the table, (without the row id)."""
+        return [row[1] for row in conn.execute('PRAGMA table_info(results)') if row[1] != '_row_id']
+
+    def append(self, df):
+        """Appends rows of the dataframe, as one transaction.
+
+        Args:
+            df: pd.DataFrame = results rows, (columns are added to the table as needed).
+        """
+        df = _csv_like(df)
+        columns = list(df.columns)
+        rows = list(zip(*[df[col].tolist() for col in columns]))
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            existing = self._columns(conn)
+            if len(existing) == 0:
+                # autoincrement ids are never reused, (see consolidate)..
+                conn.execute(
+                    f"CREATE TABLE results (_row_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                    f"{', '.join(_quote(col) for col in columns)})"
+                    )
+                for col in FILTER_COLUMNS.values():
+                    if col in columns:
+                        conn.execute(f"CREATE INDEX idx_{col} ON results ({_quote(col)})")
+            else:
+                for col in columns:
+                    if col not in existing:
+                        conn.execute(f"ALTER TABLE results ADD COLUMN {_quote(col)}")
+            conn.executemany(
+                f"INSERT INTO results ({', '.join(_quote(col) for col in columns)}) "
+                f"VALUES ({', '.join('?' for _ in columns)})",
+                rows
+                )
+            self._create_jobs_table(conn)
+            self._record_jobs(conn, df)
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def read(self, sessions=None, bin_widths=None, layers=None, columns=None):
+        """Returns merged view of csv file and the store, filtered by
+        sessions, bin_widths and layers (each a value or list of values).
+
+        Args:
+            columns: list = columns to read, all columns if None.
+
+        Returns:
+            pd.DataFrame, or None if no results exist.
+        """
+        filters = {
+            FILTER_COLUMNS['sessions']: sessions, FILTER_COLUMNS['bin_widths']: bin_widths,
+            FILTER_COLUMNS['layers']: layers,
+            }
+        filters = {col: _as_numeric_list(values) for col, values in filters.items() if values is not None}
+        for attempt in range(5):
+            parts = []
+            csv_stamp = self._csv_stamp()
+            if os.path.isfile(self.db_path):
+                store_data, last_row_id, store_stamp = self._read_store(filters, columns)
+            else:
+                store_data, last_row_id, store_stamp = None, 0, csv_stamp
+            if csv_stamp is not None:
+                data = pd.read_csv(self.file_path, usecols=columns)
+                for col, values in filters.items():
+                    if col in data.columns:
+                        data = data[data[col].isin(values)]
+                parts.append(data)
+            if store_stamp == csv_stamp and self._csv_stamp() == csv_stamp:
+                break
+            # csv file replaced by a consolidation not yet committed (or changed
+            # elsewhere), wait for the lock and index it, then read again..
+            if os.path.isfile(self.db_path):
+                self._sync()
+        else:
+            logger.warning(f"Csv file changed while reading results of: {self.file_path}")
+        if store_data is not None:
+            parts.append(store_data)
+        if len(filters) == 0:
+            self.read_row_id = last_row_id
+        if len(parts) == 0:
+            return None
+        return pd.concat(parts, axis=0, ignore_index=True)
+
+    def _read_store(self, filters=None, columns=None):
+        """Returns (rows of the store not yet consolidated, last row id read,
+        stamp of the csv file they go with), read in one transaction."""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN')
+            meta = self._read_meta(conn)
+            consolidated_upto = int(meta.get('consolidated_upto', 0))
+            existing = self._columns(conn)
+            data = None
+            if len(existing) > 0:
+                if columns is not None:
+                    existing = [col for col in existing if col in columns]
+                query = f"SELECT _row_id, {', '.join(_quote(col) for col in existing)} FROM results"
+                conditions, params = ['_row_id > ?'], [consolidated_upto]
+                for col, values in (filters or {}).items():
+                    conditions.append(f"{_quote(col)} IN ({', '.join('?' for _ in values)})")
+                    params.extend(values)
+                query += ' WHERE ' + ' AND '.join(conditions)
+                data = pd.read_sql_query(query, conn, params=params)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        if data is None:
+            # nothing appended yet, so nothing consolidated either..
+            return None, consolidated_upto, meta.get('csv_stamp', self._csv_stamp())
+        last_row_id = int(data['_row_id'].max()) if len(data) > 0 else consolidated_upto
+        return data.drop(columns='_row_id'), last_row_id, meta.get('csv_stamp')
+
+    def _read_meta(self, conn):
+        """Returns {key: value} of the meta table, empty if there is none."""
+        tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        if 'meta' not in tables:
+            return {}
+        return dict(conn.execute('SELECT key, value FROM meta').fetchall())
+
+    def consolidate(self, data=None):
+        """Writes merged results (or the data given, e.g. results with normalizers
+        added, read with read() of this store without filters) to the csv file,
+        and removes rows of the store that are now in the csv file.
+        Rows appended since the read are kept."""
+        if data is None:
+            data = self.read()
+            if data is None:
+                return
+        if self.read_row_id is None and os.path.isfile(self.db_path):
+            raise ValueError("Results must be read (without filters) from the store before consolidating.")
+        conn = self._connect() if os.path.isfile(self.db_path) else None
+        try:
+            if conn is not None:
+                conn.execute('BEGIN IMMEDIATE')
+            tmp_path = self.file_path + '.tmp'
+            data.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, self.file_path)
+            if conn is not None:
+                if len(self._columns(conn)) > 0:
+                    conn.execute('DELETE FROM results WHERE _row_id <= ?', (self.read_row_id,))
+                self._create_jobs_table(conn)
+                consolidated_upto = max(int(self._read_meta(conn).get('consolidated_upto', 0)), self.read_row_id)
+                conn.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('consolidated_upto', ?)", (consolidated_upto,)
+                    )
+                self._rebuild_jobs(conn, data)
+                conn.execute('COMMIT')
+        finally:
+            if conn is not None:
+                conn.close()
+        logger.info(f"Results consolidated to: {self.file_path}")
+
+    def completed_jobs(self, bin_widths=None):
+        """Returns completed jobs, read from the index of the store.
+
+        Args:
+            bin_widths: int or list = bin widths to return jobs for, all if None.
+
+        Returns:
+            pd.DataFrame = columns (session, layer, bin_width), one row per job.
+        """
+        if not self.exists():
+            return pd.DataFrame(columns=JOB_COLUMNS)
+        conn = self._connect()
+        try:
+            self._sync_jobs(conn)
+            query = 'SELECT session, layer, bin_width FROM jobs'
+            params = []
+            if bin_widths is not None:
+                params = _as_numeric_list(bin_widths)
+                query += f" WHERE bin_width IN ({', '.join('?' for _ in params)})"
+            jobs = pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.close()
+        return jobs
+
+    def sessions_done(self, bin_width, layers=None):
+        """Returns sessions done at the bin width, (for all the layers if given).
+
+        Args:
+            bin_width: int = bin width (ms).
+            layers: list = layers that must be done, any layer if None.
+
+        Returns:
+            ndarray = session IDs.
+        """
+        jobs = self.completed_jobs(bin_widths=bin_width)
+        if layers is not None:
+            layers = _as_numeric_list(layers)
+            jobs = jobs[jobs['layer'].isin(layers)]
+            num_layers = jobs.groupby('session')['layer'].nunique()
+            return num_layers[num_layers == len(set(layers))].index.to_numpy()
+        return jobs['session'].unique()
+
+    def _create_jobs_table(self, conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (session, layer, bin_width, "
+            "PRIMARY KEY (session, layer, bin_width)) WITHOUT ROWID"
+            )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+
+    def _record_jobs(self, conn, data):
+        """Adds jobs of the rows to the index, (in the open transaction)."""
+        if 'session' not in data.columns or 'bin_width' not in data.columns:
+            return
+        data = _csv_like(data[[col for col in JOB_COLUMNS if col in data.columns]])
+        if 'layer' not in data.columns:
+            data['layer'] = -1
+        jobs = data[JOB_COLUMNS].drop_duplicates()
+        conn.executemany(
+            'INSERT OR IGNORE INTO jobs VALUES (?, ?, ?)',
+            list(zip(*[jobs[col].tolist() for col in JOB_COLUMNS]))
+            )
+
+    def _rebuild_jobs(self, conn, csv_data=None):
+        """Rebuilds the index from rows of the csv file and of the store,
+        (in the open transaction)."""
+        conn.execute('DELETE FROM jobs')
+        if csv_data is not None:
+            self._record_jobs(conn, csv_data)
+        columns = self._columns(conn)
+        if 'session' in columns and 'bin_width' in columns:
+            layer = '"layer"' if 'layer' in columns else '-1'
+            conn.execute(
+                f'INSERT OR IGNORE INTO jobs SELECT DISTINCT "session", {layer}, "bin_width" FROM results'
+                )
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('csv_stamp', ?)", (self._csv_stamp(),))
+
+    def _sync(self):
+        """Indexes the csv file (see _sync_jobs) with a connection of its own."""
+        conn = self._connect()
+        try:
+            self._sync_jobs(conn)
+        finally:
+            conn.close()
+
+    def _sync_jobs(self, conn):
+        """Indexes the csv file, if it has changed since it was last indexed."""
+        def indexed_stamp():
+            meta = self._read_meta(conn)
+            return meta.get('csv_stamp'), 'csv_stamp' in meta
+
+        stamp, indexed = indexed_stamp()
+        if indexed and stamp == self._csv_stamp():
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            stamp, indexed = indexed_stamp()
+            if not (indexed and stamp == self._csv_stamp()):
+                csv_data = None
+                if os.path.isfile(self.file_path):
+                    logger.info(f"Indexing completed jobs of: {self.file_path}")
+                    header = pd.read_csv(self.file_path, nrows=0).columns
+                    csv_data = pd.read_csv(
+                        self.file_path, usecols=[col for col in JOB_COLUMNS if col in header]
+                        )
+                self._create_jobs_table(conn)
+                self._rebuild_jobs(conn, csv_data)
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+
+    def _csv_stamp(self):
+        """Returns modification time and size of the csv file, None if it does not exist."""
+        if not os.path.isfile(self.file_path):
+            return None
+        stat = os.stat(self.file_path)
+        return f"{stat.st_mtime_ns}_{stat.st_size}"
+
+    def remove(self):
+        """Removes csv file and store of the results."""
+        for path in [self.file_path, self.db_path, self.db_path+'-wal', self.db_path+'-shm']:
+            if os.path.isfile(path):
+                os.remove(path)
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _as_numeric_list(values):
+    """Returns list of values, numeric strings converted to numbers
+    (values are stored as read by pd.read_csv)."""
+    if np.isscalar(values):
+        values = [values]
+    out = []
+    for value in values:
+        if isinstance(value, np.generic):
+            value = value.item()
+        if isinstance(value, str):
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+        out.append(value)
+    return out
+
+def _csv_like(df):
+    """Converts columns of numeric strings (e.g. session IDs) to numbers,
+    so that stored values match those read back from csv files."""
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
+            converted = pd.to_numeric(df[col], errors='coerce')
+            if not converted.isna().any():
+                df[col] = converted
+    return df
+
+def results_exist(file_path):
+    """Returns True if results (csv file or store) exist for the file path."""
+    return ResultsStore(file_path).exists()
+
+def read_results(file_path, sessions=None, bin_widths=None, layers=None, columns=None):
+    """Returns merged view of the results (see ResultsStore.read), raises
+    FileNotFoundError if no results exist."""
+    data = ResultsStore(file_path).read(
+        sessions=sessions, bin_widths=bin_widths, layers=layers, columns=columns
+        )
+    if data is None:
+        raise FileNotFoundError(f"No results found for: {file_path}")
+    return data
@@ -0,0 +1,87 @@
+"""
+Reading and caching of stimulus audios.
+
+Waveform (.wfm) files are decoded from a memory map of the file, (no python
+objects per sample), and decoded audios are kept in an LRU cache bounded by
+'audio_cache_size' of config, so that repeated calls of get_stim_audio (e.g.
+features of DNNs and spectrograms for STRF) do not read the files again.
+
+Audios resampled for the DNNs (e.g. 48 kHz -> 16 kHz for ucdavis) can be kept
+in an audio bank on disk (io.read_audio_bank), one float32 array per dataset
+and sampling rate, so resampling happens once per dataset, instead of once per
+feature extractor per run (see DataLoader.get_stim_audios).
+
+Classes:
+    AudioCache:
+        LRU cache of stimulus audios.
+
+Functions:
+    read_wfm(filename):
+        Returns audio samples of 16-bit WFM file in the range [-1, 1].
+    resample_audio(audio, sampling_rate, new_sampling_rate):
+        Returns audio resampled at new_sampling_rate.
+"""
+
+from collections import OrderedDict
+import numpy as np
+from scipy.signal import resample
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class AudioCache:
+    def __init__(self, max_items=None):
+        """
+        Args:
+            max_items: int = maximum number of audios kept, unbounded if None.
+        """
+        self.max_items = max_items
+        self.audios = OrderedDict()
+
+    def __contains__(self, stim_id):
+        return stim_id in self.audios
+
+    def __len__(self):
+        return len(self.audios)
+
+    def get(self, stim_id, load):
+        """Returns cached audio of the stimulus, calls load() if not cached."""
+        if stim_id in self.audios:
+            self.audios.move_to_end(stim_id)
+            return self.audios[stim_id]
+        audio = load()
+        self.audios[stim_id] = audio
+        if self.max_items is not None:
+            while len(self.audios) > self.max_items:
+                self.audios.popitem(last=False)
+        return audio
+
+    def clear(self):
+        self.audios.clear()
+
+
+def read_wfm(filename):
+    """
+    Reads a WFM file containing 16-bit (little-endian) integer waveform data
+    stored as binary, and returns the waveform as a NumPy array of
+    floating-point samples in the range [-1, 1].
+
+    Args:
+        filename (str): Path to the WFM file.
+
+    Returns:
+        np.ndarray: Array of audio samples.
+    """
+    samples = np.memmap(filename, dtype='<i2', mode='r')
+    audio = samples.astype(np.float32)/2**15	# Normalize to [-1, 1]
+    del samples
+    return audio
+
+def resample_audio(audio, sampling_rate, new_sampling_rate):
+    """Returns audio resampled at new_sampling_rate, (same as done by
+    feature extractors, see BaseFeatureExtractor.prepare_audio)."""
+    if sampling_rate == new_sampling_rate:
+        return audio
+    n_samples = int(audio.size*new_sampling_rate/sampling_rate)
+    return resample(audio, n_samples)
@@ -102,7 +102,7 @@ class BaseMetaData(ABC):
         """Returns duration of the stimulus in seconds"""
         pass
 
-    def sample_stim_ids_by_duration(self, percent_duration=None, repeated=False, mVocs=False):
+    def sample_stim_ids_by_duration(self, percent_duration=None, repeated=False, mVocs=False, rng=None):
         """Returns random choice of stimulus ids, for the desired fraction of total 
         duration of test set as specified by percent_duration.
         
@@ -111,10 +111,13 @@ class BaseMetaData(ABC):
                 If None or >= 100, returns all stimulus ids.
             repeated: bool = if True, returns spikes for repeated trials, else for unique trials.
             mVocs: bool = If True, mVocs trials are considered otherwise TIMIT
+            rng: np.random.Generator = random generator, uses np.random if None.
         
         Returns:
             list: stimulus subset for the fraction of duration.
         """
+        if rng is None:
+            rng = np.random
         stim_durations = self.total_stimuli_duration(mVocs)
         if repeated:
             all_stim_ids = self.get_testing_stim_ids(mVocs)
@@ -122,7 +125,7 @@ class BaseMetaData(ABC):
         else:
             all_stim_ids = self.get_training_stim_ids(mVocs)
             total_duration = stim_durations['unique']
-        np.random.shuffle(all_stim_ids)
+        rng.shuffle(all_stim_ids)
         if percent_duration is None: 
             return all_stim_ids, total_duration
         else:
@@ -131,7 +134,7 @@ class BaseMetaData(ABC):
             choosen_stim_ids = []
 
             while stim_duration < required_duration:
-                stim_id = np.random.choice(all_stim_ids)
+                stim_id = rng.choice(all_stim_ids)
                 stim_duration += self.get_stim_duration(stim_id, mVocs=mVocs)
                 choosen_stim_ids.append(stim_id)
             return np.array(choosen_stim_ids), stim_duration
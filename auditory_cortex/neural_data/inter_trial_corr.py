@@ -0,0 +1,204 @@
+"""
+Vectorized bootstrap of inter-trial correlations.
+
+At each bootstrap iteration, stimuli are randomly ordered and a distinct pair
+of trials is picked for each stimulus, the first (second) trials of all stimuli
+are concatenated into a long sequence U (V). True distribution is corr(U, V) and
+null distribution is corr(U, V circularly shifted by half its length).
+
+Pearson r only needs n, sum(U), sum(V), sum(U^2), sum(V^2) and sum(UV). These are
+sums of per-(stim, trial, channel) sums, sums of squares and per-(stim, trial pair)
+cross-products, precomputed once, so correlations of all iterations and channels
+are assembled with batched gathers. Circular shift does not change the sums, only
+the cross-product, which depends on the order of stimuli and is computed with
+a batched gather of the (index of) shifted sequences for a block of iterations.
+
+Classes:
+    InterTrialCorrBootstrap:
+        Precomputes sufficient statistics of repeated spikes and draws bootstrap samples.
+
+Functions:
+    pearson_from_sums(n, sum_x, sum_y, sum_xx, sum_yy, sum_xy):
+        Pearson correlation from sufficient statistics, element-wise.
+"""
+
+import copy
+import numpy as np
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def pearson_from_sums(n, sum_x, sum_y, sum_xx, sum_yy, sum_xy):
+    """Returns Pearson correlation coefficient from sufficient statistics,
+    (NaN where x or y is constant, same as np.corrcoef).
+
+    Args:
+        n: int = number of samples.
+        sum_x, sum_y: ndarray = sums of x and y.
+        sum_xx, sum_yy: ndarray = sums of squares of x and y.
+        sum_xy: ndarray = sums of products of x and y.
+    """
+    cov = n*sum_xy - sum_x*sum_y
+    var_x = n*sum_xx - sum_x**2
+    var_y = n*sum_yy - sum_y**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return cov / np.sqrt(var_x*var_y)
+
+
+class InterTrialCorrBootstrap:
+    def __init__(self, repeated_spikes, stim_ids=None, channel_ids=None):
+        """
+        Args:
+            repeated_spikes dict(stim: ndarray): {stim: {channel: (repeats, samples/time)}}
+            stim_ids: list of str = stimulus ids to use, all stimuli if None.
+            channel_ids: list = channels to use, all channels if None.
+        """
+        if stim_ids is None:
+            stim_ids = list(repeated_spikes.keys())
+        if channel_ids is None:
+            channel_ids = list(repeated_spikes[stim_ids[0]].keys())
+        self.stim_ids = list(stim_ids)
+        self.channel_ids = list(channel_ids)
+
+        # (repeats, time, channels) for each stimulus..
+        stim_spikes = [
+            np.stack([
+                np.asarray(repeated_spikes[stim_id][ch], dtype=np.float64).reshape(
+                    repeated_spikes[stim_id][ch].shape[0], -1
+                    )
+                for ch in self.channel_ids
+                ], axis=-1)
+            for stim_id in self.stim_ids
+            ]
+        self.num_repeats = stim_spikes[0].shape[0]
+        self.lengths = np.array([spikes.shape[1] for spikes in stim_spikes])
+        self.total_length = int(self.lengths.sum())
+
+        # per (stim, trial, channel) sufficient statistics..
+        self.sums = np.stack([spikes.sum(axis=1) for spikes in stim_spikes])              # (S, R, C)
+        self.sums_sq = np.stack([(spikes**2).sum(axis=1) for spikes in stim_spikes])      # (S, R, C)
+        self.nonzeros = np.stack([np.count_nonzero(spikes, axis=1) for spikes in stim_spikes])
+        self.cross = np.stack([
+            np.einsum('itc,jtc->ijc', spikes, spikes) for spikes in stim_spikes
+            ])                                                                              # (S, R, R, C)
+
+        # all trials as rows of a flat array, (needed for circularly shifted cross-products)..
+        self.flat_spikes = np.concatenate([
+            spikes.reshape(-1, spikes.shape[-1]) for spikes in stim_spikes
+            ], axis=0)
+        if np.all(self.flat_spikes == np.round(self.flat_spikes)) and np.abs(self.flat_spikes).max() < 2**15:
+            # spike counts, compact dtype makes gathers cheaper (products are exact)..
+            self.flat_spikes = self.flat_spikes.astype(np.int16)
+        trial_rows = [spikes.shape[0]*spikes.shape[1] for spikes in stim_spikes]
+        self.stim_base = np.cumsum(trial_rows) - np.array(trial_rows)
+        # rows of the statistics used, (see subset)..
+        self.stim_index = np.arange(len(self.stim_ids))
+
+    def subset(self, stim_ids):
+        """Returns bootstrap over a subset of the stimuli, sharing the statistics
+        (and flat spikes) of this object, only the stimulus index is new.
+
+        Args:
+            stim_ids: list = stimulus ids, (all must be stimuli of this object).
+        """
+        positions = {stim_id: i for i, stim_id in enumerate(self.stim_ids)}
+        positions = np.array([positions[stim_id] for stim_id in stim_ids], dtype=int)
+        bootstrap = copy.copy(self)
+        bootstrap.stim_ids = list(stim_ids)
+        bootstrap.stim_index = self.stim_index[positions]
+        bootstrap.lengths = self.lengths[positions]
+        bootstrap.stim_base = self.stim_base[positions]
+        bootstrap.total_length = int(bootstrap.lengths.sum())
+        return bootstrap
+
+    def sample(self, num_itr, trial_ids=None, rng=None, block_size=None):
+        """Draws bootstrap samples of true and null inter-trial correlations.
+
+        Args:
+            num_itr: int = number of iterations.
+            trial_ids: ndarray = trials to pick pairs from (may have repeated trials),
+                all trials if None.
+            rng: np.random.Generator = random generator, a new generator if None.
+            block_size: int = iterations processed together, bounds memory
+                of the gathered sequences. If None, chosen for ~256MB.
+
+        Returns:
+            norm_dists: ndarray = (num_itr, num_channels) true distribution.
+            null_dists: ndarray = (num_itr, num_channels) null distribution.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        if trial_ids is None:
+            trial_ids = np.arange(self.num_repeats)
+        trial_ids = np.asarray(trial_ids)
+        if block_size is None:
+            bytes_per_itr = 2*self.total_length*len(self.channel_ids)*self.flat_spikes.itemsize
+            block_size = max(1, int(256*2**20 // bytes_per_itr))
+
+        num_channels = len(self.channel_ids)
+        norm_dists = np.zeros((num_itr, num_channels))
+        null_dists = np.zeros((num_itr, num_channels))
+        for start in range(0, num_itr, block_size):
+            end = min(start + block_size, num_itr)
+            norm_dists[start:end], null_dists[start:end] = self._sample_block(
+                end - start, trial_ids, rng
+                )
+        return norm_dists, null_dists
+
+    def _sample_trial_pairs(self, num_itr, trial_ids, rng):
+        """Returns (num_itr, num_stims) pairs of distinct trials, picks
+        two different positions of trial_ids and redraws pairs with same trials."""
+        shape = (num_itr, len(self.stim_ids))
+        n = trial_ids.size
+        pos_1 = rng.integers(0, n, size=shape)
+        pos_2 = (pos_1 + rng.integers(1, n, size=shape)) % n
+        same = trial_ids[pos_1] == trial_ids[pos_2]
+        while np.any(same):
+            num_same = np.count_nonzero(same)
+            pos_1[same] = rng.integers(0, n, size=num_same)
+            pos_2[same] = (pos_1[same] + rng.integers(1, n, size=num_same)) % n
+            same = trial_ids[pos_1] == trial_ids[pos_2]
+        return trial_ids[pos_1], trial_ids[pos_2]
+
+    def _sample_block(self, num_itr, trial_ids, rng):
+        """Returns true and null correlations for a block of iterations."""
+        num_stims = len(self.stim_ids)
+        stim_order = np.argsort(rng.random((num_itr, num_stims)), axis=1)
+        tr_1, tr_2 = self._sample_trial_pairs(num_itr, trial_ids, rng)
+
+        stims = self.stim_index
+        sum_u = self.sums[stims, tr_1].sum(axis=1)              # (B, C)
+        sum_v = self.sums[stims, tr_2].sum(axis=1)
+        sum_uu = self.sums_sq[stims, tr_1].sum(axis=1)
+        sum_vv = self.sums_sq[stims, tr_2].sum(axis=1)
+        sum_uv = self.cross[stims, tr_1, tr_2].sum(axis=1)
+        all_zeros = (self.nonzeros[stims, tr_1].sum(axis=1) == 0) | (self.nonzeros[stims, tr_2].sum(axis=1) == 0)
+
+        n = self.total_length
+        norm = pearson_from_sums(n, sum_u, sum_v, sum_uu, sum_vv, sum_uv)
+
+        # cross-product of U and circularly shifted V, gathering rows of flat spikes..
+        rows_u = self._sequence_rows(stim_order, tr_1)
+        rows_v = np.roll(self._sequence_rows(stim_order, tr_2), n//2, axis=1)
+        sum_uv_shifted = np.einsum(
+            'btc,btc->bc', self.flat_spikes[rows_u], self.flat_spikes[rows_v],
+            dtype=np.float64, casting='unsafe'
+            )
+        null = pearson_from_sums(n, sum_u, sum_v, sum_uu, sum_vv, sum_uv_shifted)
+
+        # channels with all zero sequences have zero correlation (see safe_corrcoef)..
+        norm[all_zeros] = 0.0
+        null[all_zeros] = 0.0
+        return norm, null
+
+    def _sequence_rows(self, stim_order, trials):
+        """Returns (B, total_length) rows of flat spikes making up the
+        long sequences, stimuli concatenated in stim_order."""
+        num_itr = stim_order.shape[0]
+        ordered_trials = np.take_along_axis(trials, stim_order, axis=1)
+        seg_lengths = self.lengths[stim_order]
+        seg_starts = self.stim_base[stim_order] + ordered_trials*seg_lengths
+        seg_offsets = np.cumsum(seg_lengths, axis=1) - seg_lengths
+        rows = np.repeat((seg_starts - seg_offsets).ravel(), seg_lengths.ravel())
+        return rows.reshape(num_itr, -1) + np.arange(self.total_length)
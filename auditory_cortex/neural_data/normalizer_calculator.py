@@ -3,6 +3,8 @@ import numpy as np
 
 from .base_dataset import BaseDataset, create_neural_dataset
 from .base_metadata import create_neural_metadata
+from .inter_trial_corr import InterTrialCorrBootstrap
+from .normalizer_executor import NormalizerExecutor
 import auditory_cortex.io_utils.io as io
 
 import logging
@@ -43,7 +45,7 @@ class NormalizerCalculator:
         stim_duration = self.metadata.total_stimuli_duration(mVocs)
         return stim_duration['repeated']
 
-    def get_test_set_ids(self, percent_duration=None, mVocs=False):
+    def get_test_set_ids(self, percent_duration=None, mVocs=False, rng=None):
         """Returns random choice of stimulus ids, for the desired fraction of total 
         duration of test set as specified by percent_duration.
         
@@ -51,12 +53,13 @@ class NormalizerCalculator:
             percent_duration: float = Percentage of total duration of test set to consider.
                 If None or >= 100, returns all stimulus ids.
             mVocs: bool = If True, mVocs trials are considered otherwise TIMIT
+            rng: np.random.Generator = random generator, uses np.random if None.
         
         Returns:
             list: List of stimulus ids to consider for testing.
         """
         stim_ids, stim_duration = self.metadata.sample_stim_ids_by_duration(
-            percent_duration, repeated=True, mVocs=mVocs
+            percent_duration, repeated=True, mVocs=mVocs, rng=rng
             )
         logger.info(f"Total duration={stim_duration:.2f} sec")
         return stim_ids
@@ -179,10 +182,14 @@ class NormalizerCalculator:
         return bootstrap_dists
     
     def save_bootstrapped_distributions(
-        self, session, percent_durations, epoch_ids=None, bin_width=50, num_itr=1000, mVocs=False
+        self, session, percent_durations, epoch_ids=None, bin_width=50, num_itr=1000, mVocs=False,
+        num_workers=1, chunk_size=10000, seed=0, force_redo=False,
         ):
         """Computes and saves the bootstrapped distributions of inter-trial correlations
         for different setting of percent durations and number of repeats.
+        Settings are run in chunks on num_workers processes (see NormalizerExecutor),
+        results are reproducible for the given seed, and interrupted runs resume
+        from checkpointed chunks.
 
         Args:
             session: str = session id
@@ -191,45 +198,41 @@ class NormalizerCalculator:
             bin_width: int = bin width in ms
             num_itr: int = number of iterations for distribution at each setting.
             mVocs: bool = If True, mVocs trials are considered otherwise TIMIT
+            num_workers: int = number of worker processes.
+            chunk_size: int = number of iterations in each chunk (and checkpoint).
+            seed: int = root seed of random generators.
+            force_redo: bool = If True, recomputes distributions already saved,
+                otherwise only the missing settings are computed.
         """
-        repeated_spikes = self.get_repeated_spikes(
-            session=session, bin_width=bin_width, mVocs=mVocs
-            )
-        
-        stim_ids = list(repeated_spikes.keys())
-        channel_ids = list(repeated_spikes[stim_ids[0]].keys())
-        num_repeats = repeated_spikes[stim_ids[0]][channel_ids[0]].shape[0]
+        num_repeats = int(self.metadata.num_repeats_for_sess(session, mVocs=mVocs))
         if epoch_ids is None:
             epoch_ids = [0]
         num_trials_list = np.arange(2, num_repeats+1)
-        for epoch in epoch_ids:
-            for percent_dur in percent_durations:
-                for num_trials in num_trials_list:
-                    stim_ids = self.get_test_set_ids(percent_dur, mVocs=mVocs)
-                    norm_dist, null_dist = self.inter_trial_corr_using_random_pairing(
-                        repeated_spikes, num_itr=num_itr, stim_ids=stim_ids,  num_trials=num_trials
-                        )
-                    io.write_inter_trial_corr_dists(
-                        norm_dist, null_dist, 
-                        session, bin_width, mVocs=mVocs, dataset_name=self.dataset_name,
-                        bootstrap=True, epoch=epoch, percent_dur=percent_dur, num_trial=num_trials
-                    )   
+        executor = NormalizerExecutor(self, num_workers=num_workers, chunk_size=chunk_size, seed=seed)
+        jobs = executor.bootstrap_jobs(
+            session, percent_durations, num_trials_list, epoch_ids, bin_width, num_itr, mVocs=mVocs
+            )
+        executor.run(jobs, force_redo=force_redo)
 
             
     @staticmethod
     def inter_trial_corr_using_random_pairing(
-        repeated_spikes, num_itr=100000, stim_ids=None, num_trials=None
+        repeated_spikes, num_itr=100000, stim_ids=None, num_trials=None, rng=None
         ):
         """Compute distribution of inter-trials correlations, using bootstrapping.
         At each iteration randomly selects trial pair for each sentence. Assigns one
         trial to first long sequence and second trial to second long sequence. 
         Computes both normalizer and null distribution of inter-trial correlations.
+        Iterations are computed in batches from precomputed sufficient statistics,
+        (see InterTrialCorrBootstrap).
 
         Args: 
             repeated_spikes dict(stim: ndarray): {stim: {channel: (repeats, samples/time)}}
             num_itr (int): number of iterations
             stim_ids: list of str = List of stimulus ids to consider for computing the distribution.
                 By Default (None), all available stimulus ids are considered.
+            num_trials: int = If not None, bootstraps a subset of num_trials trials.
+            rng: np.random.Generator = random generator, a new generator if None.
 
         Returns:
             norm_dists (dict): {channel: (num_itr,)} True distribution of inter-trial correlations
@@ -244,32 +247,12 @@ class NormalizerCalculator:
             assert num_trials <= total_trial_repeats and num_trials >= 2, \
                 "num_trials must be between 1 and {}".format(total_trial_repeats)
             # trial_ids = np.random.choice(trial_ids, size=num_trials, replace=True)  
-            trial_ids = NormalizerCalculator.sample_subset_of_trials(trial_ids, num_trials) # bootsraping step
-
-        norm_dists = {ch: np.zeros((num_itr,)) for ch in channel_ids}
-        null_dists = {ch: np.zeros((num_itr,)) for ch in channel_ids}
-        
-        for itr in range(num_itr):
-            seq_U = {ch: [] for ch in channel_ids}
-            seq_V = {ch: [] for ch in channel_ids}
-            for stim_id in np.random.permutation(stim_ids):
-                tr1, tr2 = np.random.choice(trial_ids, size=2, replace=False)   # distinct pair required
-                while tr1 == tr2:   # making sure trials are distinct, even when input trial_ids have repeated trials
-                    tr1, tr2 = np.random.choice(trial_ids, size=2, replace=False)
-                for ch in channel_ids:
-                    seq_U[ch].append(repeated_spikes[stim_id][ch][tr1])
-                    seq_V[ch].append(repeated_spikes[stim_id][ch][tr2])
-            for ch in channel_ids:
-                U = np.concatenate(seq_U[ch], axis=0).squeeze()
-                V = np.concatenate(seq_V[ch], axis=0).squeeze()
+            trial_ids = NormalizerCalculator.sample_subset_of_trials(trial_ids, num_trials, rng=rng) # bootsraping step
 
-                # Correlation for tr-tr distribution
-                corr_ch = NormalizerCalculator.safe_corrcoef(U, V) 
-                norm_dists[ch][itr] = corr_ch
-                # Correlation for Null distribution
-                V_shifted = np.roll(V, V.shape[0]//2, axis=0)
-                null_ch = NormalizerCalculator.safe_corrcoef(U, V_shifted) 
-                null_dists[ch][itr] = null_ch
+        bootstrap = InterTrialCorrBootstrap(repeated_spikes, stim_ids=stim_ids, channel_ids=channel_ids)
+        norm_dists, null_dists = bootstrap.sample(num_itr, trial_ids=trial_ids, rng=rng)
+        norm_dists = {ch: norm_dists[:, i] for i, ch in enumerate(channel_ids)}
+        null_dists = {ch: null_dists[:, i] for i, ch in enumerate(channel_ids)}
         return norm_dists, null_dists
 
     @staticmethod
@@ -281,43 +264,85 @@ class NormalizerCalculator:
         return np.corrcoef(x, y)[0, 1]
     
     @staticmethod
-    def sample_subset_of_trials(trial_ids, num_trials):
+    def rowwise_corrcoef(x, y):
+        """Computes Pearson correlation coefficients between corresponding 
+        rows of x and y, (NaN for constant rows, same as np.corrcoef).
+
+        Args:
+            x: ndarray = (num_rows, num_samples)
+            y: ndarray = (num_rows, num_samples)
+
+        Returns:
+            ndarray = (num_rows,)
+        """
+        x = x - x.mean(axis=1, keepdims=True)
+        y = y - y.mean(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.einsum('ij,ij->i', x, y) / np.sqrt(
+                np.einsum('ij,ij->i', x, x)*np.einsum('ij,ij->i', y, y)
+                )
+
+    @staticmethod
+    def sample_subset_of_trials(trial_ids, num_trials, rng=None):
         """ Samples a subset of trials from the given trial_ids. 
         Makes sure that the sampled subset has at least 2 unique trials.
         Args:
             trial_ids: array-like = Array of trial ids to sample from.
             num_trials: int = Number of trials to sample.
+            rng: np.random.Generator = random generator, uses np.random if None.
         """
-        subset = np.random.choice(trial_ids, size=num_trials, replace=True)  # bootsraping step
+        choice = np.random.choice if rng is None else rng.choice
+        subset = choice(trial_ids, size=num_trials, replace=True)  # bootsraping step
         while len(np.unique(subset)) < 2:
             # If the sampled subset has less than 2 unique trials, resample
-            subset = np.random.choice(trial_ids, size=num_trials, replace=True)
+            subset = choice(trial_ids, size=num_trials, replace=True)
         return subset
     
     # --------  Method 1 Null distribution: Using random poisson sequences   ------ #
 
     def _compute_normalizer_null_dist_using_poisson(
-            self, bin_width, spike_rate=50, p_value=5, num_itr=10000, mVocs=False
+            self, bin_width, spike_rate=50, p_value=5, num_itr=10000, mVocs=False,
+            block_size=None, rng=None,
         ):
         """Normalizer based on assumption that spikes are generated by a poisson process, 
-        and are uniformly distributed in time."""
+        and are uniformly distributed in time.
+        Bin of each uniformly distributed spike is uniform over bins, so bins of 
+        spikes of all iterations are drawn at once and counted with a single
+        np.bincount, (in blocks of iterations).
+
+        Args:
+            bin_width: int = bin width in ms
+            spike_rate: int = spikes per second (Hz)
+            p_value: int = p-value (in percent) for the threshold.
+            num_itr: int = number of iterations.
+            block_size: int = iterations drawn together, bounds memory. If None,
+                chosen for ~256MB.
+            rng: np.random.Generator = random generator, a new generator if None.
+        """
         logger.info(f"Poisson Process: Null distribution for bin_width: {bin_width}, spike_rate: {spike_rate}...")
+        if rng is None:
+            rng = np.random.default_rng()
         test_duration = self.get_testing_stim_duration(mVocs)
         logger.info(f"Test duration: {test_duration:.2f} sec")
         total_spikes = int(spike_rate * test_duration)
         num_bins = BaseDataset.calculate_num_bins(test_duration, bin_width/1000)
-        null_dist = []
-        for i in range(num_itr):
-            spike_times_1 = np.random.uniform(0, test_duration, int(total_spikes))
-            counts_1,_ = np.histogram(spike_times_1, num_bins)
-
-            spike_times_2 = np.random.uniform(0, test_duration, int(total_spikes))
-            counts_2, _ = np.histogram(spike_times_2, num_bins)
+        if block_size is None:
+            block_size = max(1, int(256*2**20 // (2*max(num_bins, total_spikes)*8)))
 
-            null_dist.append(np.corrcoef(counts_1, counts_2)[0,1])
+        null_dist = np.zeros(num_itr)
+        for start in range(0, num_itr, block_size):
+            num_rows = min(start + block_size, num_itr) - start
+            # (2*num_rows, num_bins) spike counts, each row is a sequence..
+            spike_bins = rng.integers(0, num_bins, size=(2*num_rows, total_spikes))
+            spike_bins += num_bins*np.arange(2*num_rows)[:, None]
+            counts = np.bincount(spike_bins.ravel(), minlength=2*num_rows*num_bins)
+            counts = counts.reshape(2*num_rows, num_bins).astype(np.float64)
+            null_dist[start:start+num_rows] = NormalizerCalculator.rowwise_corrcoef(
+                counts[:num_rows], counts[num_rows:]
+                )
        
         q = 100 - p_value
-        return np.percentile(null_dist, q), np.array(null_dist)
+        return np.percentile(null_dist, q), null_dist
     
 
     def get_normalizer_null_dist_using_poisson(
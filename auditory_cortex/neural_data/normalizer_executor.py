@@ -0,0 +1,210 @@
+"""
+Parallel, resumable computation of normalizer distributions.
+
+A job is one distribution to be saved, i.e. (session, bin_width, mVocs) and for
+bootstrap analysis also (epoch, percent_dur, num_trial). Iterations of each job
+are split into chunks, chunks run on the worker processes of SessionScheduler,
+(repeated spikes of a session are read once in the parent and shared with the
+forked workers).
+
+Random numbers are drawn from generators spawned with np.random.SeedSequence,
+keyed by (seed, job, chunk index), so that results do not depend on the number
+of workers or on the order chunks finish in. Job level random choices (stimuli
+and trials subsets for bootstrap) use their own key, and are same for all chunks.
+Each finished chunk is checkpointed to disk, an interrupted run computes only
+the missing chunks when started again. Once all chunks of a job are done, the
+distribution is saved (io.write_inter_trial_corr_dists) and checkpoints removed.
+
+Classes:
+    NormalizerExecutor:
+        Runs normalizer jobs in chunks using a pool of workers.
+
+Usage:
+    executor = NormalizerExecutor(NormalizerCalculator('ucsf'), num_workers=8)
+    jobs = executor.session_jobs(sessions, bin_widths=[50], num_itr=100000)
+    executor.run(jobs)
+"""
+
+import zlib
+import numpy as np
+
+from auditory_cortex.scheduler import SessionScheduler
+from .inter_trial_corr import InterTrialCorrBootstrap
+import auditory_cortex.io_utils.io as io
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class NormalizerExecutor:
+    def __init__(self, calculator, num_workers=1, chunk_size=10000, seed=0, threads_per_worker=None):
+        """
+        Args:
+            calculator: NormalizerCalculator = calculator for the dataset.
+            num_workers: int = number of worker processes, Default=1.
+            chunk_size: int = number of iterations in each chunk (and checkpoint).
+            seed: int = root seed, same seed gives same distributions.
+            threads_per_worker: int = limit on BLAS threads for each worker.
+        """
+        self.calculator = calculator
+        self.dataset_name = calculator.dataset_name
+        self.chunk_size = int(chunk_size)
+        self.seed = int(seed)
+        self.scheduler = SessionScheduler(num_workers=num_workers, threads_per_worker=threads_per_worker)
+
+    @staticmethod
+    def session_jobs(sessions, bin_widths, num_itr, mVocs=False):
+        """Returns jobs for distributions of all sessions and bin widths."""
+        return [
+            {'session': str(int(float(session))), 'bin_width': int(bin_width), 'mVocs': mVocs, 'num_itr': num_itr}
+            for session in sessions for bin_width in bin_widths
+            ]
+
+    @staticmethod
+    def bootstrap_jobs(session, percent_durations, num_trials_list, epoch_ids, bin_width, num_itr, mVocs=False):
+        """Returns jobs for bootstrapped distributions of the session."""
+        return [
+            {
+                'session': str(int(float(session))), 'bin_width': int(bin_width), 'mVocs': mVocs,
+                'num_itr': num_itr, 'bootstrap': True, 'epoch': int(epoch),
+                'percent_dur': percent_dur, 'num_trial': int(num_trial),
+            }
+            for epoch in epoch_ids for percent_dur in percent_durations for num_trial in num_trials_list
+            ]
+
+    def job_name(self, job):
+        """Returns name identifying the job, its seed and chunking."""
+        settings = {
+            'dataset': self.dataset_name, 'session': job['session'], 'bin_width': job['bin_width'],
+            'mVocs': job['mVocs'], 'num_itr': job['num_itr'], 'seed': self.seed, 'chunk': self.chunk_size,
+            }
+        if job.get('bootstrap', False):
+            settings.update(epoch=job['epoch'], percent_dur=job['percent_dur'], num_trial=job['num_trial'])
+        return io.settings_to_name(settings)
+
+    def job_rng(self, job, chunk_idx=None):
+        """Returns generator for the job (chunk_idx=None) or for its chunk,
+        depends only on seed, job settings and chunk index."""
+        job_key = zlib.crc32(self.job_name(job).encode())
+        key = (job_key, 0) if chunk_idx is None else (job_key, chunk_idx + 1)
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=key))
+
+    def _io_kwargs(self, job):
+        kwargs = dict(mVocs=job['mVocs'], dataset_name=self.dataset_name)
+        if job.get('bootstrap', False):
+            kwargs.update(
+                bootstrap=True, epoch=job['epoch'], percent_dur=job['percent_dur'], num_trial=job['num_trial']
+                )
+        return kwargs
+
+    def _num_chunks(self, job):
+        return int(np.ceil(job['num_itr']/self.chunk_size))
+
+    def run(self, jobs, force_redo=False):
+        """Computes and saves the distributions of all jobs.
+
+        Args:
+            jobs: list = jobs (see session_jobs and bootstrap_jobs).
+            force_redo: bool = If True, recomputes distributions already saved,
+                (checkpointed chunks are still reused).
+
+        Returns:
+            list = list of (group_key, chunk) that failed.
+        """
+        self._jobs = {}
+        groups = {}
+        for job in jobs:
+            if not force_redo:
+                norm_dist, null_dist = io.read_inter_trial_corr_dists(
+                    job['session'], job['bin_width'], **self._io_kwargs(job)
+                    )
+                if norm_dist is not None and null_dist is not None:
+                    continue
+            name = self.job_name(job)
+            done = set(io.list_normalizer_chunks(name, mVocs=job['mVocs'], dataset_name=self.dataset_name))
+            pending = [idx for idx in range(self._num_chunks(job)) if idx not in done]
+            self._jobs[name] = dict(job=job, pending=set(pending))
+            if len(pending) == 0:
+                self._finalize(name)
+                continue
+            logger.info(f"Job {name}: {len(done)} chunks checkpointed, {len(pending)} to compute.")
+            group_key = (job['session'], job['bin_width'], job['mVocs'])
+            groups.setdefault(group_key, []).extend([(name, idx) for idx in pending])
+
+        return self.scheduler.run(
+            list(groups.items()), self._make_group_state, _compute_chunk, self._save_chunk
+            )
+
+    def _make_group_state(self, group_key):
+        """Reads repeated spikes of the session and sets up bootstrap of all
+        jobs of the group, (in the parent process, shared with workers).
+        Statistics of all stimuli are computed once for the group, jobs on a
+        subset of stimuli only keep their stimulus ids (see _compute_chunk)."""
+        session, bin_width, mVocs = group_key
+        repeated_spikes = self.calculator.get_repeated_spikes(session, bin_width=bin_width, mVocs=mVocs)
+        stim_ids = list(repeated_spikes.keys())
+        channel_ids = list(repeated_spikes[stim_ids[0]].keys())
+        num_repeats = repeated_spikes[stim_ids[0]][channel_ids[0]].shape[0]
+        state = {}
+        full_bootstrap = InterTrialCorrBootstrap(repeated_spikes, stim_ids=stim_ids, channel_ids=channel_ids)
+        for name, job_state in self._jobs.items():
+            job = job_state['job']
+            if (job['session'], job['bin_width'], job['mVocs']) != group_key or len(job_state['pending']) == 0:
+                continue
+            trial_ids = np.arange(num_repeats)
+            job_stim_ids = None
+            if job.get('bootstrap', False):
+                rng = self.job_rng(job)
+                job_stim_ids = list(self.calculator.get_test_set_ids(job['percent_dur'], mVocs=mVocs, rng=rng))
+                trial_ids = self.calculator.sample_subset_of_trials(trial_ids, job['num_trial'], rng=rng)
+            state[name] = dict(
+                bootstrap=full_bootstrap, stim_ids=job_stim_ids, trial_ids=trial_ids, job=job,
+                chunk_rngs={idx: self.job_rng(job, idx) for idx in job_state['pending']},
+                chunk_size=self.chunk_size,
+                )
+        return state
+
+    def _save_chunk(self, group_key, unit, result):
+        """Checkpoints the chunk, saves the distribution once all chunks are done."""
+        name, chunk_idx = unit
+        norm_dist, null_dist, channel_ids = result
+        job_state = self._jobs[name]
+        io.write_normalizer_chunk(
+            norm_dist, null_dist, channel_ids, name, chunk_idx,
+            mVocs=job_state['job']['mVocs'], dataset_name=self.dataset_name
+            )
+        job_state['pending'].discard(chunk_idx)
+        if len(job_state['pending']) == 0:
+            self._finalize(name)
+
+    def _finalize(self, name):
+        """Concatenates checkpointed chunks and saves the distributions of the job."""
+        job = self._jobs[name]['job']
+        chunks = io.read_normalizer_chunks(name, mVocs=job['mVocs'], dataset_name=self.dataset_name)
+        chunk_ids = sorted(chunks.keys())
+        channel_ids = chunks[chunk_ids[0]][2]
+        norm_dist = np.concatenate([chunks[idx][0] for idx in chunk_ids], axis=0)
+        null_dist = np.concatenate([chunks[idx][1] for idx in chunk_ids], axis=0)
+        io.write_inter_trial_corr_dists(
+            {ch: norm_dist[:, i] for i, ch in enumerate(channel_ids)},
+            {ch: null_dist[:, i] for i, ch in enumerate(channel_ids)},
+            job['session'], job['bin_width'], **self._io_kwargs(job)
+            )
+        io.clear_normalizer_chunks(name, mVocs=job['mVocs'], dataset_name=self.dataset_name)
+
+
+def _compute_chunk(state, group_key, unit):
+    """Computes a chunk of iterations of a job, (runs in the worker process)."""
+    name, chunk_idx = unit
+    job_state = state[name]
+    num_itr = job_state['job']['num_itr']
+    chunk_size = job_state['chunk_size']
+    chunk_itr = min(chunk_size, num_itr - chunk_idx*chunk_size)
+    bootstrap = job_state['bootstrap']
+    if job_state['stim_ids'] is not None:
+        # statistics of the subset are gathered by index, (nothing copied)..
+        bootstrap = bootstrap.subset(job_state['stim_ids'])
+    norm_dist, null_dist = bootstrap.sample(
+        chunk_itr, trial_ids=job_state['trial_ids'], rng=job_state['chunk_rngs'][chunk_idx]
+        )
+    return norm_dist, null_dist, bootstrap.channel_ids
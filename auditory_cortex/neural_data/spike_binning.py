@@ -0,0 +1,100 @@
+"""
+Vectorized binning of spike times.
+
+Spikes of all trials and channels of a stimulus are passed as flat arrays
+(spike times with trial and channel index of each spike), located in the bins
+with a single np.searchsorted and counted with a single np.bincount,
+giving dense (trials, bins, channels) counts.
+
+Functions:
+    accumulated_bin_edges(num_bins, bin_width, delay=0):
+        Bin edges computed by repeatedly adding bin_width, as in UCSFDataset.create_bins.
+
+    uniform_bin_edges(duration, bin_width, delay=0):
+        Bin edges used by BaseDataset.bin_spike_times.
+
+    bin_spikes(times, trial_idx, channel_idx, num_trials, num_channels, edges, right=True, upper=None):
+        Counts spikes of all trials and channels in the bins at once.
+
+    counts_to_channel_dict(counts):
+        Converts (trials, bins, channels) counts to {channel: (trials, bins)}.
+"""
+
+import numpy as np
+
+
+def accumulated_bin_edges(num_bins, bin_width, delay=0):
+    """Returns bin edges [delay, delay+w, (delay+w)+w, ...], edges are
+    computed by sequentially adding bin_width (same floating point
+    values as the window pointer of UCSFDataset.create_bins).
+
+    Args:
+        num_bins: int = number of bins.
+        bin_width: float = width of bins in seconds.
+        delay: float = start of the first bin in seconds.
+
+    Returns:
+        edges: ndarray = (num_bins+1,)
+    """
+    steps = np.full(num_bins+1, bin_width, dtype=np.float64)
+    steps[0] = delay
+    return np.add.accumulate(steps)
+
+def uniform_bin_edges(duration, bin_width, delay=0):
+    """Returns bin edges used by BaseDataset.bin_spike_times,
+    partial bin at the end is included if it is at least half of bin_width.
+
+    Args:
+        duration: float = duration of trial in seconds.
+        bin_width: float = width of bins in seconds.
+        delay: float = start of the first bin in seconds.
+
+    Returns:
+        edges: ndarray = (num_bins+1,)
+    """
+    duration += 1e-6
+    return np.arange(delay, delay + duration + bin_width/2, bin_width)
+
+
+def bin_spikes(
+        times, trial_idx, channel_idx, num_trials, num_channels, edges, right=True, upper=None
+    ):
+    """Counts spikes of all trials and channels in the bins defined by edges.
+
+    Args:
+        times: ndarray = (N,) spike times (relative to stimulus onset), in any order.
+        trial_idx: ndarray = (N,) trial index [0, num_trials) of each spike.
+        channel_idx: ndarray = (N,) channel index [0, num_channels) of each spike.
+        num_trials: int = number of trials.
+        num_channels: int = number of channels.
+        edges: ndarray = (num_bins+1,) monotonically increasing bin edges.
+        right: bool = If True, bins are (edges[j], edges[j+1]] (UCSFDataset.create_bins),
+            otherwise [edges[j], edges[j+1]) with last bin closed (np.histogram).
+        upper: float = If not None, only spikes with times < upper are counted.
+
+    Returns:
+        counts: ndarray = (num_trials, num_bins, num_channels) int32 spike counts.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    edges = np.asarray(edges, dtype=np.float64)
+    num_bins = edges.size - 1
+    if right:
+        bin_idx = np.searchsorted(edges, times, side='left') - 1
+    else:
+        bin_idx = np.searchsorted(edges, times, side='right') - 1
+        # last bin includes the right edge..
+        bin_idx[times == edges[-1]] = num_bins - 1
+    valid = (bin_idx >= 0) & (bin_idx < num_bins)
+    if upper is not None:
+        valid &= times < upper
+
+    flat_idx = (
+        np.asarray(trial_idx)[valid]*num_bins + bin_idx[valid]
+        )*num_channels + np.asarray(channel_idx)[valid]
+    counts = np.bincount(flat_idx, minlength=num_trials*num_bins*num_channels)
+    return counts.reshape(num_trials, num_bins, num_channels).astype(np.int32)
+
+def counts_to_channel_dict(counts):
+    """Converts (trials, bins, channels) counts to {channel: (trials, bins)},
+    the format returned by extract_spikes of the datasets."""
+    return {ch: np.ascontiguousarray(counts[..., ch]) for ch in range(counts.shape[-1])}
@@ -39,6 +39,7 @@ import scipy.io
 import numpy as np
 
 from ..base_dataset import BaseDataset, register_dataset
+from .. import spike_binning
 from .ucdavis_metadata import UCDavisMetaData
 from auditory_cortex import neural_data_dir, NEURAL_DATASETS
 
@@ -64,6 +65,7 @@ class UCDavisDataset(BaseDataset):
         self.tetrodes = ['WM_1', 'WM_2', 'WM_3', 'WM_4' ]  # example tetrode
         self.assigned_units = np.concatenate([np.unique(self.data[tet].codes) for tet in self.tetrodes])
         # all assigned unit ids (SUA and MUA) across all tetrodes
+        self.tetrode_spikes, self.exp_stim_trials = self.index_spikes()
 
         # self.data is the entire data structre: contains
         #   TrialStimData, WM_1, WM_2, WM_3, WM_4
@@ -74,6 +76,42 @@ class UCDavisDataset(BaseDataset):
         # BMT#: {'unique': [...], 'repeated': [...]},
         # BMM#: {'unique': [...], 'repeated': [...]}
         #}
+        # self.tetrode_spikes: spike times sorted once per tetrode
+        #   {tet: (times, unit_idx, codes)}
+        # self.exp_stim_trials: trial indices for each stimulus
+        #   {BMT#: {stim_id: [...]}, BMM#: {stim_id: [...]}}
+
+    def index_spikes(self):
+        """Sorts spike times of each tetrode (with unit index of each spike) and
+        maps stimulus ids to trial indices, so that spikes of all trials and units of 
+        a stimulus are looked up with np.searchsorted instead of masks.
+
+        Returns:
+            tetrode_spikes: dict = {tet: (times, unit_idx, codes)}, codes are unique
+                unit codes of the tetrode and unit_idx index into codes.
+            exp_stim_trials: dict = {exp_name: {stim_id: trial indices}}
+        """
+        tetrode_spikes = {}
+        for tet in self.tetrodes:
+            times = np.atleast_1d(self.data[tet].times)
+            spk_codes = np.atleast_1d(self.data[tet].codes)
+            order = np.argsort(times, kind='stable')
+            codes = np.unique(spk_codes)
+            unit_idx = np.searchsorted(codes, spk_codes[order])
+            tetrode_spikes[tet] = (times[order], unit_idx, codes)
+
+        exp_stim_trials = {}
+        for exp_name, trial_data in self.exp_wise_trial.items():
+            exp_stim_ids = np.array([
+                exp_stim_id.split('\\')[-1] for exp_stim_id in self.get_value(trial_data, 'StimulusName')
+                ])
+            stim_trials = {}
+            for tr_id, stim_id in enumerate(exp_stim_ids):
+                stim_trials.setdefault(stim_id, []).append(tr_id)
+            exp_stim_trials[exp_name] = {
+                stim_id: np.array(tr_ids) for stim_id, tr_ids in stim_trials.items()
+                }
+        return tetrode_spikes, exp_stim_trials
 
     def exp_name(self, mVocs=False):
         """Returns the experiment name for stim type and num of repeats"""
@@ -138,47 +176,123 @@ class UCDavisDataset(BaseDataset):
         """
         stim_group = 'repeated' if repeated else 'unique'
         stim_ids = self.get_stim_ids(mVocs)[stim_group]
-        spikes = {}
-        for stim_id in stim_ids:
-            spikes[stim_id] = self.stim_spike_counts(stim_id, mVocs, bin_width, delay)
-        return spikes
+        return self.stims_spike_counts(stim_ids, mVocs, bin_width, delay)
+
+    def stim_trial_windows(self, stim_id, mVocs=False):
+        """Returns stimulus onsets (of all trials) and duration of the stimulus."""
+        trial_data = self.exp_wise_trial[self.exp_name(mVocs)]
+        tr_ids = self.exp_stim_trials[self.exp_name(mVocs)].get(stim_id, np.array([], dtype=int))
+        stim_onset = np.atleast_1d(self.get_value(trial_data, 'StimulusTimeOn'))[tr_ids]
+        stim_dur = self.get_stim_duration(stim_id, mVocs)
+        return stim_onset, stim_dur
+
+    def window_spikes(self, tet, onsets, ends):
+        """Returns spikes of the tetrode within [onset, end] windows,
+        all windows found with a single searchsorted on the sorted spike times.
+
+        Returns:
+            relative_times: ndarray = (N,) spike times relative to onset of the window.
+            window_idx: ndarray = (N,) window index of each spike.
+            unit_idx: ndarray = (N,) unit index of each spike (into tetrode codes).
+        """
+        times, unit_idx, _ = self.tetrode_spikes[tet]
+        starts = np.searchsorted(times, onsets, side='left')
+        lengths = np.searchsorted(times, ends, side='right') - starts
+        lengths = np.maximum(lengths, 0)
+        slice_ends = np.cumsum(lengths)
+        spike_idx = np.arange(slice_ends[-1] if lengths.size > 0 else 0) + np.repeat(
+            starts - (slice_ends - lengths), lengths
+            )
+        window_idx = np.repeat(np.arange(lengths.size), lengths)
+        relative_times = times[spike_idx] - np.asarray(onsets)[window_idx]
+        return relative_times, window_idx, unit_idx[spike_idx]
 
     def stim_spike_times(self, stim_id, mVocs=False):
         """Returns the spike times for the given channel, spike
         times are returned relative to the stimulus onset.
         
+        Returns:
+            spike_times: dict = {code: [trial spike times, ...]}
         """
-        exp_name = self.exp_name(mVocs)
-        trial_data = self.exp_wise_trial[exp_name]
-
-        exp_stim_ids = np.array([
-            exp_stim_id.split('\\')[-1] for exp_stim_id in self.get_value(trial_data, 'StimulusName')
-            ])
-        tr_id = np.where(exp_stim_ids==stim_id)[0]
-        stim_onset = self.get_value(trial_data, 'StimulusTimeOn')[tr_id]
-        stim_dur = self.get_stim_duration(stim_id, mVocs)
-        tetrodes = ['WM_1', 'WM_2', 'WM_3', 'WM_4']
+        stim_onset, stim_dur = self.stim_trial_windows(stim_id, mVocs)
         spike_times = {code: [] for code in self.assigned_units}  # dict to hold spike times for each assigned unit
-        for tet in tetrodes:
-            all_tet_codes = np.unique(self.data[tet].codes)        # all unique codes for the tetrode
-            # spk_times_all_trials = []
-            for onset in stim_onset:
-                spikes_mask = (self.data[tet].times >= onset) & (self.data[tet].times <= onset + stim_dur)
-                relative_spk_times = self.data[tet].times[spikes_mask] - onset	# relative to stimulus onset
-                tr_codes = self.data[tet].codes[spikes_mask]
-                for code in all_tet_codes:
-                    code_mask = tr_codes == code
-                    spike_times[code].append(relative_spk_times[code_mask])  
-                    # append relative spike times for each code
-            #     spk_times_all_trials.append(relative_spk_times)
-            # spike_times[tet] = spk_times_all_trials
+        for tet in self.tetrodes:
+            codes = self.tetrode_spikes[tet][2]        # all unique codes for the tetrode
+            relative_spk_times, window_idx, unit_idx = self.window_spikes(
+                tet, stim_onset, stim_onset + stim_dur
+                )
+            # spikes are ordered by (trial, time), split by trial and then by unit..
+            for tr in range(stim_onset.size):
+                tr_mask = window_idx == tr
+                tr_times, tr_units = relative_spk_times[tr_mask], unit_idx[tr_mask]
+                for i, code in enumerate(codes):
+                    spike_times[code].append(tr_times[tr_units == i])
         return spike_times
         
     def stim_spike_counts(self, stim_id, mVocs=False, bin_width=50, delay=0):
         """Returns the binned spike counts for the given stimulus id"""
-        spike_times = self.stim_spike_times(stim_id, mVocs)
-        stim_dur = self.get_stim_duration(stim_id, mVocs)
-        return BaseDataset.bin_spike_times(spike_times, stim_dur, bin_width, delay)
+        return self.stims_spike_counts([stim_id], mVocs, bin_width, delay)[stim_id]
+
+    def stims_spike_counts(self, stim_ids, mVocs=False, bin_width=50, delay=0):
+        """Returns the binned spike counts for a batch of stimuli, spikes of all
+        trials and units of all the stimuli are binned in one pass per tetrode.
+        Bins are the same as BaseDataset.bin_spike_times.
+
+        Args:
+            stim_ids: list = stimulus ids.
+            mVocs: bool = If True, stimuli of mVocs experiment.
+            bin_width: int = miliseconds specifying the time duration of each bin
+            delay: int = miliseconds specifying the time delay
+
+        Returns:
+            spikes: dict of dict = {stim_id: {code: (trials, bins) spike_counts}}
+        """
+        bin_width = bin_width/1000
+        delay = delay/1000
+        windows = [self.stim_trial_windows(stim_id, mVocs) for stim_id in stim_ids]
+        onsets = np.concatenate([onset for onset, _ in windows])
+        ends = np.concatenate([onset + dur for onset, dur in windows])
+        num_trials = np.array([onset.size for onset, _ in windows])
+        # edges of all stimuli are prefixes of the edges of the longest stimulus..
+        num_bins = np.array([
+            spike_binning.uniform_bin_edges(dur, bin_width, delay).size - 1 for _, dur in windows
+            ])
+        edges = spike_binning.uniform_bin_edges(max([dur for _, dur in windows]), bin_width, delay)
+        window_bins = np.repeat(num_bins, num_trials)
+
+        spikes = {stim_id: {} for stim_id in stim_ids}
+        for tet in self.tetrodes:
+            codes = self.tetrode_spikes[tet][2]
+            num_units = codes.size
+            relative_times, window_idx, unit_idx = self.window_spikes(tet, onsets, ends)
+            bin_idx = np.searchsorted(edges, relative_times, side='right') - 1
+            spk_bins = window_bins[window_idx]
+            # last bin includes its right edge (np.histogram)..
+            on_last_edge = (bin_idx == spk_bins) & (relative_times == edges[np.minimum(spk_bins, edges.size-1)])
+            bin_idx[on_last_edge] -= 1
+            valid = (bin_idx >= 0) & (bin_idx < spk_bins)
+
+            window_size = window_bins*num_units
+            window_base = np.cumsum(window_size) - window_size
+            flat_idx = window_base[window_idx[valid]] + bin_idx[valid]*num_units + unit_idx[valid]
+            counts = np.bincount(flat_idx, minlength=window_size.sum())
+
+            window = 0
+            for stim_id, n_tr, n_bins in zip(stim_ids, num_trials, num_bins):
+                start = window_base[window] if n_tr > 0 else 0
+                stim_counts = counts[start: start + n_tr*n_bins*num_units].reshape(n_tr, n_bins, num_units)
+                window += n_tr
+                for i, code in enumerate(codes):
+                    unit_counts = stim_counts[..., i]
+                    if code in spikes[stim_id]:
+                        # same code on multiple tetrodes, trials are appended..
+                        unit_counts = np.concatenate([spikes[stim_id][code], unit_counts], axis=0)
+                    spikes[stim_id][code] = unit_counts
+        # order units same as assigned_units..
+        return {
+            stim_id: {code: stim_spikes[code] for code in dict.fromkeys(self.assigned_units)}
+            for stim_id, stim_spikes in spikes.items()
+            }
 
     def read_sess_dataset(self, rec_filename: 'str'):
         """Specify the session number to read the recording data"""
@@ -35,13 +35,13 @@ Contains metadata for mVocs experiment, including waveform names, durations, and
 import os
 import glob
 from pathlib import Path
-import struct
 import scipy.io 
 import numpy as np
 
 from .recording_config import RecordingConfig
 from ..base_metadata import BaseMetaData, register_metadata
-from auditory_cortex import neural_data_dir, NEURAL_DATASETS
+from ..audio_store import AudioCache, read_wfm
+from auditory_cortex import neural_data_dir, NEURAL_DATASETS, config
 
 import logging
 logger = logging.getLogger(__name__)
@@ -73,7 +73,7 @@ class UCDavisMetaData(BaseMetaData):
         self.timit_ids = self.timit_meta['timit'].wfmName[timit_mask]
         self.timit_dur_dict = {stim_id: dur for stim_id, dur in zip(self.timit_ids, timit_durs)}
         # self.timit_audios = self.read_stim_audios(self.timit_ids, mVocs=False)
-        self.timit_audios = {}	# no need to read in advance
+        self.timit_audios = AudioCache(config.get('audio_cache_size', None))	# no need to read in advance
 
         # reading mVocs metadata
         self.mVocs_meta_file = os.path.join(self.data_dir, 'MSL.mat')
@@ -83,7 +83,7 @@ class UCDavisMetaData(BaseMetaData):
         self.mVocs_ids = self.mVocs_meta['MSL'].WFMname#[mVocs_mask]
         self.mVocs_dur_dict = {stim_id: dur for stim_id, dur in zip(self.mVocs_ids, mVocs_durs)}
         # self.mVocs_audios = self.read_stim_audios(self.mVocs_ids, mVocs=True)
-        self.mVocs_audios = {}	# no need to read in advance
+        self.mVocs_audios = AudioCache(config.get('audio_cache_size', None))	# no need to read in advance
 
         self.timit_stim_ids, self.mVocs_stim_ids = self.read_stim_ids()
 
@@ -178,18 +178,14 @@ class UCDavisMetaData(BaseMetaData):
         """Reads stim audio for the given stimulus id"""
         if mVocs:
             stim_audios = self.mVocs_audios
+            stim_dir = os.path.join(self.data_dir, 'NIMH_Mvoc_WFM')
         else:
             stim_audios = self.timit_audios
-
-        if stim_id not in stim_audios:
-            if mVocs:
-                stim_dir = os.path.join(self.data_dir, 'NIMH_Mvoc_WFM')
-            else:
-                stim_dir = os.path.join(self.data_dir, 'TIMIT_48000')
-            stim_filepath = os.path.join(stim_dir, stim_id)
-            stim_audio = UCDavisMetaData.read_wfm(stim_filepath)
-            stim_audios[stim_id] = stim_audio
-        return stim_audios[stim_id]
+            stim_dir = os.path.join(self.data_dir, 'TIMIT_48000')
+        # LRU cache, (bounded by 'audio_cache_size' of config)..
+        return stim_audios.get(
+            stim_id, lambda: UCDavisMetaData.read_wfm(os.path.join(stim_dir, stim_id))
+            )
 
     def get_sampling_rate(self, mVocs=False):
         return self.sampling_rate
@@ -294,14 +290,8 @@ class UCDavisMetaData(BaseMetaData):
         Returns:
             np.ndarray: Array of audio samples.
         """
-        with open(filename, "rb") as file:
-            # Read the entire binary data
-            binary_data = file.read()
-            
-            # Unpack the binary data as 16-bit integers ('h' = short, little-endian '<')
-            num_samples = len(binary_data) // 2  # 2 bytes per 16-bit sample
-            samples = struct.unpack(f"<{num_samples}h", binary_data)  # Little-endian 16-bit integers
-        return np.array(samples, dtype=np.float32)/2**15	# Normalize to [-1, 1]
+        # decoded from memory map of the file (see audio_store.read_wfm)..
+        return read_wfm(filename)
 
     @staticmethod
     def read_stim_meta(filepath):
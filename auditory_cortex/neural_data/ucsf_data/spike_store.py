@@ -0,0 +1,195 @@
+"""
+Trial-indexed spike store for UCSF sessions.
+
+Spikes of all channels of a session are sorted by (channel, trial) and kept as
+flat arrays with CSR-style offsets, so that spikes of any (channel, trial) are
+an O(1) slice, and spikes of all channels and trials of a stimulus are
+gathered without scanning the trial vector of each channel.
+The store is saved next to the __MUspk.mat files of the session, later runs
+load it instead of reading the .mat files (invalidated if .mat files change).
+
+Classes:
+    SpikeStore:
+        Built from spike/trial structs of the __MUspk.mat files, or loaded from disk.
+"""
+
+import os
+import numpy as np
+from types import SimpleNamespace
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SpikeStore:
+    STORE_VERSION = 1
+
+    def __init__(self, channels, offsets, spike_fields, trial_fields, sources=None):
+        """
+        Args:
+            channels: list = channel keys, in the order stored.
+            offsets: ndarray = (num_channels, max_trial+2) offsets into flat spike arrays,
+                spikes of channel c and trial tr are [offsets[c, tr], offsets[c, tr+1]).
+            spike_fields: dict = {field: (N,) flat per-spike arrays} e.g. 'trial',
+                'stimlock', 'spktimes', sorted by (channel, trial).
+            trial_fields: dict = {field: (num_trials,)} per-trial arrays e.g. 'stimon'.
+            sources: ndarray = (num_files,) [name, size, mtime] of the .mat files.
+        """
+        self.channels = list(channels)
+        self.offsets = offsets
+        self.spike_fields = spike_fields
+        self.trial_fields = trial_fields
+        self.sources = sources
+        self.max_trial = offsets.shape[1] - 2
+
+    @classmethod
+    def from_structs(cls, spikes, trials, sources=None):
+        """Builds store from the spike and trial structs of __MUspk.mat files.
+
+        Args:
+            spikes: dict = {channel: spike struct}
+            trials: dict = {channel: trial struct}, trials of the first
+                channel are kept (same for all channels).
+        """
+        channels = sorted(spikes.keys())
+        spike_trials = [np.atleast_1d(spikes[ch].trial).astype(np.int64) for ch in channels]
+        max_trial = max([int(tr.max()) for tr in spike_trials if tr.size > 0], default=0)
+
+        # per-spike fields, i.e. arrays as long as the trial vector of every channel..
+        field_names = [
+            name for name in spikes[channels[0]]._fieldnames
+            if all(np.atleast_1d(getattr(spikes[ch], name)).shape == spike_trials[i].shape
+                   and np.issubdtype(np.atleast_1d(getattr(spikes[ch], name)).dtype, np.number)
+                   for i, ch in enumerate(channels))
+            ]
+        spike_fields = {name: [] for name in field_names}
+        offsets = np.zeros((len(channels), max_trial+2), dtype=np.int64)
+        base = 0
+        for i, ch in enumerate(channels):
+            order = np.argsort(spike_trials[i], kind='stable')
+            for name in field_names:
+                spike_fields[name].append(np.atleast_1d(getattr(spikes[ch], name))[order])
+            counts = np.bincount(spike_trials[i], minlength=max_trial+1)
+            offsets[i, 1:] = base + np.cumsum(counts)
+            offsets[i, 0] = base
+            base += spike_trials[i].size
+        spike_fields = {name: np.concatenate(values) for name, values in spike_fields.items()}
+
+        trial_struct = trials[channels[0]]
+        trial_fields = {}
+        for name in trial_struct._fieldnames:
+            value = np.atleast_1d(getattr(trial_struct, name))
+            if value.ndim == 1 and np.issubdtype(value.dtype, np.number):
+                trial_fields[name] = value
+        return cls(channels, offsets, spike_fields, trial_fields, sources=sources)
+
+    @staticmethod
+    def file_sources(dir_path, file_names):
+        """Returns [name, size, mtime] of files, used to invalidate saved store."""
+        sources = []
+        for name in file_names:
+            stat = os.stat(os.path.join(dir_path, name))
+            sources.append([name, str(stat.st_size), str(stat.st_mtime_ns)])
+        return np.array(sources, dtype=str)
+
+    def save(self, file_path):
+        """Saves store to .npz file, (warns if directory is not writable)."""
+        arrays = {
+            'version': np.array(self.STORE_VERSION),
+            'channels': np.array(self.channels),
+            'offsets': self.offsets,
+            }
+        if self.sources is not None:
+            arrays['sources'] = self.sources
+        arrays.update({f'spike_{name}': value for name, value in self.spike_fields.items()})
+        arrays.update({f'trial_{name}': value for name, value in self.trial_fields.items()})
+        try:
+            tmp_path = file_path + '.tmp.npz'
+            np.savez(tmp_path, **arrays)
+            os.replace(tmp_path, file_path)
+            logger.info(f"Spike store saved to: {file_path}")
+        except OSError as err:
+            logger.warning(f"Could not save spike store to {file_path}: {err}")
+
+    @classmethod
+    def load(cls, file_path, sources=None):
+        """Loads store from .npz file, returns None if file does not exist
+        or was built from different files than sources."""
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as data:
+            if int(data['version']) != cls.STORE_VERSION:
+                return None
+            saved_sources = data['sources'] if 'sources' in data.files else None
+            if sources is not None and (
+                    saved_sources is None or not np.array_equal(saved_sources, sources)
+                ):
+                logger.info(f"Spike store is stale, rebuilding: {file_path}")
+                return None
+            spike_fields, trial_fields = {}, {}
+            for key in data.files:
+                if key.startswith('spike_'):
+                    spike_fields[key[len('spike_'):]] = data[key]
+                elif key.startswith('trial_'):
+                    trial_fields[key[len('trial_'):]] = data[key]
+            channels = data['channels'].tolist()
+            offsets = data['offsets']
+        return cls(channels, offsets, spike_fields, trial_fields, sources=saved_sources)
+
+    def spike_times(self, ch, tr, timing_type='relative'):
+        """Returns spike times of channel and trial, (a view, O(1)).
+
+        Args:
+            ch: int = index of the channel.
+            tr: int = session trial ID (MATLAB ID).
+            timing_type: str = 'relative' to stimulus onset or 'absolute'.
+        """
+        field = 'stimlock' if timing_type == 'relative' else 'spktimes'
+        if tr < 0 or tr > self.max_trial:
+            return self.spike_fields[field][:0]
+        return self.spike_fields[field][self.offsets[ch, tr]: self.offsets[ch, tr+1]]
+
+    def trial_spike_times(self, tr_ids, timing_type='relative'):
+        """Returns spike times of all channels for the given trials, as flat arrays.
+
+        Args:
+            tr_ids: list = session trial IDs (MATLAB IDs).
+
+        Returns:
+            times: ndarray = (N,) spike times.
+            trial_idx: ndarray = (N,) index of trial in tr_ids for each spike.
+            channel_idx: ndarray = (N,) channel index of each spike.
+        """
+        field = 'stimlock' if timing_type == 'relative' else 'spktimes'
+        tr_ids = np.asarray(tr_ids, dtype=np.int64)
+        valid = (tr_ids >= 0) & (tr_ids <= self.max_trial)
+        tr_ids = np.where(valid, tr_ids, 0)
+        # (channels, trials) slices..
+        starts = self.offsets[:, tr_ids]
+        lengths = np.where(valid, self.offsets[:, tr_ids+1] - starts, 0).ravel()
+        starts = starts.ravel()
+        total = lengths.sum()
+        # index of every spike in the flat arrays, without looping over slices..
+        slice_ends = np.cumsum(lengths)
+        spike_idx = np.arange(total) + np.repeat(starts - (slice_ends - lengths), lengths)
+
+        num_channels, num_trials = len(self.channels), tr_ids.size
+        trial_idx = np.repeat(np.tile(np.arange(num_trials), num_channels), lengths)
+        channel_idx = np.repeat(np.repeat(np.arange(num_channels), num_trials), lengths)
+        return self.spike_fields[field][spike_idx], trial_idx, channel_idx
+
+    def spike_structs(self):
+        """Returns {channel: struct} with per-spike fields of each channel
+        (views of the flat arrays), in place of the structs of .mat files."""
+        structs = {}
+        for i, ch in enumerate(self.channels):
+            start, end = self.offsets[i, 0], self.offsets[i, -1]
+            structs[ch] = SimpleNamespace(
+                **{name: value[start:end] for name, value in self.spike_fields.items()}
+                )
+        return structs
+
+    def trial_structs(self):
+        """Returns {channel: struct} with per-trial fields, (same for all channels)."""
+        trial_struct = SimpleNamespace(**self.trial_fields)
+        return {ch: trial_struct for ch in self.channels}
@@ -6,7 +6,9 @@ import matplotlib.pyplot as plt
 import auditory_cortex.utils as utils
 from auditory_cortex import neural_data_dir, NEURAL_DATASETS
 from .ucsf_metadata import UCSFMetaData
+from .spike_store import SpikeStore
 from ..base_dataset import BaseDataset, register_dataset
+from .. import spike_binning
 import logging
 logger = logging.getLogger(__name__)
 
@@ -100,25 +102,33 @@ class UCSFDataset(BaseDataset):
 
     def load_data(self, verbose):
         """ Loads data from __MUspk.mat files and returns a tuple of dictionaries. 
+        Also builds the trial-indexed spike store (self.spike_store), saved next to
+        the __MUspk files, if saved store is up to date, .mat files are not read.
 
         Returns:
         (spikes, trials): 1st carries dictionary of spike structs read from __MUspk files
         and second one carries dictionary of trial structs.
         """
         path = self.data_dir / 'sessions' / self.sub
+        self.names.sort()
+        mat_names = [name for name in self.names if 'MUspk' in name]
+        store_path = os.path.join(path, f'{self.sub}_spike_store.npz')
+        sources = SpikeStore.file_sources(path, mat_names)
+        self.spike_store = SpikeStore.load(store_path, sources=sources)
+        if self.spike_store is not None:
+            logger.info(f"Loaded spike store for session: {self.sub}")
+            return self.spike_store.spike_structs(), self.spike_store.trial_structs()
+
         spikes = {}
         trials = {}
-        data = {}
-        self.names.sort()
-        for i, name in enumerate(self.names):
+        for i, name in enumerate(mat_names):
             if verbose:
                 print(name)
-            if 'MUspk' in name:
-                # print(name)
-                data[i] = io.loadmat(os.path.join(path,name), squeeze_me = True, struct_as_record = False)
-                spikes[i] = data[i]['spike']
-                trials[i] = data[i]['trial']
-        
+            data = io.loadmat(os.path.join(path,name), squeeze_me = True, struct_as_record = False)
+            spikes[i] = data['spike']
+            trials[i] = data['trial']
+        self.spike_store = SpikeStore.from_structs(spikes, trials, sources=sources)
+        self.spike_store.save(store_path)
         return spikes, trials
 
     def phoneme(self, sent=1):
@@ -194,10 +204,8 @@ class UCSFDataset(BaseDataset):
         """
         if mVocs:
             get_trial_ids = self.metadata.nid_to_tr_id
-            get_spike_counts = self.retrieve_mVocs_spike_counts
         else:
             get_trial_ids = self.get_trials
-            get_spike_counts = self.retrieve_spike_counts
 
         stim_group = 'repeated' if repeated else 'unique'
         stim_ids = self.get_stim_ids(mVocs=mVocs)[stim_group]
@@ -207,33 +215,60 @@ class UCSFDataset(BaseDataset):
             if not repeated:
                 # only one trial for unique stimuli
                 tr_ids = tr_ids[:1]
-
-            all_tr_spikes = []
-            for tr_id in tr_ids:
-                # if mVocs:
-                #     tr_id = tr_id + self.mVocs_first_tr
-                try:
-                    tr_spikes = get_spike_counts(trial=tr_id, win=bin_width, delay=delay)
-                    all_tr_spikes.append(tr_spikes)
-                except:
-                    logger.debug(f"Missing trial id: {tr_id}, skipping...")
-                    continue
-
-
-            if len(all_tr_spikes) == 0:
+            counts = self.bin_trial_spikes(tr_ids, bin_width=bin_width, delay=delay, mVocs=mVocs)
+            if counts is None:
                 # this can happen if all trials for a stim_id are missing
                 continue
+            spikes[stim_id] = spike_binning.counts_to_channel_dict(counts)
+        return spikes
 
-            num_channels = len(all_tr_spikes[0])
-            all_ch_spikes_dict = {}
-            for ch in range(num_channels):
-                channel_spikes = [tr_spikes[ch] for tr_spikes in all_tr_spikes]
-                channel_spikes = np.stack(channel_spikes, axis=0)
-                all_ch_spikes_dict[ch] = channel_spikes
+    def bin_trial_spikes(self, tr_ids, bin_width=50, delay=0, mVocs=False):
+        """Returns spike counts of all channels for the trials of a stimulus,
+        binned in one vectorized pass (same bins as create_bins for TIMIT and
+        BaseDataset.bin_spike_times for mVocs trials).
 
-            spikes[stim_id] = all_ch_spikes_dict
-        return spikes
+        Args:
+            tr_ids: list = trial IDs of the same stimulus, (session trial IDs for TIMIT,
+                trial IDs in [0, 779] for mVocs).
+            bin_width: int = width of the time window in milliseconds.
+            delay: int = delay in milliseconds, default is 0.
+            mVocs: bool = if True, tr_ids are mVocs trials.
 
+        Returns:
+            counts: ndarray = (trials, bins, channels) spike counts, 
+                None if all trials are missing.
+        """
+        win = bin_width/1000
+        delay = delay/1000
+        tr_ids = np.atleast_1d(tr_ids)
+        if mVocs:
+            missing = np.isin(tr_ids, self.missing_trial_ids)
+            if np.any(missing):
+                logger.debug(f"Missing trial ids: {tr_ids[missing]}, skipping...")
+                tr_ids = tr_ids[~missing]
+            if tr_ids.size == 0:
+                return None
+            duration = self.metadata.get_mVoc_dur(tr_ids[0])
+            edges = spike_binning.uniform_bin_edges(duration, win, delay)
+            upper = None
+            right = False
+            # map trial Id [0, 779] to session specific trial Id.. 
+            sess_tr_ids = self.mVocs_first_tr + tr_ids
+        else:
+            # MATLAB ID to PYTHON ID
+            sent = self.trials[0].timitStimcode[tr_ids[0]-1]
+            n = BaseDataset.calculate_num_bins(self.duration(sent), win)
+            self.sent_sections[sent] = [0, int(n/3), int(2*n/3), n]
+            edges = spike_binning.accumulated_bin_edges(n, win, delay)
+            upper = n*win + delay
+            right = True
+            sess_tr_ids = tr_ids
+
+        times, trial_idx, channel_idx = self.spike_store.trial_spike_times(sess_tr_ids)
+        return spike_binning.bin_spikes(
+            times, trial_idx, channel_idx, len(sess_tr_ids), self.num_channels,
+            edges, right=right, upper=upper
+            )
 
     def retrieve_spike_times(self, sent=212, trial = 0 , timing_type = 'relative'):
         """Returns times of spikes, relative to stimulus onset or absolute time
@@ -251,13 +286,8 @@ class UCSFDataset(BaseDataset):
         else:
             tr = trial
         for i in range(self.num_channels):
-            j = i
-            spike_indices = np.where(self.spikes[j].trial == tr)
             #spike times relative to the stimuls On time (Stimon)
-            if timing_type == 'relative':
-                s_times[i] = self.spikes[j].stimlock[spike_indices]   
-            elif timing_type == 'absolute':
-                s_times[i] = self.spikes[j].spktimes[spike_indices]   
+            s_times[i] = self.spike_store.spike_times(i, tr, timing_type=timing_type)
         
         return s_times
 
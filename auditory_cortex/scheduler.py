@@ -0,0 +1,145 @@
+"""
+Process pool scheduler for running TRF fits of many sessions concurrently.
+
+Sessions are grouped by the features they need, e.g. (bin_width, layer).
+For each group, the data assembler (holding resampled DNN features) is built
+once in the parent process, and the sessions of the group are fanned out
+to a pool of forked worker processes. Workers share the read-only features
+of the parent (copy-on-write pages of the fork), so features are neither
+reloaded nor copied. Each worker only reads spikes for its session and fits
+the model, results are sent back to the parent, which is the only process
+writing to the results table.
+
+Global NumPy random state is reseeded for each session, with a seed derived
+from (seed, group_key, session), so that sessions running concurrently do not
+draw the same random numbers (forked workers inherit the state of the parent),
+and draws do not depend on the number of workers.
+
+Classes:
+    SessionScheduler:
+        Runs a function for all (group, session) pairs using a pool of workers.
+
+Usage:
+    scheduler = SessionScheduler(num_workers=40)
+    scheduler.run(groups, make_assembler, fit_session, save_result)
+"""
+
+import os
+import time
+import zlib
+import numpy as np
+import traceback
+import multiprocessing as mp
+
+import logging
+logger = logging.getLogger(__name__)
+
+# state of the current group, set in parent before forking the workers.
+_group_state = {}
+
+
+class SessionScheduler:
+    def __init__(self, num_workers=1, threads_per_worker=None, seed=0):
+        """
+        Args:
+            num_workers: int = number of worker processes, sessions are run
+                serially in the parent process if 1. Default=1.
+            threads_per_worker: int = limit on BLAS threads for each worker,
+                if None, cpu_count // num_workers (at least 1).
+            seed: int = root seed of np.random, reseeded for each session.
+        """
+        if num_workers > 1 and 'fork' not in mp.get_all_start_methods():
+            logger.warning(f"'fork' start method not available, running sessions serially.")
+            num_workers = 1
+        self.num_workers = num_workers
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+        self.threads_per_worker = threads_per_worker
+        self.seed = int(seed)
+
+    def run(self, groups, make_assembler, session_fn, on_result):
+        """Runs session_fn for all sessions of all groups.
+
+        Args:
+            groups: list = list of (group_key, sessions) tuples,
+                e.g. ((bin_width, layer_id), ['200206', '191113'])
+            make_assembler: callable = make_assembler(group_key) returns data assembler
+                for the group, called in the parent process.
+            session_fn: callable = session_fn(assembler, group_key, session) fits the model
+                for the session and returns the results, called in the worker process.
+            on_result: callable = on_result(group_key, session, result) called in
+                the parent process for each finished session, e.g. to write results.
+
+        Returns:
+            list = list of (group_key, session) that failed.
+        """
+        failed = []
+        for group_key, sessions in groups:
+            if len(sessions) == 0:
+                continue
+            logger.info(f"Running {len(sessions)} sessions for {group_key} using {self.num_workers} worker(s).")
+            assembler = make_assembler(group_key)
+            _group_state.update(
+                assembler=assembler, group_key=group_key, session_fn=session_fn,
+                seed=self.seed,
+                )
+            start = time.time()
+            if self.num_workers == 1:
+                outputs = map(_run_session, sessions)
+                failed += self._collect(group_key, outputs, on_result)
+            else:
+                ctx = mp.get_context('fork')
+                num_workers = min(self.num_workers, len(sessions))
+                with ctx.Pool(
+                        num_workers, initializer=_init_worker,
+                        initargs=(self.threads_per_worker,)
+                    ) as pool:
+                    outputs = pool.imap_unordered(_run_session, sessions)
+                    failed += self._collect(group_key, outputs, on_result)
+            logger.info(f"Finished sessions for {group_key} in {(time.time()-start)/60:.1f} min.")
+            _group_state.clear()
+            del assembler
+        if len(failed) > 0:
+            logger.warning(f"Failed sessions: {failed}")
+        return failed
+
+    @staticmethod
+    def _collect(group_key, outputs, on_result):
+        """Passes results of finished sessions to on_result,
+        returns list of failed sessions."""
+        failed = []
+        for session, result, error in outputs:
+            if error is not None:
+                logger.error(f"Session '{session}' of {group_key} failed:\n{error}")
+                failed.append((group_key, session))
+                continue
+            on_result(group_key, session, result)
+        return failed
+
+
+def _init_worker(threads_per_worker):
+    """Limits BLAS threads of the worker and uses NumPy backend,
+    (CUDA context of the parent can not be used in forked processes)."""
+    os.environ['AC_ARRAY_BACKEND'] = 'numpy'
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(threads_per_worker)
+    except ImportError:
+        pass
+
+def _session_seed(seed, group_key, session):
+    """Returns seed of np.random for the session, depends only on
+    root seed, group key and session."""
+    key = zlib.crc32(f"{group_key}-{session}".encode())
+    return np.random.SeedSequence(seed, spawn_key=(key,)).generate_state(1)[0]
+
+def _run_session(session):
+    """Runs session_fn of the current group for the session."""
+    try:
+        np.random.seed(_session_seed(_group_state['seed'], _group_state['group_key'], session))
+        result = _group_state['session_fn'](
+            _group_state['assembler'], _group_state['group_key'], session
+            )
+        return session, result, None
+    except Exception:
+        return session, None, traceback.format_exc()
@@ -5,13 +5,13 @@ import torch
 import torchaudio
 import torch.nn as nn
 import numpy as np
-import cupy as cp
 import pandas as pd
 import matplotlib.pylab as plt
 
 # local
 # from auditory_cortex import session_to_coordinates#, #CMAP_2D
 from auditory_cortex import aux_dir, saved_corr_dir
+from auditory_cortex import array_backend
 
 import sys
 import logging
@@ -541,23 +541,22 @@ def poiss_regression(x_train, y_train):
 #     return data
 
 def write_to_disk(corr_dict, file_path):
-    """Takes in the 'corr' dict and stores the results
-    at the 'file_path', (concatenates if file already exists)
+    """Takes in the 'corr' dict and appends the results to the
+    store of the 'file_path' (see io_utils.results_store), cost of
+    each write depends only on the rows appended.
     
     Args:
         corr_dict (dict): 
         file_path: path of csv file to write results to.
+
+    Returns:
+        pd.DataFrame = rows appended.
     """
-    columns= list(corr_dict.keys())
+    from auditory_cortex.io_utils.results_store import ResultsStore
     df = pd.DataFrame(corr_dict)
-    if os.path.isfile(file_path):
-        data = pd.read_csv(file_path)[columns]
-        data = pd.concat([data,df], axis=0, ignore_index=True)
-    else:
-        data = df
-    data.to_csv(file_path, index=False)
+    ResultsStore(file_path).append(df)
     logger.info(f"Data saved to: '{file_path}'")
-    return data
+    return df
 
 
 # def write_to_disk(corr_dict, file_path, normalizer=None):
@@ -633,6 +632,32 @@ def write_to_disk(corr_dict, file_path):
 #     bin-width: {win}ms, delay: {delay}ms at file: '{file_path}'")
 #     return data
 
+def pearson_corr(y, y_hat, axis=0):
+    """Computes correlations along the time axis for all the other dims
+    (e.g. trials, channels, repeats) in one pass, arrays are broadcast
+    against each other. Same formula as cc_single_channel, i.e.
+    cov (N-1) / (sqrt(var(y)*var(y_hat)) + 1e-8), runs on the array
+    module (numpy or cupy) of y.
+
+    Args:
+        y (ndarray): (..., n_samples, ...) actual spikes.
+        y_hat (ndarray): (..., n_samples, ...) predictions, broadcastable to y.
+        axis (int): time axis of y and y_hat.
+
+    Returns:
+        ndarray: correlations, broadcast shape without the time axis. Channels with
+            zero variance (of y or y_hat) get 0.
+    """
+    module = array_backend.get_array_module(y)
+    n_samples = y.shape[axis]
+    y = y - module.mean(y, axis=axis, keepdims=True)
+    y_hat = y_hat - module.mean(y_hat, axis=axis, keepdims=True)
+    cov = module.sum(y*y_hat, axis=axis) / (n_samples - 1)
+    var_y = module.sum(y*y, axis=axis) / n_samples
+    var_y_hat = module.sum(y_hat*y_hat, axis=axis) / n_samples
+    corr = cov / (module.sqrt(var_y*var_y_hat) + 1.0e-8)
+    return module.where((var_y > 0) & (var_y_hat > 0), corr, 0.0)
+
 def cc_norm(y, y_hat, sp=1, normalize=False):
     """
     Args:   
@@ -642,28 +667,15 @@ def cc_norm(y, y_hat, sp=1, normalize=False):
     """
     #check if incoming array is np or cp,
     #and decide which module to use...!
-    if type(y).__module__ == np.__name__:
-        module = np
-        cupy_return = False
-    else:
-        cupy_return = True
-        module = cp
-    # if 'normalize' = True, use signal power as factor otherwise use normalize CC formula i.e. 'un-normalized'
-    try:
-        n_channels = y.shape[1]
-    except:
-        n_channels=1
+    module = array_backend.get_array_module(y)
+    if y.ndim == 1:
         y = module.expand_dims(y,axis=1)
         y_hat = module.expand_dims(y_hat,axis=1)
-        
-    corr_coeff = module.zeros(y_hat.shape[1:])
-    for ch in range(n_channels):
-        corr_coeff[ch] = cc_single_channel(y[:,ch],y_hat[:,ch])
-
-    if cupy_return:
-        return cp.asnumpy(corr_coeff)
-    else:
-        return corr_coeff
+    if y_hat.ndim == y.ndim + 1:
+        # same spikes for all repeats..
+        y = module.expand_dims(y,axis=-1)
+    corr_coeff = pearson_corr(y, y_hat, axis=0)
+    return array_backend.to_numpy(corr_coeff)
     
 # def compute_avg_test_corr(y_all_trials, y_pred, test_trial=None, mVocs=False):
 # 	"""Computes correlation for each trial and averages across all trials.
@@ -674,29 +686,38 @@ def cc_norm(y, y_hat, sp=1, normalize=False):
 # 		tr: int = integer in range=[0, 11], Default=None.
 
 # 	"""
-def compute_avg_test_corr(y_all_trials, y_pred, n_test_trials=None):
+def compute_avg_test_corr(y_all_trials, y_pred, n_test_trials=None, backend=None):
     """Computes correlation for each trial and averages across all trials.
+    Correlations of all trials are computed in one pass, bootstrapped trials
+    are then gathered by index.
     
     Args:
-        y_all_trials: (num_trials, num_bins)
-        y_pred: (num_bins,)
+        y_all_trials: (num_trials, num_bins) or (num_trials, num_bins, num_channels)
+        y_pred: (num_bins,) or (num_bins, num_channels)
         n_test_trials: int = number of trials to be tested on.
             Choices=[0, num_repeats], If None, test on all trial    
             repeats. Default=None
+        backend: str = array backend ('numpy' or 'cupy') to compute on,
+            if None, array module of the inputs is used.
 
     Returns:
         trial_corr: ndarray = (num_channels,) correlation values averaged across trials.
     """
-    trial_corr = []
     total_trial_repeats = y_all_trials.shape[0]
     if n_test_trials is None:
         trial_ids = np.arange(total_trial_repeats)
     else:
         trial_ids = np.random.choice(total_trial_repeats, size=n_test_trials, replace=True) # with replacement for bootstrapping
-    for tr in trial_ids:
-        trial_corr.append(cc_norm(y_all_trials[tr], y_pred))
-    trial_corr = np.stack(trial_corr, axis=0)
-    trial_corr = np.mean(trial_corr, axis=0)
+    if backend is not None:
+        module = array_backend.get_backend(backend)
+        y_all_trials = array_backend.to_device(y_all_trials, module)
+        y_pred = array_backend.to_device(y_pred, module)
+    if y_pred.ndim == 1:
+        y_all_trials = y_all_trials[..., None]
+        y_pred = y_pred[:, None]
+    # (num_trials, num_channels)..
+    trial_corr = array_backend.to_numpy(pearson_corr(y_all_trials, y_pred[None], axis=1))
+    trial_corr = np.mean(trial_corr[trial_ids], axis=0)
     return trial_corr
 
 # def cc_norm_cp(y, y_hat, sp=1, normalize=False):
@@ -749,10 +770,7 @@ def cc_single_channel(y, y_hat):
     """
     #check if incoming array is np or cp,
     #and decide which module to use...!
-    if type(y).__module__ == np.__name__:
-        module = np
-    else:
-        module = cp
+    module = array_backend.get_array_module(y)
     try:
         y_hat = module.transpose(y_hat,(1,0))
     except:
@@ -788,10 +806,7 @@ def reg(X,y, lmbda=0):
 
     #check if incoming array is np or cp,
     #and decide which module to use...!
-    if type(X).__module__ == np.__name__:
-        module = np
-    else:
-        module = cp
+    module = array_backend.get_array_module(X)
     
     if X.ndim ==2:
         X = module.expand_dims(X,axis=0)
@@ -799,7 +814,7 @@ def reg(X,y, lmbda=0):
     m = X.shape[1]
     # X_t = X.transpose((0,2,1))
 
-    return module.linalg.solve(
+    return array_backend.solve_pos(
         module.matmul(X.transpose((0,2,1)), X) + m*lmbda*module.eye(d),
         module.matmul(X.transpose((0,2,1)), y)
         ).squeeze()
@@ -842,10 +857,7 @@ def predict(X, B):
 
     #check if incoming array is np or cp,
     #and decide which module to use...!
-    if type(X).__module__ == np.__name__:
-        module = np
-    else:
-        module = cp
+    module = array_backend.get_array_module(X)
     pred = module.matmul(X,B)
     if pred.ndim ==3:
         return pred.transpose(1,2,0) 
@@ -880,11 +892,11 @@ def train_test_split(x,y, split=0.7):
 
 
 def mse_loss(y, y_hat):
-    module = np
+    module = array_backend.get_array_module(y_hat)
     if y.ndim < y_hat.ndim:
         y = module.expand_dims(y, axis=-1)
     loss = (module.sum((y - y_hat)**2, axis=0))/y_hat.shape[0]
-    return cp.asnumpy(loss)
+    return array_backend.to_numpy(loss)
 
 # def mse_loss_cp(y, y_hat):
 #     if y.ndim < y_hat.ndim:
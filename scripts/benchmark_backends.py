@@ -0,0 +1,155 @@
+"""
+This script benchmarks the array backends (numpy and cupy)
+used by the encoding models, on a synthetic problem of
+the size of a typical session. It times fitting and prediction
+of LinearModel (single lmbda) and RidgePath (path of lmbdas used
+for cross-validation) and checks that the backends agree.
+
+Args:
+    n_samples: int, default=25000, -n
+    n_features: int, default=768, -f
+    n_lags: int, default=5, -k
+    n_channels: int, default=64, -c
+    n_lmbdas: int, default=21, --lmbdas
+    repeats: int, default=3, -r
+    backends: list of str, default=None (all available), --backends
+
+Example usage:
+    python benchmark_backends.py -n 25000 -f 768 -k 5 -c 64
+"""
+# ------------------  set up logging ----------------------
+import logging
+from auditory_cortex.utils import set_up_logging
+set_up_logging()
+
+import time
+import argparse
+import numpy as np
+
+# local
+from auditory_cortex import array_backend
+from auditory_cortex.encoding import LinearModel, RidgePath
+
+
+def synchronize(xp):
+    """Waits for the queued GPU kernels to finish, for fair timings."""
+    if xp is not np:
+        xp.cuda.Stream.null.synchronize()
+
+def time_it(fn, xp, repeats):
+    """Returns the best of 'repeats' wall times (in seconds) of calling fn."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        synchronize(xp)
+        times.append(time.perf_counter() - start)
+    return min(times), out
+
+def benchmark_backends(args):
+
+    backends = args.backends
+    if backends is None:
+        backends = ['numpy', 'cupy'] if array_backend.gpu_available() else ['numpy']
+
+    rng = np.random.default_rng(0)
+    n_dims = args.n_features*args.n_lags
+    X = rng.standard_normal((args.n_samples, n_dims)).astype(np.float32)
+    W = rng.standard_normal((n_dims, args.n_channels)).astype(np.float32)/np.sqrt(n_dims)
+    y = X @ W + rng.standard_normal((args.n_samples, args.n_channels)).astype(np.float32)
+    lmbdas = np.logspace(-5, 15, args.n_lmbdas)
+    logging.info(f"Synthetic problem: X={X.shape}, y={y.shape}, n_lmbdas={len(lmbdas)}")
+
+    results = {}
+    for backend in backends:
+        xp = array_backend.get_backend(backend)
+        # warm up (cuda context, kernel compilation)..
+        LinearModel(alpha=1.0, backend=backend).fit(X[:1000], y[:1000])
+
+        model = LinearModel(alpha=1.0, backend=backend)
+        fit_time, _ = time_it(lambda: model.fit(X, y), xp, args.repeats)
+        pred_time, pred = time_it(lambda: model.predict(X), xp, args.repeats)
+
+        path = RidgePath(lmbdas, backend=backend)
+        path_fit_time, _ = time_it(lambda: path.fit(X, y), xp, args.repeats)
+        path_pred_time, _ = time_it(lambda: path.predict(X), xp, args.repeats)
+
+        results[backend] = pred
+        logging.info(
+            f"{backend:6}: LinearModel fit {fit_time:.3f}s, predict {pred_time:.3f}s | "
+            f"RidgePath fit {path_fit_time:.3f}s, predict (all lmbdas) {path_pred_time:.3f}s"
+            )
+
+    if len(results) > 1:
+        preds = list(results.values())
+        max_diff = np.max(np.abs(preds[0] - preds[1]))
+        logging.info(f"Max abs difference of predictions across backends: {max_diff:.2e}")
+
+
+
+# ------------------  get parser ----------------------#
+
+def get_parser():
+    # create an instance of argument parser
+    parser = argparse.ArgumentParser(
+        description='This is to benchmark the numpy and cupy backends of the '+
+            'encoding models on a synthetic session-sized problem.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+
+    # add arguments to read from command line
+    parser.add_argument(
+        '-n','--n_samples', dest='n_samples', type=int, action='store',
+        default=25000,
+        help="Number of time samples (bins) of the training data."
+    )
+    parser.add_argument(
+        '-f','--n_features', dest='n_features', type=int, action='store',
+        default=768,
+        help="Number of features of the layer."
+    )
+    parser.add_argument(
+        '-k','--n_lags', dest='n_lags', type=int, action='store',
+        default=5,
+        help="Number of time delays (lags) of the TRF."
+    )
+    parser.add_argument(
+        '-c','--n_channels', dest='n_channels', type=int, action='store',
+        default=64,
+        help="Number of neural channels (targets)."
+    )
+    parser.add_argument(
+        '--lmbdas', dest='n_lmbdas', type=int, action='store',
+        default=21,
+        help="Number of regularization parameters on the path."
+    )
+    parser.add_argument(
+        '-r','--repeats', dest='repeats', type=int, action='store',
+        default=3,
+        help="Number of repeats, best time is reported."
+    )
+    parser.add_argument(
+        '--backends', dest='backends', nargs='+', type=str, action='store',
+        choices=array_backend.VALID_BACKENDS, default=None,
+        help="Backends to benchmark, all available if not specified."
+    )
+    return parser
+
+
+
+
+# ------------------  main function ----------------------#
+
+if __name__ == '__main__':
+
+    start_time = time.time()
+    parser = get_parser()
+    args = parser.parse_args()
+
+    # display the arguments passed
+    for arg in vars(args):
+        logging.info(f"{arg:15} : {getattr(args, arg)}")
+
+    benchmark_backends(args)
+    elapsed_time = time.time() - start_time
+    logging.info(f"It took {elapsed_time/60:.1f} min. to run.")
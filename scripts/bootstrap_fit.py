@@ -27,6 +27,8 @@ Args:
         duration of train/test stimuli to be used for training/evaluation.
         if test_bootstrap is True, this is the percent of the test set duration to be used.
         otherwise used for percent of training set duration to be used.
+    num_workers: int, default=1, -n
+    threads_per_worker: int, default=None, --threads_per_worker
 
 
 Usage examples:
@@ -40,7 +42,6 @@ from auditory_cortex.utils import set_up_logging
 set_up_logging()
 
 import os
-import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 import time
@@ -59,15 +60,28 @@ from auditory_cortex import valid_model_names
 # from auditory_cortex.datasets import BaselineDataset, DNNDataset
 # from auditory_cortex.computational_models.encoding import TRF
 
-from auditory_cortex.io_utils import ResultsManager
+from auditory_cortex.io_utils import ResultsManager, ResultsStore
 from auditory_cortex.neural_data import create_neural_dataset, create_neural_metadata
 from auditory_cortex.dnn_feature_extractor import create_feature_extractor
 from auditory_cortex.data_assembler import STRFDataAssembler, DNNDataAssembler
 from auditory_cortex.encoding import TRF
+from auditory_cortex.scheduler import SessionScheduler
 
+# arguments of the run, shared with the (forked) workers
+_run_args = None
+
+# fixed parameters of the run, (used for results file, data assembler and fit)..
+TMIN = 0
+NUM_FOLDS = 3
+LPF = False
+LPF_ANALYSIS_BW = 20
+SHUFFLED = False
+LAG = 200
 
 def compute_and_save_regression(args):
 
+    global _run_args
+    _run_args = args
     # bin_widths = config['bin_widths']
     bin_widths = args.bin_widths
     model_name = args.model_name
@@ -83,20 +97,9 @@ def compute_and_save_regression(args):
     n_test_trials = args.n_test_trials
     dataset_name = args.dataset_name
     # itr = args.itr
-    # fixed parameters..
-    
-    tmin=0
-    delay=0
-    # N_sents=500
-    # num_workers=16
-    num_folds=3
-    LPF=False
-    LPF_analysis_bw = 20
-    shuffled = False
-    # LPF_analysis_bw = 10
-    
-    lag=200
-    # use_nonlinearity=False
+    # fixed parameters (module constants, shared with fit_session)..
+    shuffled = SHUFFLED
+    lag = LAG
 
     results_identifier = ResultsManager.get_run_id(
             dataset_name, bin_widths[0], identifier, mVocs=mVocs, shuffled=shuffled, lag=lag,
@@ -107,11 +110,8 @@ def compute_and_save_regression(args):
 
 
     # CSV file to save the results at
-    file_exists = False
     file_path = os.path.join(saved_corr_dir, csv_file_name)
-    if os.path.exists(file_path):
-        data = pd.read_csv(file_path)
-        file_exists = True
+    results_store = ResultsStore(file_path)
 
     if shuffled:
         logging.info(f"Running TRF for 'Untrained' networks...")
@@ -131,118 +131,119 @@ def compute_and_save_regression(args):
                 ])
     elif dataset_name == 'ucdavis':
         sessions = metadata.get_all_available_sessions()
+    if mVocs:
+        excluded_sessions = ['190726', '200213']
+        logging.info(f"Excluding sessions: {excluded_sessions}")
+        sessions = np.asarray(sessions)
+        sessions = sessions[np.isin(sessions, excluded_sessions, invert=True)]
+
+    groups = []
     for bin_width in bin_widths:
         # Session in data_dir that we do not have results for...
-        if file_exists:
-            sessions_done = data[
-                    (data['delay']==delay) & \
-                    (data['bin_width']==bin_width) 
-                ]['session'].unique()
-
-            subjects = sessions[np.isin(sessions,sessions_done.astype(int).astype(str), invert=True)]
-        else:
-            subjects = sessions
+        sessions_done = results_store.sessions_done(bin_width, layers=[layer_ID])
+        subjects = sessions[np.isin(sessions,sessions_done.astype(int).astype(str), invert=True)]
 
         if len(subjects) == 0:
             logging.info(f"All sessions already done for bin_width: {bin_width}.")
             continue
 
+        groups.append(((bin_width, layer_ID), list(subjects)))
+
+    def make_assembler(group_key):
+        # features are loaded once, and shared by all sessions (workers)..
+        bin_width, layer_ID = group_key
         neural_dataset = create_neural_dataset(dataset_name)
-        data_assembler = DNNDataAssembler(
+        return DNNDataAssembler(
                 neural_dataset, feature_extractor, layer_ID, bin_width=bin_width, mVocs=mVocs,
-                LPF=LPF, LPF_analysis_bw=LPF_analysis_bw
+                LPF=LPF, LPF_analysis_bw=LPF_ANALYSIS_BW
                 )
-        
-        for session in subjects:
-            logging.info(f"Working with '{session}'")
-            
-            if mVocs:
-                excluded_sessions = ['190726', '200213']
-                if session in excluded_sessions:
-                    print(f"Excluding session: {session}")
-                    continue
-            
-            if session != data_assembler.get_session_id():
-                # no need to read features again...just reach spikes..
-                dataset_obj = create_neural_dataset(dataset_name, session)
-                data_assembler.read_session_spikes(dataset_obj)
-            
-
-            trf_obj = TRF(model_name, data_assembler)
-            if test_bootstrap:
-                trf_model = trf_obj.load_saved_model(
-                    model_name, session, layer_ID, bin_width, shuffled=shuffled, dataset_name=dataset_name,
-                    mVocs=mVocs, tmax=lag, LPF=LPF,
-                    )
-                if trf_model is None:
-                    corr, opt_lmbda, trf_model = trf_obj.grid_search_CV(
-                        lag=lag, tmin=tmin, num_folds=num_folds,
-                    )
-                    trf_obj.save_model_parameters(
-                        trf_model, model_name, layer_ID, session, bin_width, shuffled=shuffled,
-                        LPF=LPF, mVocs=mVocs, dataset_name=dataset_name, tmax=lag
-                    )
-                corr = trf_obj.evaluate(
-                    trf_model, n_test_trials=n_test_trials, percent_duration=percent_duration
-                    )
-                # opt_lag = [0]*corr.size
-                opt_lmbda = [1]*corr.size
-            else:
-                corr, opt_lmbda, trf_model = trf_obj.grid_search_CV(
-                        lag=lag, tmin=tmin, num_folds=num_folds,
-                        percent_duration=percent_duration,
-                    )
-            if mVocs:
-                mVocs_corr = corr
-                timit_corr = np.zeros_like(corr)
-            else:
-                mVocs_corr = np.zeros_like(corr)
-                timit_corr = corr
-
-            channel_ids = data_assembler.channel_ids
-            num_channels = len(channel_ids)
-            corr_dict = {
-                'session': num_channels*[session],
-                'layer': num_channels*[layer_ID],
-                'channel': channel_ids,
-                'bin_width': num_channels*[bin_width],
-                'percent_duration': num_channels*[percent_duration],
-                'test_cc_raw': timit_corr.squeeze(),
-                'normalizer': num_channels*[0.0],  # placeholder for normalizer
-                'mVocs_test_cc_raw': mVocs_corr.squeeze(),
-                'mVocs_normalizer': num_channels*[0.0],  # placeholder for mVocs normalizer
-                'opt_lag': num_channels*[lag],
-                'opt_lmbda': np.log10(opt_lmbda).squeeze(),
-                'n_test_trials': num_channels*[n_test_trials],
-                }
-            
-            df = utils.write_to_disk(corr_dict, file_path)
-
-
-            # corr_dict = {
-            #     'test_cc_raw': timit_corr[None,...],
-            #     'mVocs_test_cc_raw': mVocs_corr[None,...],
-            #     'win': bin_width,
-            #     'delay': delay, 
-            #     'session': session,
-            #     'model': model_name,
-            #     'N_sents': N_sents,
-            #     'layer_ids': [layer_ID],
-            #     'opt_lag': opt_lag,
-            #     'opt_lmbda': np.log10(opt_lmbda),
-            #     'poiss_entropy': np.zeros_like(corr[None,...]),
-            #     'uncertainty_per_spike': np.zeros_like(corr[None,...]),
-            #     'bits_per_spike_NLB': np.zeros_like(corr[None,...]),
-            #     }
-
-            # df = utils.write_to_disk(corr_dict, file_path, normalizer=None)
-
-            # make sure to delete the objects to free up memory
-            # del dataset
-            del trf_model
-            del trf_obj
+
+    def save_result(group_key, session, corr_dict):
+        # only the parent process writes to the results file..
+        utils.write_to_disk(corr_dict, file_path)
+
+    scheduler = SessionScheduler(
+        num_workers=args.num_workers, threads_per_worker=args.threads_per_worker
+        )
+    scheduler.run(groups, make_assembler, fit_session, save_result)
+
+
+def fit_session(data_assembler, group_key, session):
+    """Fits (or evaluates) TRF for the session, runs in worker process.
+    Features of the data assembler are shared by all sessions."""
+    bin_width, layer_ID = group_key
+    args = _run_args
+    model_name = args.model_name
+    dataset_name = args.dataset_name
+    mVocs = args.mVocs
+    percent_duration = args.percent_duration
+    n_test_trials = args.n_test_trials
+    # fixed parameters (module constants, shared with compute_and_save_regression)..
+    tmin = TMIN
+    num_folds = NUM_FOLDS
+    shuffled = SHUFFLED
+    lag = LAG
+
+    logging.info(f"Working with '{session}'")
+    if session != data_assembler.get_session_id():
+        # no need to read features again...just reach spikes..
+        dataset_obj = create_neural_dataset(dataset_name, session)
+        data_assembler.read_session_spikes(dataset_obj)
     
-            gc.collect()
+
+    trf_obj = TRF(model_name, data_assembler)
+    if args.test_bootstrap:
+        trf_model = trf_obj.load_saved_model(
+            model_name, session, layer_ID, bin_width, shuffled=shuffled, dataset_name=dataset_name,
+            mVocs=mVocs, tmax=lag, LPF=LPF,
+            )
+        if trf_model is None:
+            corr, opt_lmbda, trf_model = trf_obj.grid_search_CV(
+                lag=lag, tmin=tmin, num_folds=num_folds,
+            )
+            trf_obj.save_model_parameters(
+                trf_model, model_name, layer_ID, session, bin_width, shuffled=shuffled,
+                LPF=LPF, mVocs=mVocs, dataset_name=dataset_name, tmax=lag
+            )
+        corr = trf_obj.evaluate(
+            trf_model, n_test_trials=n_test_trials, percent_duration=percent_duration
+            )
+        # opt_lag = [0]*corr.size
+        opt_lmbda = [1]*corr.size
+    else:
+        corr, opt_lmbda, trf_model = trf_obj.grid_search_CV(
+                lag=lag, tmin=tmin, num_folds=num_folds,
+                percent_duration=percent_duration,
+            )
+    if mVocs:
+        mVocs_corr = corr
+        timit_corr = np.zeros_like(corr)
+    else:
+        mVocs_corr = np.zeros_like(corr)
+        timit_corr = corr
+
+    channel_ids = data_assembler.channel_ids
+    num_channels = len(channel_ids)
+    corr_dict = {
+        'session': num_channels*[session],
+        'layer': num_channels*[layer_ID],
+        'channel': channel_ids,
+        'bin_width': num_channels*[bin_width],
+        'percent_duration': num_channels*[percent_duration],
+        'test_cc_raw': timit_corr.squeeze(),
+        'normalizer': num_channels*[0.0],  # placeholder for normalizer
+        'mVocs_test_cc_raw': mVocs_corr.squeeze(),
+        'mVocs_normalizer': num_channels*[0.0],  # placeholder for mVocs normalizer
+        'opt_lag': num_channels*[lag],
+        'opt_lmbda': np.log10(opt_lmbda).squeeze(),
+        'n_test_trials': num_channels*[n_test_trials],
+        }
+
+    # make sure to delete the objects to free up memory
+    del trf_model
+    del trf_obj
+    gc.collect()
+    return corr_dict
 
 
 
@@ -317,6 +318,16 @@ def get_parser():
         choices=[10, 20, 30, 40, 50, 60, 70, 80, 90, 100],
         help="Specify the \%\ of total duration of train/test stimuli to be used for training/evaluation."
     )
+    parser.add_argument(
+        '-n','--num_workers', dest='num_workers', type=int, action='store', 
+        default=1,
+        help="Number of worker processes, sessions are run concurrently."
+    )
+    parser.add_argument(
+        '--threads_per_worker', dest='threads_per_worker', type=int, action='store', 
+        default=None,
+        help="BLAS threads for each worker, default divides cores among workers."
+    )
     return parser
 
 
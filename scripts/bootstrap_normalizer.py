@@ -8,9 +8,13 @@ Args:
     mVocs: bool, default=False, -v
     session_index: int, default=0, -s
     num_itr: int, default=100000, -n
+    num_workers: int, default=1, -w
+    chunk_size: int, default=10000, -c
+    seed: int, default=0
+    force_redo: bool, default=False, -f
     
 Example usage:
-    python bootstrap_normalizer.py -d ucsf -b 50 -s 3 -v -n 1000
+    python bootstrap_normalizer.py -d ucsf -b 50 -s 3 -v -n 1000 -w 8
 """
 
 import time
@@ -61,7 +65,9 @@ def save_normalizer_bootstrap_dist(args):
     norm_obj = NormalizerCalculator(dataset_name)
     norm_obj.save_bootstrapped_distributions(
         session, percent_durations, epoch_ids=epoch_ids, 
-        bin_width=bin_width, num_itr=num_itr, mVocs=mVocs
+        bin_width=bin_width, num_itr=num_itr, mVocs=mVocs,
+        num_workers=args.num_workers, chunk_size=args.chunk_size, seed=args.seed,
+        force_redo=args.force_redo,
         )
 
 
@@ -101,6 +107,25 @@ def get_parser():
         default=1000,
         help="Number of iterations for each distribution."
     )
+    parser.add_argument(
+        '-w','--num_workers', dest='num_workers', type=int, action='store', 
+        default=1,
+        help="Number of worker processes."
+    )
+    parser.add_argument(
+        '-c','--chunk_size', dest='chunk_size', type=int, action='store', 
+        default=10000,
+        help="Number of iterations in each chunk (checkpointed to disk)."
+    )
+    parser.add_argument(
+        '--seed', dest='seed', type=int, action='store', 
+        default=0,
+        help="Root seed of the random generators."
+    )
+    parser.add_argument(
+        '-f','--force_redo', dest='force_redo', action='store_true', default=False,
+        help="Recompute distributions already saved, (otherwise only missing ones are computed)."
+    )
 
     return parser
 
@@ -8,10 +8,19 @@ Args:
     shuffle: bool, -s
     mVocs: bool, -v
     factor: float, relevant for shuffled -f
+    convert: bool, re-write legacy (npz) cache in memory-mapped format, --convert
+    float16: bool, store features as float16, --float16
+    rebuild: bool, extract features of all stimuli, --rebuild
+
+Features are written one stimulus at a time, if interrupted, running 
+again resumes from the stimuli already written. Only stimuli missing from
+the cache, or whose audio or feature extractor changed, are extracted
+(unless --rebuild).
 
 Example usage:  
     python cache_features.py -d ucsf -i 3 -s -v
     python cache_features.py -d ucdavis -i 1 -s -v
+    python cache_features.py -d ucsf -m whisper_tiny --convert
 """
 # ------------------  set up logging ----------------------
 import logging
@@ -22,6 +31,7 @@ import time
 import argparse
 
 from auditory_cortex import valid_model_names
+from auditory_cortex.io_utils import io
 from auditory_cortex.dataloader import DataLoader
 from auditory_cortex.neural_data import create_neural_dataset
 from auditory_cortex.dnn_feature_extractor import create_feature_extractor
@@ -46,14 +56,31 @@ def cache_features(args):
     logging.info(f"model_name: {model_name}")
     # load the neural dataset
     dataset_obj = create_neural_dataset(dataset_name)
-    feature_extractor = create_feature_extractor(model_name, shuffled=shuffled)
 
+    dtype = 'float16' if args.float16 else None
+    if args.convert:
+        # re-write the cached features in memory-mapped format, without extracting again..
+        features = io.read_cached_features(
+            model_name, dataset_name=dataset_name, shuffled=shuffled, mVocs=mVocs,
+            )
+        if features is None:
+            logging.info(f"No cached features found to convert.")
+            return
+        io.write_cached_features(
+            model_name, features, dataset_name=dataset_name, shuffled=shuffled, mVocs=mVocs,
+            dtype=dtype,
+            )
+        logging.info(f"Done...!")
+        return
+    
+    feature_extractor = create_feature_extractor(model_name, shuffled=shuffled)
     dataloader = DataLoader(dataset_obj, feature_extractor)
     
 
     # load the features
     features = dataloader.get_raw_DNN_features(
-        mVocs=mVocs, force_reload=True, contextualized=False, scale_factor=factor
+        mVocs=mVocs, force_reload=True, contextualized=False, scale_factor=factor,
+        cache_dtype=dtype, rebuild=args.rebuild,
         )
 
 
@@ -110,6 +137,18 @@ def get_parser():
         '-f','--factor', dest='factor', type=float, action='store', default=1,
         help="Specify the scale factor."
     )
+    parser.add_argument(
+        '--convert', dest='convert', action='store_true', default=False,
+        help="Re-write legacy (npz) cached features in memory-mapped format."
+    )
+    parser.add_argument(
+        '--float16', dest='float16', action='store_true', default=False,
+        help="Store cached features as float16 (half the disk and memory)."
+    )
+    parser.add_argument(
+        '--rebuild', dest='rebuild', action='store_true', default=False,
+        help="Extract features of all stimuli, instead of missing or stale ones only."
+    )
 
     return parser
 
@@ -10,14 +10,22 @@ Args:
     start_ind: int, default=0, -s
     end_ind: int, default=45, -e
     force_redo: bool, default=False, -f
+    num_workers: int, default=1, -w
+    chunk_size: int, default=10000, -c
+    seed: int, default=0
     
+Iterations are run in chunks on 'num_workers' processes, each chunk is 
+checkpointed, so an interrupted run resumes from the finished chunks.
+Same seed gives same distributions, for any number of workers.
+
 Example usage:
-    python cache_norm_dists.py -d ucsf -b 50 -v -n 100000 -s 0 -e 45 
+    python cache_norm_dists.py -d ucsf -b 50 -v -n 100000 -s 0 -e 45 -w 8
 """
 # ------------------  imports ----------------------#
 import time
 import argparse
 from auditory_cortex.neural_data import NormalizerCalculator
+from auditory_cortex.neural_data.normalizer_executor import NormalizerExecutor
 from auditory_cortex.neural_data import create_neural_metadata
 from auditory_cortex import NEURAL_DATASETS
 
@@ -68,6 +76,21 @@ def get_parser():
         '-f','--force_redo', dest='force_redo', action='store_true', default=False,
         help="Specify if force redoing the distribution again.."
     )
+    parser.add_argument(
+        '-w','--num_workers', dest='num_workers', type=int, action='store', 
+        default=1,
+        help="Number of worker processes."
+    )
+    parser.add_argument(
+        '-c','--chunk_size', dest='chunk_size', type=int, action='store', 
+        default=10000,
+        help="Number of iterations in each chunk (checkpointed to disk)."
+    )
+    parser.add_argument(
+        '--seed', dest='seed', type=int, action='store', 
+        default=0,
+        help="Root seed of the random generators."
+    )
 
     return parser
 
@@ -85,18 +108,15 @@ def compute_and_save_normalizers(args):
     logging.info(f"Running for sessions starting at index-{args.start_ind}, ending before index-{args.end_ind}..")
     norm_obj = NormalizerCalculator(dataset_name)
     excluded_sessions = ['190726', '200213']
-    for session in sessions:
-            
-        if dataset_name=='ucsf' and mVocs and (session in excluded_sessions):
-            logging.info(f"Excluding session: {session}")
-            continue
-        else:
-            for bin_width in args.bin_widths:
-                bin_width = int(bin_width)
-                norm_dist, null_dist = norm_obj.get_inter_trial_corr_dists_for_session(
-                    session, bin_width=bin_width, mVocs=mVocs, num_itr=num_itr,
-                    force_redo=force_redo,
-                    )
+    if dataset_name=='ucsf' and mVocs:
+        logging.info(f"Excluding sessions: {[s for s in sessions if s in excluded_sessions]}")
+        sessions = [session for session in sessions if session not in excluded_sessions]
+
+    executor = NormalizerExecutor(
+        norm_obj, num_workers=args.num_workers, chunk_size=args.chunk_size, seed=args.seed
+        )
+    jobs = executor.session_jobs(sessions, args.bin_widths, num_itr, mVocs=mVocs)
+    executor.run(jobs, force_redo=force_redo)
                 
 # ------------------  main function ----------------------#
 
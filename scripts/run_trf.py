@@ -39,7 +39,7 @@ import gc
 # local
 from auditory_cortex import saved_corr_dir
 import auditory_cortex.utils as utils
-from auditory_cortex.io_utils import ResultsManager
+from auditory_cortex.io_utils import ResultsManager, results_exist, read_results
 from auditory_cortex.io_utils.io import write_lmbdas
 from auditory_cortex import valid_model_names
 
@@ -79,8 +79,8 @@ def compute_and_save_regression(args):
     # CSV file to save the results at
     file_exists = False
     file_path = os.path.join(saved_corr_dir, csv_file_name)
-    if os.path.exists(file_path):
-        data = pd.read_csv(file_path)
+    if results_exist(file_path):
+        data = read_results(file_path)
         file_exists = True
 
     if shuffled:
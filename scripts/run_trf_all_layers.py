@@ -14,15 +14,16 @@ Args:
     identifier: str, default='', -i
     mVocs: bool, default=False, -v
     shuffled: bool, default=False, -s
-    test_trial: int, default=None, -t
     LPF: bool, default=False, -L
     start_ind: int, default=0, --start
     end_ind: int, default=41, --end
     save_param: bool, default=False, --save_param
+    num_workers: int, default=1, -n
+    threads_per_worker: int, default=None, --threads_per_worker
 
 
 Example usage:
-    python run_trf_all_layers.py -d ucsf -m whisper_tiny -b 50 -l 0 -i plos_test -v -s 
+    python run_trf_all_layers.py -d ucsf -m whisper_tiny -b 50 -i plos_test -v -s -n 41
 """
 # ------------------  set up logging ----------------------
 import logging
@@ -30,7 +31,6 @@ from auditory_cortex.utils import set_up_logging
 set_up_logging()
 
 import os
-import pandas as pd
 import numpy as np
 import time
 import argparse
@@ -38,26 +38,71 @@ import gc
 
 # local
 from auditory_cortex import saved_corr_dir
-# from auditory_cortex import config
 import auditory_cortex.utils as utils
-# import auditory_cortex.models as models
-import auditory_cortex.io_utils.io as io
-from auditory_cortex.io_utils.io import write_lmbdas
 from auditory_cortex import valid_model_names
-# from auditory_cortex.neural_data import NeuralMetaData
-
-
-
+from auditory_cortex.io_utils import ResultsManager, ResultsStore
+from auditory_cortex.scheduler import SessionScheduler
 
 from auditory_cortex.neural_data import create_neural_dataset, create_neural_metadata
 from auditory_cortex.dnn_feature_extractor import create_feature_extractor
-from auditory_cortex.data_assembler import STRFDataAssembler, DNNDataAssembler, DNNAllLayerAssembler
+from auditory_cortex.data_assembler import DNNAllLayerAssembler
 from auditory_cortex.encoding import TRF
 
+# arguments of the run, shared with the (forked) workers
+_run_args = None
+
+
+
+def fit_session(data_assembler, group_key, session):
+    """Fits TRF for the session (runs in worker process), 
+    features of the data assembler are shared by all sessions."""
+    bin_width, layer_ids = group_key
+    args = _run_args
+    logging.info(f"Working with '{session}'")
+    if session != data_assembler.get_session_id():
+        # no need to read features again...just reach spikes..
+        dataset_obj = create_neural_dataset(args.dataset_name, session)
+        data_assembler.read_session_spikes(dataset_obj)
+
+    trf_obj = TRF(args.model_name, data_assembler)
+    corr, opt_lmbda, trf_model = trf_obj.grid_search_CV(
+            lag=args.lag, tmin=0, num_folds=3,
+        )
+        
+    if args.mVocs:
+        mVocs_corr = corr
+        timit_corr = np.zeros_like(corr)
+    else:
+        mVocs_corr = np.zeros_like(corr)
+        timit_corr = corr
+
+    channel_ids = data_assembler.channel_ids
+    num_channels = len(channel_ids)
+    corr_dict = {
+        'session': num_channels*[session],
+        'layer': num_channels*[0],     # all layers fitted together
+        'channel': channel_ids,
+        'bin_width': num_channels*[bin_width],
+        'delay': num_channels*[0],
+        'test_cc_raw': timit_corr.squeeze(),
+        'normalizer': num_channels*[0.0],  # placeholder for normalizer
+        'mVocs_test_cc_raw': mVocs_corr.squeeze(),
+        'mVocs_normalizer': num_channels*[0.0],  # placeholder for mVocs normalizer
+        'opt_lag': num_channels*[args.lag],
+        'opt_lmbda': np.log10(opt_lmbda).squeeze(),
+        'N_sents': num_channels*[500],
+        }
+    # make sure to delete the objects to free up memory
+    del trf_obj
+    del trf_model
+    gc.collect()
+    return corr_dict
 
 
 def compute_and_save_regression(args):
 
+    global _run_args
+    _run_args = args
     START = time.time()
     # bin_widths = config['bin_widths']
     bin_widths = args.bin_widths
@@ -65,33 +110,17 @@ def compute_and_save_regression(args):
     model_name = args.model_name
     layer_ids = args.layer_ids
     shuffled = args.shuffled
-    test_trial = args.test_trial
     identifier = args.identifier
     mVocs = args.mVocs
-    LPF = args.LPF
-    save_param = args.save_param
-    # fixed parameters..
     
-    tmin=0
-    delay=0
-    N_sents=500
-    num_workers=16
-    num_folds=3
-    LPF_analysis_bw = 20   
-    
-    lags=[args.lag]
-    
-    full_id = utils.get_run_id(
-        dataset_name, bin_widths[0], identifier, mVocs=mVocs, shuffled=shuffled, lag=lags[0],
+    full_id = ResultsManager.get_run_id(
+        dataset_name, bin_widths[0], identifier, mVocs=mVocs, shuffled=shuffled, lag=args.lag,
     )
     csv_file_name = model_name+'_'+full_id+'_'+'corr_results.csv'
 
     # CSV file to save the results at
-    file_exists = False
     file_path = os.path.join(saved_corr_dir, csv_file_name)
-    if os.path.exists(file_path):
-        data = pd.read_csv(file_path)
-        file_exists = True
+    results_store = ResultsStore(file_path)
 
     if shuffled:
         logging.info(f"Running TRF for 'Untrained' networks...")
@@ -101,106 +130,41 @@ def compute_and_save_regression(args):
 
     feature_extractor = create_feature_extractor(model_name, shuffled=shuffled)
     metadata = create_neural_metadata(dataset_name)
-    # metadata = NeuralMetaData()
     sessions = metadata.get_all_available_sessions()
-    # ################################################################
-    # # list of significant sessions only...
-    # sig_sessions = np.array([180613., 180627., 180719., 180720., 180728., 180730., 180731.,
-    # 					180807., 180808., 180814., 190606., 191113., 191121., 191125.,
-    # 					191206., 191210., 200205., 200206., 200207., 200213., 200219.])
-
-    # sessions = sig_sessions.astype(int)
-    ###############################################################
     sessions = np.sort(sessions)
     sessions = sessions[args.start_ind:args.end_ind]
-    # sessions = sessions[:20]
-    # sessions = sessions[20:]
-    current_time = time.time()
-    elapsed_time = current_time - START
+    if mVocs:
+        excluded_sessions = ['190726', '200213']
+        logging.info(f"Excluding sessions: {excluded_sessions}")
+        sessions = sessions[np.isin(sessions, excluded_sessions, invert=True)]
 
+    groups = []
     for bin_width in bin_widths:
-        # sessions = np.array(['200206'])
-        # Session in data_dir that we do not have results for...
-        if file_exists:
-            sessions_done = data[
-                    (data['delay']==delay) & \
-                    (data['bin_width']==bin_width) 
-                ]['session'].unique()
-
-            subjects = sessions[np.isin(sessions,sessions_done.astype(int).astype(str), invert=True)]
-        else:
-            subjects = sessions
-
-        for session in subjects:
-            if mVocs:
-                excluded_sessions = ['190726', '200213']
-                if session in excluded_sessions:
-                    print(f"Excluding session: {session}")
-                    continue
-            logging.info(f"Working with '{session}'")
-
-            dataset_obj = create_neural_dataset(dataset_name, session)
-
-            # dataset = DNNDataAssembler(
-            #     dataset_obj, feature_extractor, layer_ID, bin_width=bin_width, mVocs=mVocs,
-            #     LPF=LPF, LPF_analysis_bw=LPF_analysis_bw
-            #     )
-            dataset = DNNAllLayerAssembler(
-            dataset_obj, feature_extractor, layer_ids=layer_ids, bin_width=bin_width, mVocs=mVocs,
+        # Session in data_dir that we do not have results for (all layers are saved as layer 0)...
+        sessions_done = results_store.sessions_done(bin_width)
+        subjects = sessions[np.isin(sessions,sessions_done.astype(int).astype(str), invert=True)]
+        if len(subjects) == 0:
+            logging.info(f"All sessions already done for bin_width: {bin_width}.")
+            continue
+        groups.append(((bin_width, layer_ids), list(subjects)))
+
+    def make_assembler(group_key):
+        # features are loaded once, and shared by all sessions (workers)..
+        bin_width, layer_ids = group_key
+        neural_dataset = create_neural_dataset(dataset_name)
+        return DNNAllLayerAssembler(
+            neural_dataset, feature_extractor, layer_ids=layer_ids, bin_width=bin_width, mVocs=mVocs,
+            LPF=args.LPF,
             )
-            
-
-            trf_obj = TRF(model_name, dataset)
-            
-            corr, opt_lag, opt_lmbda, trf_model = trf_obj.grid_search_CV(
-                    lags=lags, tmin=tmin,
-                    num_folds=num_folds,
-                    test_trial=test_trial
-                )
-            weights, biases = trf_model.coef_
-            # if save_param:
-            #     io.write_trf_parameters(
-            #         model_name, session, weights, bin_width=bin_width, 
-            #         shuffled=shuffled, layer_ID=layer_ID, LPF=LPF, mVocs=mVocs
-            #         )
-            #     io.write_trf_parameters(
-            #         model_name, session, biases, bin_width=bin_width, 
-            #         shuffled=shuffled, layer_ID=layer_ID, LPF=LPF, mVocs=mVocs,
-            #         bias=True
-            #         )
-                
-            if mVocs:
-                mVocs_corr = corr
-                timit_corr = np.zeros_like(corr)
-            else:
-                mVocs_corr = np.zeros_like(corr)
-                timit_corr = corr
-
-
-            corr_dict = {
-                'test_cc_raw': timit_corr[None,...],
-                'mVocs_test_cc_raw': mVocs_corr[None,...],
-                'win': bin_width,
-                'delay': delay, 
-                'session': session,
-                'model': model_name,
-                'N_sents': N_sents,
-                'layer_ids': [0],
-                'opt_lag': opt_lag,
-                'opt_lmbda': np.log10(opt_lmbda),
-                'poiss_entropy': np.zeros_like(corr[None,...]),
-                'uncertainty_per_spike': np.zeros_like(corr[None,...]),
-                'bits_per_spike_NLB': np.zeros_like(corr[None,...]),
-                }
-
-            df = utils.write_to_disk(corr_dict, file_path, normalizer=None)
-
-            # make sure to delete the objects to free up memory
-            del dataset
-            del trf_obj
-            del weights
-            del biases
-            gc.collect()
+
+    def save_result(group_key, session, corr_dict):
+        # only the parent process writes to the results file..
+        utils.write_to_disk(corr_dict, file_path)
+
+    scheduler = SessionScheduler(
+        num_workers=args.num_workers, threads_per_worker=args.threads_per_worker
+        )
+    scheduler.run(groups, make_assembler, fit_session, save_result)
 
     END = time.time()
     logging.info(f"Took {(END-START)/60:.2f} min., for bin_widths: '{bin_widths}'.")
@@ -261,11 +225,6 @@ def get_parser():
         '-L','--LPF', dest='LPF', action='store_true', default=False,
         help="Specify if features are to be low pass filtered."
     )
-    parser.add_argument(
-        '-t','--test_trial', dest='test_trial', type= int, action='store',
-        default=None,
-        help="trial to test on."
-    )
     parser.add_argument(
         '--start', dest='start_ind', type=int, action='store', 
         default=0,
@@ -281,7 +240,16 @@ def get_parser():
         '--save_param', dest='save_param', action='store_true', default=False,
         help="Specify if parameters to be saved."
     )
-
+    parser.add_argument(
+        '-n','--num_workers', dest='num_workers', type=int, action='store', 
+        default=1,
+        help="Number of worker processes, sessions are run concurrently."
+    )
+    parser.add_argument(
+        '--threads_per_worker', dest='threads_per_worker', type=int, action='store', 
+        default=None,
+        help="BLAS threads for each worker, default divides cores among workers."
+    )
 
     return parser
 
@@ -0,0 +1,114 @@
+"""
+This script serves cached features of a DNN model in shared memory, so that
+concurrent runs on the node (e.g. run_trf_all_layers.py for different bin widths
+or layers) attach to the same features instead of each loading its own copy.
+Features must be cached already (cache_features.py, and for resampled features
+a previous run at the bin width). Serves until interrupted (Ctrl-C or SIGTERM).
+
+Args:
+    dataset_name: str ['ucsf', 'ucdavis'], -d
+    model_name: str, -m
+    layers: list of int, default=None (all layers), -l
+    bin_widths: list of int, default=None (raw features only), -b
+    mVocs: bool, default=False, -v
+    shuffled: bool, default=False, -s
+    LPF: bool, default=False, -L
+    raw: bool, serve raw features as well as resampled, --raw
+
+Example usage:
+    python serve_features.py -d ucsf -m whisper_tiny -b 20 50 100 &
+    python run_trf_all_layers.py -d ucsf -m whisper_tiny -b 50 -i plos_test
+"""
+# ------------------  set up logging ----------------------
+import logging
+from auditory_cortex.utils import set_up_logging
+set_up_logging()
+
+import time
+import argparse
+
+from auditory_cortex import valid_model_names, config
+from auditory_cortex.feature_server import FeatureServer
+import auditory_cortex.utils as utils
+
+# ------------------  serve features function ----------------------
+
+def serve_features(args):
+
+    layer_ids = args.layer_ids
+    if layer_ids is None:
+        layer_ids = [layer['layer_id'] for layer in utils.load_dnn_config(model_name=args.model_name)['layers']]
+    with FeatureServer(
+            args.model_name, args.dataset_name, shuffled=args.shuffled, mVocs=args.mVocs
+        ) as server:
+        if args.bin_widths is None or args.raw:
+            server.publish(layer_ids=layer_ids)
+        for bin_width in args.bin_widths or []:
+            server.publish(
+                bin_width=bin_width, layer_ids=layer_ids, LPF=args.LPF, pad_time=config['pad_time'],
+                )
+        logging.info(f"Serving features, interrupt to stop...")
+        server.wait()
+    logging.info(f"Done...!")
+
+# ------------------  get parser ----------------------#
+
+def get_parser():
+    # create an instance of argument parser
+    parser = argparse.ArgumentParser(
+        description="This is to serve cached DNN features in shared memory, "+
+        "for concurrent runs on the node. ",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+        )
+    parser.add_argument(
+        '-d','--dataset_name', dest='dataset_name', type= str, action='store',
+        choices=['ucsf', 'ucdavis'], required=True,
+        help = "Name of neural data to be used."
+    )
+    parser.add_argument(
+        '-m', '--model_name', dest='model_name', action='store',
+        choices=valid_model_names, required=True,
+        help='model to serve features of.'
+    )
+    parser.add_argument(
+        '-l','--layers', dest='layer_ids', nargs='+', type=int, action='store', default=None,
+        help="Layer IDs to serve, all layers if not specified."
+    )
+    parser.add_argument(
+        '-b','--bin_widths', dest='bin_widths', nargs='+', type=int, action='store', default=None,
+        help="Bin widths (ms) of resampled features to serve."
+    )
+    parser.add_argument(
+        '-v','--mVocs', dest='mVocs', action='store_true', default=False,
+        help="Specify if serving features for mVocs."
+    )
+    parser.add_argument(
+        '-s','--shuffle', dest='shuffled', action='store_true', default=False,
+        help="Specify if shuffled network to be used."
+    )
+    parser.add_argument(
+        '-L','--LPF', dest='LPF', action='store_true', default=False,
+        help="Specify if serving low-pass filtered features."
+    )
+    parser.add_argument(
+        '--raw', dest='raw', action='store_true', default=False,
+        help="Serve raw features as well as resampled features."
+    )
+    return parser
+
+
+# ------------------  main function ----------------------#
+
+if __name__ == '__main__':
+
+    start_time = time.time()
+    parser = get_parser()
+    args = parser.parse_args()
+
+    # display the arguments passed
+    for arg in vars(args):
+        logging.info(f"{arg:15} : {getattr(args, arg)}")
+
+    serve_features(args)
+    elapsed_time = time.time() - start_time
+    logging.info(f"It took {elapsed_time/60:.1f} min. to run.")
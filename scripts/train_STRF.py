@@ -39,7 +39,7 @@ from auditory_cortex import utils, config, saved_corr_dir
 from auditory_cortex.neural_data import create_neural_dataset, create_neural_metadata
 from auditory_cortex.data_assembler import STRFDataAssembler
 from auditory_cortex.encoding import TRF
-from auditory_cortex.io_utils import ResultsManager
+from auditory_cortex.io_utils import ResultsManager, results_exist, read_results
 
 
 # ------------------  Baseline computing function ----------------------#
@@ -90,8 +90,8 @@ def compute_and_save_STRF_baseline(args):
     # CSV file to save the results at
     file_exists = False
     file_path = os.path.join(saved_corr_dir, csv_file_name)
-    if os.path.exists(file_path):
-        data = pd.read_csv(file_path)
+    if results_exist(file_path):
+        data = read_results(file_path)
         file_exists = True
 
     metadata = create_neural_metadata(dataset_name)
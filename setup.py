@@ -29,7 +29,10 @@ setuptools.setup(
         'matplotlib', 'pandas', 'omegaconf', 
         'memory-profiler',
         'sentencepiece', 'transformers',
-        'cupy', 'seaborn', 'plotly', 'naplib', 'scikit-learn',
+        'seaborn', 'plotly', 'naplib', 'scikit-learn',
         'torch>=2.0', 'torchaudio>=2.0',
     ],
+    extras_require={
+        'gpu': ['cupy'],
+    },
 )
\ No newline at end of file